@@ -0,0 +1,72 @@
+"""ベンチマーク共通のスタブ (ネットワークを使わない)。"""
+from __future__ import annotations
+import json
+from vrcfriendwatch.rate_limiter import RateLimiter
+
+
+class _Resp:
+    """requests.Response の代わり。json() は毎回デコードするので実物と同じく新しい文字列ができる。"""
+    ok, status_code, reason = True, 200, "OK"
+
+    def __init__(self, data, status_code: int = 200, headers: dict | None = None):
+        self.content = json.dumps(data).encode("utf-8")
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.headers = headers or {}
+
+    def json(self):
+        return json.loads(self.content)
+
+
+class StubFriendsHTTP:
+    """/auth/user/friends だけ返すスタブ。レコードはページごとに生成するので自身は定数メモリ。"""
+    def __init__(self, total: int):
+        self.total = total
+        self.calls = 0
+
+    def get(self, url, params=None, **kw):
+        self.calls += 1
+        offset, n = int(params["offset"]), int(params["n"])
+        offline = params["offline"] == "true"
+        # 半分をオフライン、半分をオンラインに割り振る
+        lo, hi = (0, self.total // 2) if offline else (self.total // 2, self.total)
+        start, end = lo + offset, min(lo + offset + n, hi)
+        return _Resp([make_friend(i, offline) for i in range(start, end)])
+
+
+def make_friend(i: int, offline: bool) -> dict:
+    return {
+        "id": f"usr_{i:08d}-0000-4000-8000-000000000000",
+        "displayName": f"friend{i}",
+        "bio": "x" * 200,
+        "currentAvatarImageUrl": f"https://api.vrchat.cloud/api/1/file/file_{i:08d}/1/file",
+        "currentAvatarThumbnailImageUrl": f"https://api.vrchat.cloud/api/1/image/file_{i:08d}/1/256",
+        "tags": ["system_trust_basic", "system_trust_known", "language_jpn"],
+        "developerType": "none",
+        "status": "active" if not offline else "offline",
+        "statusDescription": "",
+        "location": "offline" if offline else f"wrld_{i % 50:08d}-0000-4000-8000-000000000000:{i % 7}~region(jp)",
+        "last_platform": "standalonewindows",
+        "last_login": "2026-01-01T00:00:00.000Z",
+        "last_activity": "2026-01-01T00:00:00.000Z",
+    }
+
+
+class StubAPIHTTP(StubFriendsHTTP):
+    """friends に加えて /users/<id> と /worlds/<id> も返すスタブ。名前/ワールド解決の回数も数える。"""
+    def __init__(self, total: int = 0):
+        super().__init__(total)
+        self.lookups = {"users": 0, "worlds": 0}
+        # WSRunner (ポーリングのフォールバック) が枠を見るだけ。get では使わない
+        self.limiter = RateLimiter(capacity=10, refill_rate=1.0)
+
+    def get(self, url, params=None, **kw):
+        if "/users/" in url:
+            self.lookups["users"] += 1
+            uid = url.rsplit("/", 1)[1]
+            return _Resp({"id": uid, "displayName": "name-" + uid[4:12]})
+        if "/worlds/" in url:
+            self.lookups["worlds"] += 1
+            wid = url.rsplit("/", 1)[1]
+            return _Resp({"id": wid, "name": "World " + wid[5:13]})
+        return super().get(url, params=params, **kw)
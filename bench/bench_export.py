@@ -0,0 +1,81 @@
+"""
+フレンド一覧のストリーミング export のベンチマーク (ネットワーク不要)。
+
+    python bench/bench_export.py [--friends 10000]
+
+スタブの friends API (100 件/ページ) から JSONL / CSV に書き出し、
+スループットと Python ヒープのピーク (tracemalloc) を測る。
+比較用に旧方式 (生 dict の全件リスト ×2 を連結して dict 化) のピークも出す。
+"""
+from __future__ import annotations
+import argparse, os, sys, tempfile, time, tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from vrcfriendwatch.vrchat_api import VRChatAPI  # noqa: E402
+from vrcfriendwatch.export import write_friends  # noqa: E402
+from _stubs import StubFriendsHTTP  # noqa: E402
+
+
+def _measure(fn) -> tuple[float, int]:
+    tracemalloc.start()
+    t = time.perf_counter()
+    fn()
+    elapsed = time.perf_counter() - t
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return elapsed, peak
+
+
+def run(total: int) -> dict:
+    results: dict = {"friends": total}
+
+    def legacy():
+        api = VRChatAPI(StubFriendsHTTP(total))
+        all_friends = list(api.iter_friends(offline=True)) + list(api.iter_friends(offline=False))
+        by_id = {f["id"]: f for f in all_friends}
+        return list(by_id.values())
+
+    elapsed, peak = _measure(legacy)
+    results["legacy_list"] = {"seconds": round(elapsed, 4), "peak_bytes": peak}
+
+    for fmt in ("jsonl", "csv"):
+        fd, path = tempfile.mkstemp(suffix="." + fmt)
+        os.close(fd)
+        try:
+            def export():
+                api = VRChatAPI(StubFriendsHTTP(total))
+                with open(path, "w", encoding="utf-8", newline="") as fh:
+                    write_friends(api.iter_all_friends(), fh, fmt)
+
+            elapsed, peak = _measure(export)
+            results[f"export_{fmt}"] = {
+                "seconds": round(elapsed, 4),
+                "friends_per_sec": round(total / elapsed),
+                "peak_bytes": peak,
+                "file_bytes": os.path.getsize(path),
+            }
+        finally:
+            os.unlink(path)
+
+    try:
+        import resource
+        # Linux は KiB, macOS は bytes
+        rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+        results["max_rss_bytes"] = rss if sys.platform == "darwin" else rss * 1024
+    except ImportError:
+        pass
+    return results
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--friends", type=int, default=10_000)
+    args = p.parse_args()
+    for k, v in run(args.friends).items():
+        print(f"{k:>14}: {v}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,66 @@
+"""
+フレンド 1 人あたりのメモリ使用量のベンチマーク (ネットワーク不要)。
+
+    python bench/bench_memory.py [--sizes 1000,10000,50000]
+
+スタブの friends API から全件を
+  raw     : API の dict のまま保持 (旧方式)
+  compact : FriendRecord に変換して保持
+  roster  : Roster に seed (ids 集合 + FriendRecord)
+したときに残るヒープ (tracemalloc) を bytes/friend で出す。
+"""
+from __future__ import annotations
+import argparse, gc, sys, tracemalloc
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from vrcfriendwatch.vrchat_api import VRChatAPI  # noqa: E402
+from vrcfriendwatch.records import FriendRecord  # noqa: E402
+from vrcfriendwatch.roster import Roster  # noqa: E402
+from _stubs import StubFriendsHTTP  # noqa: E402
+
+
+def _retained(build) -> int:
+    gc.collect()
+    tracemalloc.start()
+    keep = build()
+    gc.collect()
+    current, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    del keep
+    return current
+
+
+def run(sizes: list[int]) -> dict:
+    results: dict = {}
+    for n in sizes:
+        def raw():
+            return list(VRChatAPI(StubFriendsHTTP(n)).iter_all_friends())
+
+        def compact():
+            return [FriendRecord.from_api(f) for f in VRChatAPI(StubFriendsHTTP(n)).iter_all_friends()]
+
+        def roster():
+            r = Roster()
+            for f in VRChatAPI(StubFriendsHTTP(n)).iter_all_friends():
+                r.seed(f)
+            return r
+
+        results[n] = {name: round(_retained(fn) / n, 1)
+                      for name, fn in (("raw", raw), ("compact", compact), ("roster", roster))}
+    return results
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--sizes", default="1000,10000,50000")
+    args = p.parse_args()
+    sizes = [int(x) for x in args.sizes.split(",") if x]
+    print(f"{'friends':>8} {'raw':>10} {'compact':>10} {'roster':>10}  (bytes/friend)")
+    for n, r in run(sizes).items():
+        print(f"{n:>8} {r['raw']:>10} {r['compact']:>10} {r['roster']:>10}")
+
+
+if __name__ == "__main__":
+    main()
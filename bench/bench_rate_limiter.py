@@ -0,0 +1,162 @@
+"""
+RateLimiter の公平性と待ち時間のベンチマーク (ネットワーク不要)。
+
+    python bench/bench_rate_limiter.py [--threads 16] [--per-thread 50] [--rate 2000]
+
+1) 同じ優先度のスレッドを競わせ、到着順と取得順のずれ (FIFO 違反数)、
+   スレッド間の取得数の偏り (Jain の公平性指数, 1.0 が完全公平)、待ち時間の分布を測る。
+2) interactive / resync / prefetch を混ぜて、優先度ごとの待ち時間を比べる。
+3) asyncio タスクとスレッドを同じリミッタで競わせる。
+"""
+from __future__ import annotations
+import argparse, asyncio, itertools, sys, threading, time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "src"))
+
+from vrcfriendwatch.rate_limiter import (  # noqa: E402
+    RateLimiter, PRIORITY_INTERACTIVE, PRIORITY_RESYNC, PRIORITY_PREFETCH, PRIORITY_NAMES,
+)
+
+
+def _pct(xs: list[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return xs[min(len(xs) - 1, int(q * len(xs)))]
+
+
+def _latency(xs: list[float]) -> dict:
+    return {
+        "p50_ms": round(_pct(xs, 0.50) * 1000, 2),
+        "p99_ms": round(_pct(xs, 0.99) * 1000, 2),
+        "max_ms": round(max(xs, default=0.0) * 1000, 2),
+    }
+
+
+def _jain(counts: list[int]) -> float:
+    s, sq = sum(counts), sum(c * c for c in counts)
+    return round(s * s / (len(counts) * sq), 4) if sq else 1.0
+
+
+def contention(threads: int, per_thread: int, rate: float) -> dict:
+    """同一優先度で threads 本を競わせる。capacity=1 なので全員がほぼ毎回待つ。"""
+    lim = RateLimiter(capacity=1, refill_rate=rate)
+    lim.tokens = 0.0
+    ticket = itertools.count()
+    order_lock = threading.Lock()
+    grants: list[int] = []
+    lat: list[float] = []
+    counts = [0] * threads
+    stop = threading.Event()
+
+    def worker(idx: int) -> None:
+        while not stop.is_set():
+            t = time.perf_counter()
+            # 到着順の番号は acquire 直前に取る (ロック内で取れないので多少のずれは許容)
+            my = next(ticket)
+            lim.acquire()
+            with order_lock:
+                grants.append(my)
+                lat.append(time.perf_counter() - t)
+                counts[idx] += 1
+                if len(grants) >= threads * per_thread:
+                    stop.set()
+
+    ts = [threading.Thread(target=worker, args=(i,), daemon=True) for i in range(threads)]
+    t0 = time.perf_counter()
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    elapsed = time.perf_counter() - t0
+    # 取得順に並べたとき、それより前に取れた番号の最大値より小さい = 追い越された
+    inversions, hi = 0, -1
+    for g in grants:
+        if g < hi:
+            inversions += 1
+        hi = max(hi, g)
+    return {
+        "threads": threads,
+        "grants": len(grants),
+        "grants_per_sec": round(len(grants) / elapsed),
+        "fifo_inversions": inversions,
+        "jain_index": _jain(counts),
+        **_latency(lat),
+    }
+
+
+def mixed(per_class: int, rate: float) -> dict:
+    """優先度 3 クラスを各 4 スレッドで同時に流し、クラスごとの待ち時間を比べる。"""
+    lim = RateLimiter(capacity=1, refill_rate=rate)
+    lim.tokens = 0.0
+    lat: dict[int, list[float]] = {p: [] for p in (PRIORITY_INTERACTIVE, PRIORITY_RESYNC, PRIORITY_PREFETCH)}
+    lock = threading.Lock()
+
+    def worker(priority: int, n: int) -> None:
+        for _ in range(n):
+            t = time.perf_counter()
+            lim.acquire(priority=priority)
+            with lock:
+                lat[priority].append(time.perf_counter() - t)
+
+    ts = [threading.Thread(target=worker, args=(p, per_class // 4), daemon=True)
+          for p in lat for _ in range(4)]
+    for t in ts:
+        t.start()
+    for t in ts:
+        t.join()
+    return {PRIORITY_NAMES[p]: _latency(xs) for p, xs in lat.items()}
+
+
+def mixed_async(per_side: int, rate: float) -> dict:
+    """asyncio タスク 4 本とスレッド 4 本で同じリミッタを取り合う。"""
+    lim = RateLimiter(capacity=1, refill_rate=rate)
+    lim.tokens = 0.0
+    out: dict[str, list[float]] = {"async": [], "thread": []}
+
+    def thread_worker(n: int) -> None:
+        for _ in range(n):
+            t = time.perf_counter()
+            lim.acquire()
+            out["thread"].append(time.perf_counter() - t)
+
+    async def task(n: int) -> None:
+        for _ in range(n):
+            t = time.perf_counter()
+            await lim.acquire_async()
+            out["async"].append(time.perf_counter() - t)
+
+    async def amain() -> None:
+        await asyncio.gather(*(task(per_side // 4) for _ in range(4)))
+
+    ts = [threading.Thread(target=thread_worker, args=(per_side // 4,), daemon=True) for _ in range(4)]
+    for t in ts:
+        t.start()
+    asyncio.run(amain())
+    for t in ts:
+        t.join()
+    return {k: {"grants": len(v), **_latency(v)} for k, v in out.items()}
+
+
+def run(threads: int, per_thread: int, rate: float) -> dict:
+    results: dict = {}
+    for n in sorted({1, 4, threads}):
+        results[f"contention_{n}"] = contention(n, per_thread, rate)
+    results["mixed_priority"] = mixed(threads * per_thread // 2, rate)
+    results["mixed_async"] = mixed_async(threads * per_thread // 2, rate)
+    return results
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--threads", type=int, default=16)
+    p.add_argument("--per-thread", type=int, default=50)
+    p.add_argument("--rate", type=float, default=2000.0, help="tokens/sec (大きいほど短時間で終わる)")
+    args = p.parse_args()
+    for k, v in run(args.threads, args.per_thread, args.rate).items():
+        print(f"{k:>16}: {v}")
+
+
+if __name__ == "__main__":
+    main()
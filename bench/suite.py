@@ -0,0 +1,296 @@
+"""
+ホットパスのマイクロベンチマーク一式 (ネットワーク不要)。
+
+    python bench/suite.py                       # 全ケースを実行して bench/results/<日時>.json に保存
+    python bench/suite.py --quick               # 件数を減らして手早く
+    python bench/suite.py --only limiter,on_message
+    python bench/suite.py --compare bench/results/base.json [--threshold 0.15]
+
+--compare を付けると基準の JSON と比べ、ops_per_sec が threshold 以上下がった /
+*_us が threshold 以上増えたケースを回帰として表示し、終了コード 1 を返す。
+
+ケース:
+  limiter      RateLimiter.acquire / try_acquire (1〜64 スレッド)
+  on_message   WSRunner.on_message のイベント種別ごとのスループット (+ dispatch の名前解決込み)
+  location     parse_location / parse_location_to_world のキャッシュ hit / miss
+  list_friends ページングして FriendRecord にする速さ
+  snapshot     print_initial_snapshot の描画 (1k / 10k 人)
+"""
+from __future__ import annotations
+import argparse, gc, io, json, os, platform, subprocess, sys, threading, time
+from contextlib import redirect_stdout
+from pathlib import Path
+from typing import Callable
+
+ROOT = Path(__file__).resolve().parents[1]
+sys.path.insert(0, str(ROOT / "src"))
+
+from vrcfriendwatch.rate_limiter import RateLimiter  # noqa: E402
+from vrcfriendwatch.location import parse_location  # noqa: E402
+from vrcfriendwatch.vrchat_api import VRChatAPI  # noqa: E402
+from vrcfriendwatch.event_queue import Stage  # noqa: E402
+from vrcfriendwatch.ws_client import WSRunner  # noqa: E402
+from vrcfriendwatch.snapshot import print_initial_snapshot  # noqa: E402
+from _stubs import StubAPIHTTP, make_friend  # noqa: E402
+
+RESULTS_DIR = ROOT / "bench" / "results"
+
+
+def _best(fn: Callable[[], None], repeat: int) -> float:
+    """repeat 回まわして最短の秒数 (timeit と同じく最小値がノイズに強い)。"""
+    best = float("inf")
+    for _ in range(repeat):
+        gc.collect()
+        t = time.perf_counter()
+        fn()
+        best = min(best, time.perf_counter() - t)
+    return best
+
+
+def _rate(ops: int, seconds: float) -> dict:
+    return {"ops_per_sec": round(ops / seconds), "per_op_us": round(seconds / ops * 1e6, 3)}
+
+
+# --- limiter ---
+def bench_limiter(quick: bool) -> dict:
+    """トークンは枯れない設定で、ロックと待ち行列の素のオーバーヘッドを測る。"""
+    per_thread = 2_000 if quick else 10_000
+    out: dict = {}
+    for method in ("acquire", "try_acquire"):
+        for n in (1, 4, 16, 64):
+            lim = RateLimiter(capacity=10**9, refill_rate=10**9)
+            call = getattr(lim, method)
+            start = threading.Barrier(n + 1)
+
+            def worker() -> None:
+                start.wait()
+                for _ in range(per_thread):
+                    call()
+
+            ts = [threading.Thread(target=worker, daemon=True) for _ in range(n)]
+            for t in ts:
+                t.start()
+            start.wait()
+            t0 = time.perf_counter()
+            for t in ts:
+                t.join()
+            out[f"{method}/{n}"] = _rate(n * per_thread, time.perf_counter() - t0)
+    return out
+
+
+# --- on_message ---
+def _message(typ: str, uid: str, i: int) -> str:
+    content = {"userId": uid}
+    if typ in ("friend-online", "friend-location"):
+        content["location"] = f"wrld_{i % 50:08d}-0000-4000-8000-000000000000:{i % 7}~region(jp)"
+    if typ == "friend-update":
+        content["user"] = {"id": uid, "status": "busy", "statusDescription": "zzz"}
+        content["status"] = "busy"
+    # pipeline は content を JSON 文字列で二重に包んで送ってくる
+    return json.dumps({"type": typ, "content": json.dumps(content)})
+
+
+def _runner(friends: int, capacity: int) -> WSRunner:
+    api = VRChatAPI(StubAPIHTTP())
+    runner = WSRunner(api.http, api)
+    runner.console = False
+    # ワーカーは起動せず、WS スレッド側の仕事 (デコード/フィルタ/投入/索引更新) だけを測る
+    runner.dispatch = Stage("dispatch", runner._dispatch, capacity=capacity)
+    runner.notifier = Stage("notify", runner._notify, capacity=capacity)
+    for i in range(friends):
+        runner.roster.seed(make_friend(i, offline=False))
+    runner.seed_occupancy()
+    return runner
+
+
+def bench_on_message(quick: bool) -> dict:
+    n = 5_000 if quick else 20_000
+    friends = 1_000
+    uids = [make_friend(i, False)["id"] for i in range(friends)]
+    out: dict = {}
+    cases = ["friend-online", "friend-offline", "friend-location", "friend-update", "friend-active"]
+    for typ in cases + ["filtered", "unhandled"]:
+        if typ == "filtered":
+            msgs = [_message("friend-location", f"usr_{i:08d}-ffff", i) for i in range(n)]
+        elif typ == "unhandled":
+            msgs = [json.dumps({"type": "notification", "content": "{}"})] * n
+        else:
+            msgs = [_message(typ, uids[i % friends], i) for i in range(n)]
+
+        def run() -> None:
+            runner = _runner(friends, n * 2)
+            for m in msgs:
+                runner.on_message(None, m)
+
+        # _runner の組み立て分は別に測って引く
+        base = _best(lambda: _runner(friends, n * 2), 2)
+        out[typ] = _rate(n, max(1e-9, _best(run, 3) - base))
+
+    # dispatch (名前/ワールド解決 + 表示用整形 + 通知投入)。キャッシュは温まった状態
+    for typ in ("friend-online", "friend-location", "friend-update"):
+        runner = _runner(friends, n * 4)
+        items = [json.loads(json.loads(_message(typ, uids[i % friends], i))["content"]) for i in range(n)]
+        for c in items[:friends]:
+            runner._dispatch((typ, c["userId"], c))
+
+        def run() -> None:
+            runner.notifier = Stage("notify", runner._notify, capacity=n * 2)
+            for c in items:
+                runner._dispatch((typ, c["userId"], c))
+
+        out[f"dispatch/{typ}"] = _rate(n, _best(run, 3))
+    return out
+
+
+# --- location ---
+def bench_location(quick: bool) -> dict:
+    n = 20_000 if quick else 100_000
+    locs = [f"wrld_{i % 50:08d}-0000-4000-8000-000000000000:{i % 97}~private(usr_x)~canRequestInvite~region(jp)"
+            for i in range(n)]
+    out: dict = {}
+
+    def cold() -> None:
+        parse_location.cache_clear()
+        for s in locs[:4000]:
+            parse_location(s)
+
+    out["parse_location/miss"] = _rate(4000, _best(cold, 3))
+    # hit 側は lru_cache (4096) に収まる 350 種類を回す
+    hot = [f"wrld_{i % 50:08d}-0000-4000-8000-000000000000:{i % 7}~region(jp)" for i in range(n)]
+    for s in hot:
+        parse_location(s)
+    out["parse_location/hit"] = _rate(n, _best(lambda: [parse_location(s) for s in hot], 3))
+
+    api = VRChatAPI(StubAPIHTTP())
+
+    def world_miss() -> None:
+        api.worlds = type(api.worlds)(api.worlds.maxsize)
+        for s in locs[:50]:
+            api.parse_location_to_world(s)
+
+    out["parse_location_to_world/miss"] = _rate(50, _best(world_miss, 3))
+    out["parse_location_to_world/hit"] = _rate(n, _best(lambda: [api.parse_location_to_world(s) for s in hot], 3))
+    uids = [make_friend(i % 1000, False)["id"] for i in range(n)]
+    for u in uids[:1000]:
+        api.display_name(u)
+    out["display_name/hit"] = _rate(n, _best(lambda: [api.display_name(u) for u in uids], 3))
+    out["upstream_calls"] = dict(api.http.lookups)
+    return out
+
+
+# --- list_friends ---
+def bench_list_friends(quick: bool) -> dict:
+    out: dict = {}
+    for total in ((1_000,) if quick else (1_000, 10_000)):
+        http = StubAPIHTTP(total)
+        api = VRChatAPI(http)
+        seconds = _best(lambda: api.list_friends(offline=True) + api.list_friends(offline=False), 3)
+        out[str(total)] = {**_rate(total, seconds), "pages_per_run": http.calls // 3}
+    return out
+
+
+# --- snapshot ---
+def bench_snapshot(quick: bool) -> dict:
+    out: dict = {}
+    for total in ((1_000,) if quick else (1_000, 10_000)):
+        def run() -> None:
+            api = VRChatAPI(StubAPIHTTP(total))
+            with redirect_stdout(io.StringIO()):
+                print_initial_snapshot(api, set())
+
+        out[str(total)] = _rate(total, _best(run, 3))
+    return out
+
+
+CASES: dict[str, Callable[[bool], dict]] = {
+    "limiter": bench_limiter,
+    "on_message": bench_on_message,
+    "location": bench_location,
+    "list_friends": bench_list_friends,
+    "snapshot": bench_snapshot,
+}
+
+
+# --- 保存と比較 ---
+def _meta() -> dict:
+    try:
+        commit = subprocess.run(["git", "rev-parse", "--short", "HEAD"], cwd=ROOT,
+                                capture_output=True, text=True, timeout=5).stdout.strip()
+    except Exception:
+        commit = ""
+    return {
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "commit": commit,
+        "python": platform.python_version(),
+        "implementation": platform.python_implementation(),
+        "platform": platform.platform(),
+        "cpus": os.cpu_count(),
+    }
+
+
+def _flatten(results: dict, prefix: str = "") -> dict[str, float]:
+    flat: dict[str, float] = {}
+    for k, v in results.items():
+        key = f"{prefix}{k}"
+        if isinstance(v, dict):
+            flat.update(_flatten(v, key + "."))
+        elif isinstance(v, (int, float)):
+            flat[key] = v
+    return flat
+
+
+def compare(base: dict, cur: dict, threshold: float) -> list[str]:
+    """ops_per_sec は下がったら、*_us は上がったら回帰。戻り値は回帰した行。"""
+    b, c = _flatten(base["results"]), _flatten(cur["results"])
+    regressions = []
+    print(f"\n{'metric':<52} {'base':>12} {'current':>12} {'change':>8}")
+    for key in sorted(b.keys() & c.keys()):
+        higher_better = key.endswith("ops_per_sec")
+        if not (higher_better or key.endswith("_us")) or not b[key]:
+            continue
+        change = (c[key] - b[key]) / b[key]
+        worse = -change if higher_better else change
+        flag = "  REGRESSION" if worse > threshold else ""
+        print(f"{key:<52} {b[key]:>12} {c[key]:>12} {change:>+8.1%}{flag}")
+        if flag:
+            regressions.append(key)
+    return regressions
+
+
+def main() -> None:
+    p = argparse.ArgumentParser()
+    p.add_argument("--only", default="", help="カンマ区切りのケース名 (" + ",".join(CASES) + ")")
+    p.add_argument("--quick", action="store_true")
+    p.add_argument("--out", default="", help="結果 JSON の保存先 (既定: bench/results/<日時>.json)")
+    p.add_argument("--compare", default="", help="比較する基準の結果 JSON")
+    p.add_argument("--threshold", type=float, default=0.15, help="回帰とみなす悪化率 (0.15 = 15%%)")
+    args = p.parse_args()
+
+    names = [n for n in args.only.split(",") if n] or list(CASES)
+    unknown = [n for n in names if n not in CASES]
+    if unknown:
+        p.error("unknown case: " + ", ".join(unknown))
+
+    doc = {"meta": {**_meta(), "quick": args.quick}, "results": {}}
+    for name in names:
+        t = time.perf_counter()
+        doc["results"][name] = CASES[name](args.quick)
+        print(f"[{name}] {time.perf_counter() - t:.1f}s")
+        for k, v in doc["results"][name].items():
+            print(f"  {k:<32} {v}")
+
+    out = Path(args.out) if args.out else RESULTS_DIR / (time.strftime("%Y%m%d-%H%M%S") + ".json")
+    out.parent.mkdir(parents=True, exist_ok=True)
+    out.write_text(json.dumps(doc, indent=2, ensure_ascii=False), encoding="utf-8")
+    print(f"saved: {out}")
+
+    if args.compare:
+        base = json.loads(Path(args.compare).read_text(encoding="utf-8"))
+        regressions = compare(base, doc, args.threshold)
+        if regressions:
+            print(f"\n{len(regressions)} regression(s) over {args.threshold:.0%}")
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
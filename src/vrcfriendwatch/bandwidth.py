@@ -0,0 +1,82 @@
+from __future__ import annotations
+import threading, time, zlib
+
+# サーバ→クライアントのフレームはマスク無し。ヘッダ長はペイロード長で決まる
+def frame_overhead(n: int) -> int:
+    return 2 if n < 126 else 4 if n < 65536 else 10
+
+
+class BandwidthMeter:
+    """
+    pipeline の受信量をイベント種別ごとに数える (フレーム数 / ペイロード / ヘッダ込みのバイト数)。
+
+    estimate=True のときは permessage-deflate (RFC 7692, context takeover あり) で送られていたら
+    何バイトになったかを手元で圧縮して見積もり、その伸長にかかる CPU 時間も測る。
+    """
+    def __init__(self, estimate: bool = False):
+        self.estimate = estimate
+        self.lock = threading.Lock()
+        self.by_type: dict[str, dict[str, int]] = {}
+        self.control = {"frames": 0, "bytes": 0}
+        self.started = time.monotonic()
+        self.inflate_seconds = 0.0
+        self.deflate_seconds = 0.0
+        if estimate:
+            self._comp = zlib.compressobj(6, zlib.DEFLATED, -15)
+            self._decomp = zlib.decompressobj(-15)
+
+    def record(self, typ: str, raw: str | bytes) -> None:
+        data = raw.encode("utf-8") if isinstance(raw, str) else raw
+        n = len(data)
+        deflated = 0
+        if self.estimate:
+            t = time.perf_counter()
+            c = self._comp.compress(data) + self._comp.flush(zlib.Z_SYNC_FLUSH)
+            t2 = time.perf_counter()
+            self._decomp.decompress(c)
+            self.deflate_seconds += t2 - t
+            self.inflate_seconds += time.perf_counter() - t2
+            # 末尾の 00 00 ff ff は送られない
+            deflated = len(c) - 4
+        with self.lock:
+            s = self.by_type.get(typ)
+            if s is None:
+                s = self.by_type[typ] = {"frames": 0, "payload": 0, "wire": 0, "deflated_wire": 0}
+            s["frames"] += 1
+            s["payload"] += n
+            s["wire"] += n + frame_overhead(n)
+            if self.estimate:
+                s["deflated_wire"] += deflated + frame_overhead(deflated)
+
+    def record_control(self, n: int) -> None:
+        """ping/pong などの制御フレーム。"""
+        with self.lock:
+            self.control["frames"] += 1
+            self.control["bytes"] += n + frame_overhead(n)
+
+    def stats(self) -> dict:
+        with self.lock:
+            by_type = {k: dict(v) for k, v in self.by_type.items()}
+            control = dict(self.control)
+        frames = sum(v["frames"] for v in by_type.values())
+        wire = sum(v["wire"] for v in by_type.values()) + control["bytes"]
+        elapsed = max(1e-9, time.monotonic() - self.started)
+        out: dict = {
+            "frames": frames,
+            "wire_bytes": wire,
+            "bytes_per_sec": round(wire / elapsed, 1),
+            "control": control,
+            "by_type": dict(sorted(by_type.items(), key=lambda kv: -kv[1]["wire"])),
+        }
+        if self.estimate:
+            deflated = sum(v["deflated_wire"] for v in by_type.values()) + control["bytes"]
+            out["deflate_estimate"] = {
+                "wire_bytes": deflated,
+                "saved_pct": round(100.0 * (1 - deflated / wire), 1) if wire else 0.0,
+                "inflate_us_per_frame": round(self.inflate_seconds / frames * 1e6, 2) if frames else 0.0,
+                "deflate_us_per_frame": round(self.deflate_seconds / frames * 1e6, 2) if frames else 0.0,
+            }
+        else:
+            for v in out["by_type"].values():
+                v.pop("deflated_wire", None)
+        return out
@@ -0,0 +1,55 @@
+from __future__ import annotations
+import threading
+from collections import OrderedDict
+from typing import Generic, Hashable, Iterator, TypeVar
+
+K = TypeVar("K", bound=Hashable)
+V = TypeVar("V")
+
+
+class LRUCache(Generic[K, V]):
+    """
+    上限付きの LRU キャッシュ (thread-safe)。
+    functools.lru_cache と違い、外から値を入れたり (put) 中身を列挙したりできる。
+    """
+    def __init__(self, maxsize: int = 2048):
+        self.maxsize = int(maxsize)
+        self._data: OrderedDict[K, V] = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: K) -> bool:
+        return key in self._data
+
+    def get(self, key: K, default: V | None = None) -> V | None:
+        with self.lock:
+            try:
+                value = self._data[key]
+            except KeyError:
+                self.misses += 1
+                return default
+            self._data.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def peek(self, key: K, default: V | None = None) -> V | None:
+        """統計にも LRU 順にも影響しない参照。"""
+        return self._data.get(key, default)
+
+    def put(self, key: K, value: V) -> None:
+        with self.lock:
+            self._data[key] = value
+            self._data.move_to_end(key)
+            while len(self._data) > self.maxsize:
+                self._data.popitem(last=False)
+
+    def items(self) -> Iterator[tuple[K, V]]:
+        with self.lock:
+            return iter(list(self._data.items()))
+
+    def stats(self) -> dict:
+        return {"size": len(self._data), "maxsize": self.maxsize, "hits": self.hits, "misses": self.misses}
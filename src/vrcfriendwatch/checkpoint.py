@@ -0,0 +1,173 @@
+from __future__ import annotations
+import logging, os, pickle, threading, time, zlib
+from dataclasses import dataclass, field
+from pathlib import Path
+from typing import Callable
+
+from .records import FriendRecord
+from .roster import Roster
+from .location import intern_id
+from .vrchat_api import VRChatAPI
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"VFWC"
+FORMAT_VERSION = 1
+
+
+@dataclass
+class Checkpoint:
+    saved_at: float
+    ids: set[str]
+    # uid -> FriendRecord.as_tuple()
+    friends: dict[str, tuple]
+    names: list[tuple[str, str]] = field(default_factory=list)
+    worlds: list[tuple[str, str]] = field(default_factory=list)
+    roster_etag: str | None = None
+
+
+def save_checkpoint(path: Path, roster: Roster, api: VRChatAPI, roster_etag: str | None = None) -> int:
+    """
+    ロスターとキャッシュを pickle + zlib で書き出す。一時ファイルに書いて fsync してから
+    os.replace するので、途中で落ちても前回のチェックポイントは壊れない。書いたバイト数を返す。
+    """
+    with roster.lock:
+        ids = list(roster.ids)
+    payload = {
+        "saved_at": time.time(),
+        "ids": ids,
+        "friends": roster.records(),
+        "names": list(api.names.items()),
+        "worlds": list(api.worlds.items()),
+        "roster_etag": roster_etag,
+    }
+    data = MAGIC + bytes([FORMAT_VERSION]) + zlib.compress(pickle.dumps(payload, protocol=pickle.HIGHEST_PROTOCOL), 6)
+    tmp = path.with_name(path.name + ".tmp")
+    with open(tmp, "wb") as fh:
+        fh.write(data)
+        fh.flush()
+        os.fsync(fh.fileno())
+    os.replace(tmp, path)
+    return len(data)
+
+
+def load_checkpoint(path: Path) -> Checkpoint | None:
+    """無い/壊れている/形式が違うときは None (起動はゼロからやり直すだけ)。"""
+    try:
+        data = path.read_bytes()
+    except FileNotFoundError:
+        return None
+    except OSError as e:
+        log.warning("[CKPT] read failed: %s", e)
+        return None
+    if data[:4] != MAGIC or len(data) < 5 or data[4] != FORMAT_VERSION:
+        log.warning("[CKPT] ignoring %s: unknown format", path)
+        return None
+    try:
+        p = pickle.loads(zlib.decompress(data[5:]))
+        return Checkpoint(
+            saved_at=float(p["saved_at"]),
+            ids={intern_id(u) for u in p["ids"]},
+            friends={intern_id(t[0]): tuple(t) for t in p["friends"]},
+            names=p.get("names") or [],
+            worlds=p.get("worlds") or [],
+            roster_etag=p.get("roster_etag"),
+        )
+    except Exception as e:
+        log.warning("[CKPT] ignoring corrupt checkpoint %s: %s", path, e)
+        return None
+
+
+def restore_caches(cp: Checkpoint, api: VRChatAPI) -> int:
+    """名前/ワールド名キャッシュを温める。入れた件数を返す。"""
+    for uid, name in cp.names:
+        api.names.put(intern_id(uid), name)
+    for wid, name in cp.worlds:
+        api.worlds.put(intern_id(wid), name)
+    return len(cp.names) + len(cp.worlds)
+
+
+def away_changes(cp: Checkpoint, roster: Roster) -> list[dict]:
+    """
+    チェックポイント時点と今のロスターを比べた「離れている間の変化」。
+    type は friend-add / friend-delete / online / offline / moved / status / renamed。
+    """
+    live = {rec[0]: rec for rec in roster.records()}
+    out: list[dict] = []
+    for uid in live.keys() - cp.friends.keys():
+        if uid not in cp.ids:
+            out.append({"type": "friend-add", "userId": uid, "displayName": live[uid][1]})
+    for uid in cp.friends.keys() - live.keys():
+        if uid not in roster.ids:
+            out.append({"type": "friend-delete", "userId": uid, "displayName": cp.friends[uid][1]})
+    for uid in cp.friends.keys() & live.keys():
+        old, new = FriendRecord.from_tuple(cp.friends[uid]), FriendRecord.from_tuple(live[uid])
+        name = new.display_name or old.display_name
+        if old.state != new.state and (old.state == "offline" or new.state == "offline"):
+            out.append({"type": "offline" if new.state == "offline" else "online", "userId": uid,
+                        "displayName": name, "before": old.state, "after": new.state})
+        elif old.location != new.location and new.state != "offline":
+            out.append({"type": "moved", "userId": uid, "displayName": name,
+                        "before": old.location, "after": new.location})
+        if old.status != new.status and new.status:
+            out.append({"type": "status", "userId": uid, "displayName": name,
+                        "before": old.status, "after": new.status})
+        if old.display_name and new.display_name and old.display_name != new.display_name:
+            out.append({"type": "renamed", "userId": uid, "displayName": name,
+                        "before": old.display_name, "after": new.display_name})
+    order = ("friend-add", "friend-delete", "online", "offline", "moved", "status", "renamed")
+    out.sort(key=lambda c: (order.index(c["type"]), c.get("displayName") or ""))
+    return out
+
+
+class Checkpointer:
+    """interval 秒ごとに、前回から変化があればチェックポイントを書く。stop() で最後に 1 回書く。"""
+    def __init__(self, path: Path, roster: Roster, api: VRChatAPI, interval: float = 300.0,
+                 etag: Callable[[], str | None] | None = None):
+        self.path, self.roster, self.api, self.interval = path, roster, api, float(interval)
+        self.etag = etag
+        self._last_key: tuple | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        # 定期保存と stop() の最終保存が同じ .tmp に同時に書かないように
+        self._save_lock = threading.Lock()
+        self.saves = 0
+
+    def _key(self) -> tuple:
+        return (self.roster.version, self.api.names.misses, self.api.worlds.misses, len(self.api.names),
+                len(self.api.worlds))
+
+    def save(self, force: bool = False) -> bool:
+        with self._save_lock:
+            key = self._key()
+            if not force and key == self._last_key:
+                return False
+            t = time.perf_counter()
+            size = save_checkpoint(self.path, self.roster, self.api, self.etag() if self.etag else None)
+            self._last_key = key
+            self.saves += 1
+        log.debug("[CKPT] saved %d bytes in %.1fms", size, (time.perf_counter() - t) * 1000)
+        return True
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="checkpoint", daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout: float = 10.0) -> None:
+        self._stop.set()
+        # 書きかけの定期保存を終わらせてから最後の 1 回を書く
+        if self._thread is not None:
+            self._thread.join(timeout)
+        try:
+            self.save()
+        except Exception as e:
+            log.warning("[CKPT] final save failed: %s", e)
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.save()
+            except Exception as e:
+                log.warning("[CKPT] save failed: %s", e)
@@ -1,15 +1,108 @@
 from __future__ import annotations
-import time,threading
+import sys,time,threading,argparse,logging,json,signal
 from colorama import init as colorma_init,just_fix_windows_console
-from .settings import SETTINGS
-from .logging_config import configure_logging
+from .settings import SETTINGS, ConfigWatcher
+from .logging_config import configure_logging, parse_sample_rates, resolve_level, set_level, set_sample_rates
 from .http_client import VRChatHTTP
 from .vrchat_api import VRChatAPI
 from .ws_client import WSRunner
-from .snapshot import print_initial_snapshot
-from .notify import notify
+from .snapshot import print_initial_snapshot, seed_roster, print_away_changes
+from .notify import notify, get_notifier, reload_notifier
+from .state_server import StateServer
+from .export import export_friends, FORMATS
+from .simulate import SimConfig, run_simulation, format_report
+from .checkpoint import Checkpointer, load_checkpoint, restore_caches, away_changes
+from .paths import CHECKPOINT_PATH, TRACE_PATH
+from .tracing import TRACER
+from .pubsub import PubSub, subscribe
+from .session import SessionManager
 
-def main() -> None:
+log = logging.getLogger(__name__)
+
+def _parse_args(argv: list[str] | None) -> argparse.Namespace:
+    p = argparse.ArgumentParser(prog="vrcfriendwatch", description="VRChat フレンド通知")
+    p.add_argument("--daemon",action="store_true",
+                   help="コンソール表示なしで常駐し、状態をローカル API で公開する")
+    p.add_argument("--listen",default=SETTINGS.daemon_listen,
+                   help="状態 API の待受アドレス (host:port)")
+    p.add_argument("--unix-socket",default=SETTINGS.daemon_unix_socket or None,
+                   help="指定時は TCP の代わりに Unix ソケットで待ち受ける")
+    p.add_argument("--pubsub",default=SETTINGS.pubsub_listen or None,metavar="HOST:PORT",
+                   help="解決済みイベントをローカルの購読者へ流す (例: 127.0.0.1:8766)")
+    p.add_argument("--pubsub-unix-socket",default=SETTINGS.pubsub_unix_socket or None,
+                   help="pub/sub を Unix ソケットで待ち受ける")
+    sub = p.add_subparsers(dest="command")
+    ex = sub.add_parser("export",help="フレンド一覧を JSONL/CSV で書き出す")
+    ex.add_argument("--format",choices=FORMATS,default="jsonl")
+    ex.add_argument("-o","--output",default="-",help="出力先 (既定: 標準出力)")
+    ex.add_argument("--online-only",action="store_true",help="オンラインのフレンドだけ")
+    sim = sub.add_parser("simulate",help="仮想時計で長時間の負荷をシミュレートする (ログイン不要)")
+    d = SimConfig()
+    sim.add_argument("--hours",type=float,default=d.hours)
+    sim.add_argument("--friends",type=int,default=d.friends)
+    sim.add_argument("--events-per-hour",type=float,default=d.events_per_hour)
+    sim.add_argument("--disconnects-per-hour",type=float,default=d.disconnects_per_hour)
+    sim.add_argument("--p429",type=float,default=d.p429,help="ランダムに 429 を返す確率")
+    sim.add_argument("--storms-per-day",type=float,default=d.storms_per_day,help="全リクエストが 429 になる時間帯の回数")
+    sim.add_argument("--seed",type=int,default=d.seed)
+    sim.add_argument("--no-prefetch",dest="prefetch",action="store_false",help="先読みなしで比べる")
+    sim.add_argument("--json",action="store_true",help="レポートを JSON で出す")
+    su = sub.add_parser("subscribe",help="動作中のウォッチャーの pub/sub を購読して JSON 行で出す (ログイン不要)")
+    su.add_argument("address",help="host:port か Unix ソケットのパス")
+    su.add_argument("--topics",default="",help="カンマ区切りの type (glob 可: friend-*)")
+    su.add_argument("--users",default="",help="カンマ区切りの userId")
+    su.add_argument("--since",type=int,default=None,help="この seq より後を再送してもらう")
+    return p.parse_args(argv)
+
+def _subscribe(args: argparse.Namespace) -> None:
+    split = lambda v: [x.strip() for x in v.split(",") if x.strip()] or None
+    try:
+        for ev in subscribe(args.address,split(args.topics),split(args.users),args.since):
+            print(json.dumps(ev,ensure_ascii=False),flush=True)
+    except KeyboardInterrupt:
+        pass
+
+def _simulate(args: argparse.Namespace) -> None:
+    logging.basicConfig(level=logging.DEBUG if SETTINGS.debug else logging.ERROR)
+    cfg = SimConfig(hours=args.hours,friends=args.friends,events_per_hour=args.events_per_hour,
+                    disconnects_per_hour=args.disconnects_per_hour,p429=args.p429,
+                    storms_per_day=args.storms_per_day,seed=args.seed,prefetch=args.prefetch)
+    report = run_simulation(cfg)
+    print(json.dumps(report,ensure_ascii=False,indent=2) if args.json else format_report(report))
+
+def _apply_settings(changed: dict[str, tuple]) -> None:
+    """プロセス全体の部品 (ログ/通知/トレース) への反映。WSRunner 側は runner.apply_settings。"""
+    if changed.keys() & {"debug", "log_level"}:
+        set_level(resolve_level(SETTINGS.debug, SETTINGS.log_level))
+    if "log_sample" in changed:
+        set_sample_rates(parse_sample_rates(SETTINGS.log_sample))
+    if any(k.startswith("notify_") for k in changed):
+        # 新しい設定の Notifier に差し替える (古い方は溜まっていた分を流し切ってから閉じる)
+        reload_notifier()
+    if changed.keys() & {"trace_sample", "trace_slow_ms"}:
+        TRACER.configure(SETTINGS.trace_path or TRACE_PATH,sample=SETTINGS.trace_sample,
+                         slow_ms=SETTINGS.trace_slow_ms)
+
+def _watch_config() -> ConfigWatcher:
+    watcher = ConfigWatcher(SETTINGS)
+    watcher.start()
+    if hasattr(signal,"SIGHUP"):
+        try:
+            signal.signal(signal.SIGHUP,lambda *_: watcher.trigger())
+        except ValueError:
+            # メインスレッド以外からの起動 (テストなど)
+            pass
+    log.info("Watching %s for changes",SETTINGS.config_file)
+    return watcher
+
+def main(argv: list[str] | None = None) -> None:
+    args = _parse_args(argv)
+    if args.command == "simulate":
+        _simulate(args)
+        return
+    if args.command == "subscribe":
+        _subscribe(args)
+        return
 
     try:
         just_fix_windows_console()
@@ -18,33 +111,127 @@ def main() -> None:
     colorma_init(autoreset=True,convert=True)
 
     SETTINGS.validate()
-    configure_logging(SETTINGS.debug)
+    configure_logging(
+        SETTINGS.debug,
+        level=SETTINGS.log_level,
+        max_bytes=SETTINGS.log_max_bytes,
+        backup_count=SETTINGS.log_backup_count,
+        rotate_hours=SETTINGS.log_rotate_hours,
+        compress=SETTINGS.log_compress,
+        sample_rates=parse_sample_rates(SETTINGS.log_sample),
+        # export を標準出力に流すときはログを混ぜない
+        stream=sys.stderr if args.command == "export" else None,
+    )
+
+    TRACER.configure(SETTINGS.trace_path or TRACE_PATH,sample=SETTINGS.trace_sample,
+                     slow_ms=SETTINGS.trace_slow_ms)
 
     http = VRChatHTTP()
     api = VRChatAPI(http)
 
     init_token,display_name = http.ensure_login()
-    print("Logged in as:",display_name)
+    if args.command == "export":
+        log.info("Logged in as: %s",display_name)
+        export_friends(api,args.output,args.format,online_only=args.online_only)
+        return
+
+    if args.daemon:
+        log.info("Logged in as: %s",display_name)
+    else:
+        print("Logged in as:",display_name)
+
+    # 前回のチェックポイントで名前/ワールドキャッシュを温めておく (起動直後の lookup を省く)
+    cp = None
+    if SETTINGS.checkpoint_minutes > 0:
+        t = time.perf_counter()
+        cp = load_checkpoint(CHECKPOINT_PATH)
+        if cp is not None:
+            cached = restore_caches(cp,api)
+            log.info("[CKPT] loaded %d friends, %d cached names in %.1fms",
+                     len(cp.friends),cached,(time.perf_counter()-t)*1000)
 
     target_ids = api.fetch_all_friend_ids()
     runner = WSRunner(http,api)
     runner.target_ids =target_ids
+    if cp is not None:
+        runner.roster_sync.etag = cp.roster_etag
+    session = SessionManager(http,init_token,check_interval=SETTINGS.session_check_minutes*60,
+                             refresh_after=SETTINGS.session_refresh_hours*3600)
+    runner.session = session
+    session.start()
+    SETTINGS.on_change(_apply_settings)
+    SETTINGS.on_change(runner.apply_settings)
+    watcher = _watch_config()
+
+    server = None
+    if args.daemon:
+        runner.console = False
+        seed_roster(api,runner.roster)
+        # /worlds が空の索引を返さないように、待ち受ける前に作っておく
+        runner.seed_occupancy()
+        server = StateServer(runner,listen=args.listen,unix_path=args.unix_socket)
+        server.start()
+        log.info("Daemon mode: monitoring %d friends, state API on %s",len(target_ids),server.address)
+    else:
+        print("Monitoring friends:",len(target_ids))
+        print_initial_snapshot(api,target_ids,roster=runner.roster)
+        runner.seed_occupancy()
+    runner.prefetcher.seed(runner.roster)
+
+    pubsub = None
+    if args.pubsub or args.pubsub_unix_socket:
+        pubsub = PubSub(runner.events,listen=args.pubsub or "127.0.0.1:8766",
+                        unix_path=args.pubsub_unix_socket,buffer=SETTINGS.pubsub_buffer)
+        pubsub.start()
 
-    print("Monitoring friends:",len(target_ids))
-    print_initial_snapshot(api,target_ids)
+    checkpointer = None
+    if SETTINGS.checkpoint_minutes > 0:
+        if cp is not None:
+            changes = away_changes(cp,runner.roster)
+            if args.daemon:
+                log.info("[CKPT] while away: %d changes %s",len(changes),changes[:20])
+            else:
+                print_away_changes(api,changes,cp.saved_at)
+        checkpointer = Checkpointer(CHECKPOINT_PATH,runner.roster,api,SETTINGS.checkpoint_minutes*60,
+                                    etag=lambda: runner.roster_sync.etag)
+        checkpointer.save(force=True)
+        checkpointer.start()
 
     wst = threading.Thread(target=runner.run_forever_with_reconnect,
                             args=(init_token,),daemon=True)
     wst.start()
 
     notify("VRChat","フレンド監視を開始しました")
-    print("Watching... Press Ctrl+C to exit.")
+    if not args.daemon:
+        print("Watching... Press Ctrl+C to exit.")
 
     try:
         while wst.is_alive():
             time.sleep(1)
     except KeyboardInterrupt:
-        print("Exiting...")
+        log.info("Exiting...")
+    watcher.stop()
+    session.stop()
+    if server is not None:
+        server.stop()
+    if checkpointer is not None:
+        checkpointer.stop()
+    if pubsub is not None:
+        log.info("PubSub stats: %s", pubsub.stats())
+        pubsub.stop()
+    log.info("Queue stats: %s", runner.queue_stats())
+    log.info("Reconnect stats: %s", runner.reconnect.stats())
+    log.info("Fallback stats: %s", runner.poller.stats())
+    log.info("Bandwidth stats: %s", runner.bandwidth.stats())
+    log.info("Notify stats: %s", get_notifier().stats())
+    log.info("Session stats: %s", session.stats())
+    log.info("Prefetch stats: %s", runner.prefetcher.stats())
+    log.info("Trace stats: %s", TRACER.stats())
+    TRACER.close()
+    log.info("HTTP stats: %s", http.pool_stats())
+    log.info("Rate limiter stats: %s", http.limiter.stats())
+    http.limiter.close()
+    log.info("Config reloads: %d (%d rejected)", watcher.reloads, watcher.errors)
 
 if __name__ =="__main__":
     main()
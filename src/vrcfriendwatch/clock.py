@@ -0,0 +1,83 @@
+from __future__ import annotations
+import heapq, itertools, threading, time
+from typing import Callable
+
+
+class Clock:
+    """
+    時刻と待ちの窓口。RateLimiter / VRChatHTTP / ReconnectPolicy / WSRunner はこれ経由で
+    時刻を読み、眠る。既定は実時間 (SYSTEM_CLOCK)、シミュレーションでは VirtualClock を渡す。
+    """
+    def monotonic(self) -> float:
+        return time.monotonic()
+
+    def time(self) -> float:
+        return time.time()
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            time.sleep(seconds)
+
+    def wait(self, event: threading.Event, timeout: float | None) -> bool:
+        """event.wait(timeout) と同じ。"""
+        return event.wait(timeout)
+
+
+SYSTEM_CLOCK = Clock()
+
+
+class VirtualClock(Clock):
+    """
+    離散イベントシミュレーション用の仮想時計 (シングルスレッド前提)。
+    sleep / wait は実際には眠らず、その間に予定されたタイマー (call_at) を時刻順に実行してから
+    now を進める。タイマーの中で眠るとその場で入れ子に進むので、タイマーは即時に終わる処理だけにする。
+    """
+    def __init__(self, start: float = 0.0, epoch: float = 1_767_225_600.0):
+        self.now = float(start)
+        # time() が返す壁時計の起点 (既定は 2026-01-01T00:00:00Z)
+        self.epoch = float(epoch)
+        self._timers: list[tuple[float, int, Callable[[], None]]] = []
+        self._seq = itertools.count()
+        self.slept = 0.0
+
+    def monotonic(self) -> float:
+        return self.now
+
+    def time(self) -> float:
+        return self.epoch + self.now
+
+    def call_at(self, when: float, fn: Callable[[], None]) -> None:
+        heapq.heappush(self._timers, (float(when), next(self._seq), fn))
+
+    def next_timer(self) -> float | None:
+        return self._timers[0][0] if self._timers else None
+
+    def run_until(self, when: float, until: Callable[[], bool] | None = None) -> bool:
+        """when までのタイマーを実行して now を進める。until() が真になったらその時刻で止めて True。"""
+        while self._timers and self._timers[0][0] <= when:
+            t, _, fn = heapq.heappop(self._timers)
+            self.now = max(self.now, t)
+            fn()
+            if until is not None and until():
+                return True
+        self.now = max(self.now, when)
+        return False
+
+    def sleep(self, seconds: float) -> None:
+        if seconds > 0:
+            self.slept += seconds
+            self.run_until(self.now + seconds)
+
+    def wait(self, event: threading.Event, timeout: float | None) -> bool:
+        if event.is_set():
+            return True
+        if timeout is None:
+            # 起こしてくれる相手がタイマーにしか居ないので、次のタイマーまで進めて様子を見る
+            nxt = self.next_timer()
+            if nxt is None:
+                raise RuntimeError("VirtualClock: wait() without timeout and no pending timers")
+            timeout = max(0.0, nxt - self.now)
+        start = self.now
+        woke = self.run_until(self.now + timeout, event.is_set)
+        self.slept += self.now - start
+        return woke or event.is_set()
@@ -0,0 +1,211 @@
+from __future__ import annotations
+import threading, time, logging
+from collections import deque
+from typing import Any, Callable, Hashable
+
+log = logging.getLogger(__name__)
+
+# 溢れたときの扱い
+POLICY_NEVER = "never"    # 捨てない。満杯なら producer を待たせる (backpressure)
+POLICY_LATEST = "latest"  # key ごとに最新だけ残す。満杯なら古い latest から捨てる
+POLICY_SHED = "shed"      # 満杯なら真っ先に捨てる (debug 用の処理など)
+POLICIES = (POLICY_NEVER, POLICY_LATEST, POLICY_SHED)
+
+
+class _Entry:
+    __slots__ = ("item", "policy", "key", "alive")
+
+    def __init__(self, item: Any, policy: str, key: Hashable | None):
+        self.item, self.policy, self.key, self.alive = item, policy, key, True
+
+
+class EventQueue:
+    """
+    ポリシー付きの有界 FIFO キュー (thread-safe)。
+    capacity: 通常時の上限件数
+    put_timeout: POLICY_NEVER が満杯で待つ最大秒数。超えたら上限を超えて積む (overflow として数える)
+    on_discard: 捨てた item ごとに (item, "dropped" | "coalesced") で呼ぶ (ロックの外で)
+    """
+    def __init__(self, capacity: int = 1000, put_timeout: float = 2.0,
+                 on_discard: Callable[[Any, str], None] | None = None):
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = int(capacity)
+        self.put_timeout = float(put_timeout)
+        self.on_discard = on_discard
+        self._order: deque[_Entry] = deque()
+        self._by_policy: dict[str, deque[_Entry]] = {p: deque() for p in POLICIES}
+        self._latest: dict[Hashable, _Entry] = {}
+        self._size = 0
+        self._cond = threading.Condition()
+        self.high_watermark = 0
+        self.counters: dict[str, dict[str, int]] = {
+            p: {"enqueued": 0, "coalesced": 0, "dropped": 0, "overflow": 0} for p in POLICIES
+        }
+
+    def __len__(self) -> int:
+        return self._size
+
+    def _evict_oldest_locked(self, policy: str, discarded: list) -> bool:
+        dq = self._by_policy[policy]
+        while dq:
+            e = dq.popleft()
+            if not e.alive:
+                continue
+            e.alive = False
+            self._size -= 1
+            if e.key is not None and self._latest.get(e.key) is e:
+                del self._latest[e.key]
+            self.counters[policy]["dropped"] += 1
+            discarded.append((e.item, "dropped"))
+            return True
+        return False
+
+    def put(self, item: Any, policy: str = POLICY_NEVER, key: Hashable | None = None) -> bool:
+        """積めたら True。捨てた場合は False。"""
+        if policy not in self.counters:
+            raise ValueError(f"unknown policy: {policy}")
+        discarded: list[tuple[Any, str]] = []
+        try:
+            return self._put(item, policy, key, discarded)
+        finally:
+            if self.on_discard is not None:
+                for old, reason in discarded:
+                    self.on_discard(old, reason)
+
+    def _put(self, item: Any, policy: str, key: Hashable | None, discarded: list) -> bool:
+        with self._cond:
+            c = self.counters[policy]
+            if policy == POLICY_LATEST and key is not None:
+                cur = self._latest.get(key)
+                if cur is not None and cur.alive:
+                    # 位置はそのまま中身だけ新しくする
+                    discarded.append((cur.item, "coalesced"))
+                    cur.item = item
+                    c["coalesced"] += 1
+                    return True
+
+            deadline: float | None = None
+            while self._size >= self.capacity:
+                # まず shed を捨て、次に古い latest を捨てる
+                if self._evict_oldest_locked(POLICY_SHED, discarded):
+                    continue
+                if policy == POLICY_SHED:
+                    c["dropped"] += 1
+                    discarded.append((item, "dropped"))
+                    return False
+                if self._evict_oldest_locked(POLICY_LATEST, discarded):
+                    continue
+                if policy == POLICY_LATEST:
+                    c["dropped"] += 1
+                    discarded.append((item, "dropped"))
+                    return False
+                # POLICY_NEVER: consumer が追いつくのを待つ
+                now = time.monotonic()
+                if deadline is None:
+                    deadline = now + self.put_timeout
+                remain = deadline - now
+                if remain <= 0:
+                    c["overflow"] += 1
+                    break
+                self._cond.wait(remain)
+
+            e = _Entry(item, policy, key)
+            self._order.append(e)
+            self._by_policy[policy].append(e)
+            if policy == POLICY_LATEST and key is not None:
+                self._latest[key] = e
+            self._size += 1
+            self.high_watermark = max(self.high_watermark, self._size)
+            c["enqueued"] += 1
+            self._cond.notify_all()
+            return True
+
+    def get(self, timeout: float | None = None) -> Any | None:
+        """先頭を取り出す。timeout 内に何もなければ None。"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            while True:
+                while self._order:
+                    e = self._order.popleft()
+                    if not e.alive:
+                        continue
+                    dq = self._by_policy[e.policy]
+                    while dq and dq[0] is not e and not dq[0].alive:
+                        dq.popleft()
+                    if dq and dq[0] is e:
+                        dq.popleft()
+                    e.alive = False
+                    if e.key is not None and self._latest.get(e.key) is e:
+                        del self._latest[e.key]
+                    self._size -= 1
+                    self._cond.notify_all()
+                    return e.item
+                if deadline is None:
+                    self._cond.wait()
+                else:
+                    remain = deadline - time.monotonic()
+                    if remain <= 0:
+                        return None
+                    self._cond.wait(remain)
+
+    def drops(self) -> int:
+        with self._cond:
+            return sum(c["dropped"] + c["overflow"] for c in self.counters.values())
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "depth": self._size,
+                "capacity": self.capacity,
+                "high_watermark": self.high_watermark,
+                "policies": {p: dict(c) for p, c in self.counters.items()},
+            }
+
+
+class Stage:
+    """EventQueue + ワーカースレッド 1 本。handler の例外はログに出して続行する。"""
+    def __init__(self, name: str, handler: Callable[[Any], None], *,
+                 capacity: int = 1000, put_timeout: float = 2.0, report_interval: float = 30.0,
+                 on_discard: Callable[[Any, str], None] | None = None):
+        self.name = name
+        self.handler = handler
+        self.queue = EventQueue(capacity, put_timeout, on_discard)
+        self.report_interval = report_interval
+        self._last_report = time.monotonic()
+        self._reported_drops = 0
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop.clear()
+        self._thread = threading.Thread(target=self._run, name=f"stage-{self.name}", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def put(self, item: Any, policy: str = POLICY_NEVER, key: Hashable | None = None) -> bool:
+        return self.queue.put(item, policy, key)
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            item = self.queue.get(timeout=1.0)
+            if item is not None:
+                try:
+                    self.handler(item)
+                except Exception:
+                    log.exception("[%s] handler error", self.name)
+            self._maybe_report()
+
+    def _maybe_report(self) -> None:
+        now = time.monotonic()
+        if now - self._last_report < self.report_interval:
+            return
+        self._last_report = now
+        drops = self.queue.drops()
+        if drops != self._reported_drops:
+            self._reported_drops = drops
+            log.warning("[%s] overloaded: %s", self.name, self.queue.stats())
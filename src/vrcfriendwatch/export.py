@@ -0,0 +1,56 @@
+from __future__ import annotations
+import csv, json, sys, time, logging
+from contextlib import contextmanager
+from typing import IO, Iterator
+from .vrchat_api import VRChatAPI
+
+log = logging.getLogger(__name__)
+
+# CSV の列 (JSONL はレコードをそのまま書く)
+CSV_FIELDS = ("id", "displayName", "status", "statusDescription", "location",
+              "last_platform", "last_login", "last_activity")
+FORMATS = ("jsonl", "csv")
+
+
+@contextmanager
+def _open_output(path: str | None) -> Iterator[IO[str]]:
+    if not path or path == "-":
+        yield sys.stdout
+    else:
+        with open(path, "w", encoding="utf-8", newline="") as fh:
+            yield fh
+
+
+def write_friends(friends, out: IO[str], fmt: str = "jsonl") -> int:
+    """
+    friends (イテレータ) を 1 件ずつ out に書く。メモリ使用量は件数に依存しない。
+    書いた件数を返す。
+    """
+    if fmt not in FORMATS:
+        raise ValueError(f"unknown export format: {fmt}")
+    count = 0
+    if fmt == "csv":
+        w = csv.DictWriter(out, fieldnames=CSV_FIELDS, extrasaction="ignore")
+        w.writeheader()
+        for f in friends:
+            w.writerow(f)
+            count += 1
+    else:
+        for f in friends:
+            out.write(json.dumps(f, ensure_ascii=False, separators=(",", ":")))
+            out.write("\n")
+            count += 1
+    return count
+
+
+def export_friends(api: VRChatAPI, path: str | None = None, fmt: str = "jsonl",
+                   online_only: bool = False) -> int:
+    """フレンド一覧をページ単位で取得しながら path (None/'-' なら stdout) に書き出す。"""
+    start = time.monotonic()
+    friends = api.iter_friends(offline=False) if online_only else api.iter_all_friends()
+    with _open_output(path) as out:
+        count = write_friends(friends, out, fmt)
+    elapsed = time.monotonic() - start
+    log.info("exported %d friends as %s in %.2fs (%.0f/s)",
+             count, fmt, elapsed, count / elapsed if elapsed > 0 else 0.0)
+    return count
@@ -8,10 +8,15 @@ import requests
 import pyotp
 import sys
 import random
+from requests.adapters import HTTPAdapter
+from urllib3.exceptions import NewConnectionError
 
 from .settings import SETTINGS
-from .paths import COOKIES_PATH
-from .rate_limiter import RateLimiter
+from .paths import COOKIES_PATH, RATE_LIMIT_PATH
+from .rate_limiter import RateLimiter, PRIORITY_INTERACTIVE
+from .shared_limiter import SharedRateLimiter
+from .clock import Clock, SYSTEM_CLOCK
+from .tracing import span
 
 log = logging.getLogger(__name__)
 
@@ -19,16 +24,67 @@ TOTP_VERIFY_URL  = "https://api.vrchat.cloud/api/1/auth/twofactorauth/totp/verif
 EMAIL_VERIFY_URL = "https://api.vrchat.cloud/api/1/auth/twofactorauth/emailotp/verify"
 
 
+# 一時的な失敗とみなしてリトライするステータス
+RETRY_STATUSES = (500, 502, 503, 504)
+# 接続系の一時エラー (タイムアウト含む)
+TRANSIENT_ERRORS = (requests.ConnectionError, requests.Timeout, requests.exceptions.ChunkedEncodingError)
+# 送り直しても結果が変わらないメソッド。それ以外 (POST: OTP の検証など) は届いたかもしれない失敗を再送しない
+IDEMPOTENT_METHODS = frozenset(("GET", "HEAD", "OPTIONS", "PUT", "DELETE"))
+
+
+def _never_sent(e: Exception) -> bool:
+    """接続を張る段階で失敗した (= リクエストはサーバに届いていない) か。"""
+    if isinstance(e, requests.ConnectTimeout):
+        return True
+    if isinstance(e, requests.ConnectionError) and not isinstance(e, requests.Timeout) and e.args:
+        return isinstance(getattr(e.args[0], "reason", None), NewConnectionError)
+    return False
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    """timeout 未指定のリクエストに既定の (connect, read) タイムアウトを付ける。self.s を直接使う箇所も含めて効く。"""
+    def __init__(self,*,timeout: tuple[float,float],**kw):
+        self.timeout = timeout
+        super().__init__(**kw)
+
+    def send(self,request,**kw):
+        if kw.get("timeout") is None:
+            kw["timeout"] = self.timeout
+        return super().send(request,**kw)
+
+
 class VRChatHTTP:
-    def __init__(self,limiter:RateLimiter | None = None) -> None:
+    def __init__(self,limiter:RateLimiter | None = None,
+                 clock: Clock | None = None,rng: random.Random | None = None) -> None:
+        # 時刻/待ちと乱数 (ジッター) は差し替え可能。シミュレーションで仮想時計と固定シードを渡す
+        self.clock = clock or SYSTEM_CLOCK
+        self.rng = rng or random.Random()
         self.s = requests.Session()
         self.s.headers["User-Agent"] = SETTINGS.user_agent
+        # 接続プール: 同時に走るワーカー (dispatch/同期/prefetch) 分だけ keep-alive を持てるように
+        self.adapter = TimeoutHTTPAdapter(
+            timeout=(SETTINGS.http_connect_timeout,SETTINGS.http_read_timeout),
+            pool_connections=4,pool_maxsize=SETTINGS.http_pool_size,max_retries=0,
+        )
+        self.s.mount("https://",self.adapter)
+        self.s.mount("http://",self.adapter)
+        self.retry_counts = {"429":0,"5xx":0,"conn":0}
+        # 最後に 401 以外 / 401 が返った時刻 (SessionManager がセッションの生死の判断に使う)
+        self.last_ok_at: float | None = None
+        self.last_401_at: float | None = None
         self._load_cookies()
 
         # Rate Limiter の規定値
-        rate_per_min = getattr(SETTINGS,"rate_limit_per_minute",60)
-        burst_cap = getattr(SETTINGS,"rate_burst_capacity",10)
-        self.limiter = limiter or RateLimiter(capacity=burst_cap,refill_rate=rate_per_min/60.0)
+        if limiter is None:
+            if SETTINGS.rate_limit_shared:
+                # 同じホスト (= 同じ IP) のウォッチャー全体で 1 つの枠を分け合う
+                limiter = SharedRateLimiter(SETTINGS.rate_limit_shared_path or RATE_LIMIT_PATH,
+                                            capacity=SETTINGS.rate_burst_capacity,
+                                            refill_rate=SETTINGS.rate_limit_per_minute/60.0,clock=self.clock)
+            else:
+                limiter = RateLimiter(capacity=SETTINGS.rate_burst_capacity,
+                                      refill_rate=SETTINGS.rate_limit_per_minute/60.0,clock=self.clock)
+        self.limiter = limiter
 
         # ETag フック
         self._if_none_match: str | None=None
@@ -58,40 +114,84 @@ class VRChatHTTP:
                 headers: dict | None = None,
                 auth: tuple[str,str] | None = None,
                 max_tries: int = 5,
-                base_sleep: float =0.6)->requests.Response:
+                base_sleep: float =0.6,
+                priority: int = PRIORITY_INTERACTIVE,
+                preacquired: bool = False)->requests.Response:
         local_headers = dict(headers or {})
         if self._if_none_match:
             local_headers["If-None-Match"] = self._if_none_match
 
         last: requests .Response | None = None
+        idempotent = method.upper() in IDEMPOTENT_METHODS
         for i in range(max_tries):
-            # 1) レートリミットを通す
-            self.limiter.acquire()
+            # 1) レートリミットを通す (priority ごとの FIFO に並ぶ)。try_acquire 済みなら初回だけ省く
+            if i or not preacquired:
+                with span("limiter.wait",priority=priority):
+                    self.limiter.acquire(priority=priority)
 
-            # 2)実リクエスト
-            resp = self.s.request(method,url,params=params,json=json,headers=local_headers,auth=auth)
+            # 2)実リクエスト (接続エラー/タイムアウトはバックオフして再試行)
+            try:
+                with span("http "+method,attempt=i+1) as sp:
+                    resp = self.s.request(method,url,params=params,json=json,headers=local_headers,auth=auth)
+                    sp.set(status=resp.status_code)
+            except TRANSIENT_ERRORS as e:
+                # 読み取りタイムアウトなどは、サーバが受け付けた後で応答だけ失われたかもしれない
+                if i >= max_tries-1 or not (idempotent or _never_sent(e)):
+                    raise
+                self.retry_counts["conn"] += 1
+                wait = base_sleep * (2 **i) + self.rng.uniform(0,0.5)
+                log.warning("%s on %s. Retrying in %.2fs (try %d/%d)",type(e).__name__,url,wait,i+1,max_tries)
+                with span("backoff",reason=type(e).__name__):
+                    self.clock.sleep(wait)
+                continue
             last = resp
 
+            if resp.status_code == 401:
+                self.last_401_at = self.clock.monotonic()
+            elif resp.status_code < 500:
+                self.last_ok_at = self.clock.monotonic()
+
             # ETagを保存
             self.last_response_etag =resp.headers.get("ETag") or resp.headers.get("Etag")or None
             self._if_none_match = None
 
-            # 429の扱い (Retry-After 優先)
-            if resp.status_code == 429 and i<max_tries-1:
+            # 429 / 5xx の扱い (Retry-After 優先)。5xx は処理されたか分からないので冪等なメソッドだけ
+            if (resp.status_code == 429 or (idempotent and resp.status_code in RETRY_STATUSES)) and i<max_tries-1:
                 ra = resp.headers.get("Retry-After")
                 try:
                     wait = float(ra) if ra is not None else base_sleep* (2**i)
                 except Exception:
                     wait = base_sleep * (2 **i)
-                wait += random.uniform(0,0.5) #ジッター
-                log.warning("429 on %s. Backing off for %.2fs (try %d%d)",url,wait,i+1,max_tries)
-                time.sleep(wait)
+                wait += self.rng.uniform(0,0.5) #ジッター
+                self.retry_counts["429" if resp.status_code == 429 else "5xx"] += 1
+                log.warning("%d on %s. Backing off for %.2fs (try %d/%d)",resp.status_code,url,wait,i+1,max_tries)
+                with span("backoff",reason=resp.status_code):
+                    self.clock.sleep(wait)
                 continue
 
             return resp
 
         return last
 
+    def pool_stats(self)->dict:
+        """keep-alive の再利用状況。reused = リクエスト数 - 新規接続数。"""
+        conns = reqs = 0
+        pools = self.adapter.poolmanager.pools
+        for key in list(pools.keys()):
+            pool = pools.get(key)
+            if pool is None:
+                continue
+            conns += pool.num_connections
+            reqs += pool.num_requests
+        return {
+            "requests": reqs,
+            "connections": conns,
+            "reused": max(0,reqs-conns),
+            "reuse_ratio": round((reqs-conns)/reqs,3) if reqs else 0.0,
+            "pool_maxsize": SETTINGS.http_pool_size,
+            "retries": dict(self.retry_counts),
+        }
+
     def get(self,url:str,**kw)->requests.Response:
         return self._request("GET",url,**kw)
 
@@ -102,13 +202,21 @@ class VRChatHTTP:
         # 既に _request() で rate limit & 429 リトライしているので、それを使うだけ
         return self.post(url, json=body, **kw)
 
+    def session_valid(self, priority: int = PRIORITY_INTERACTIVE) -> bool:
+        """/auth/user をレートリミット経由で叩いてセッションが生きているか確認。通信エラーは True 扱い。"""
+        try:
+            r = self.get("https://api.vrchat.cloud/api/1/auth/user", max_tries=2, priority=priority)
+        except Exception:
+            return True
+        return r.status_code != 401
+
     # --- auth/user ---
     def auth_user(self) -> dict:
-        r = self.s.get("https://api.vrchat.cloud/api/1/auth/user")
+        r = self.get("https://api.vrchat.cloud/api/1/auth/user", max_tries=3)
         if r.status_code == 401:
-            r = self.s.get(
+            r = self.get(
                 "https://api.vrchat.cloud/api/1/auth/user",
-                auth=(SETTINGS.username, SETTINGS.password),
+                auth=(SETTINGS.username, SETTINGS.password), max_tries=3,
             )
         r.raise_for_status()
         return r.json()
@@ -179,8 +287,9 @@ class VRChatHTTP:
         url = "https://api.vrchat.cloud/api/1/auth/twofactorauth/totp/verify"
         #今/前/次の3スロットを試す
         for offset in (0,-30,30):
-            code = pyotp.TOTP(secret).at(int(time.time())+offset)
-            resp = self.s.post(url,json={"code":code})
+            code = pyotp.TOTP(secret).at(int(self.clock.time())+offset)
+            # limiter を通す (429 は _request 側で Retry-After を待って再試行)
+            resp = self.post(url,json={"code":code},max_tries=3,base_sleep=3.0)
             try:
                 resp.raise_for_status()
             except requests.HTTPError:
@@ -204,9 +313,9 @@ class VRChatHTTP:
         try:
             data = self.auth_user()
         except Exception:
-            r = self.s.get(
+            r = self.get(
                 "https://api.vrchat.cloud/api/1/auth/user",
-                auth=(SETTINGS.username, SETTINGS.password),
+                auth=(SETTINGS.username, SETTINGS.password), max_tries=3,
             )
             r.raise_for_status()
             data = r.json()
@@ -267,4 +376,29 @@ class VRChatHTTP:
                 auth = new_auth
 
         self._save_cookies()
-        return auth, (data.get("displayName") if isinstance(data, dict) else "(unknown)")
\ No newline at end of file
+        return auth, (data.get("displayName") if isinstance(data, dict) else "(unknown)")
+
+    def auth_cookie_expires(self) -> float | None:
+        """auth クッキーの有効期限 (epoch 秒)。セッションクッキーなら None。"""
+        for c in self.s.cookies:
+            if c.name == "auth" and c.expires:
+                return float(c.expires)
+        return None
+
+    def relogin(self) -> tuple[str, str]:
+        """
+        別の Session でログインし直し、成功してから cookie を差し替える。
+        ログイン中も今の Session のリクエストはそのまま通り、失敗しても今の cookie は残る。
+        twoFactorAuth クッキーが生きていれば 2FA は省かれる。
+        """
+        fresh = VRChatHTTP(limiter=self.limiter,clock=self.clock,rng=self.rng)
+        try:
+            for c in list(fresh.s.cookies):
+                if c.name == "auth":
+                    fresh.s.cookies.clear(c.domain,c.path,c.name)
+            auth,name = fresh.ensure_login()
+            self.s.cookies.update(fresh.s.cookies)
+        finally:
+            fresh.s.close()
+        self.last_ok_at = self.clock.monotonic()
+        return auth,name
\ No newline at end of file
@@ -0,0 +1,112 @@
+from __future__ import annotations
+import sys
+from dataclasses import dataclass
+from functools import lru_cache
+
+# ワールドに居ない状態を表す location 値
+SPECIAL_LOCATIONS = ("offline", "private", "traveling")
+
+# インスタンスのアクセス種別
+ACCESS_PUBLIC = "public"
+ACCESS_FRIENDS_PLUS = "friends+"
+ACCESS_FRIENDS = "friends"
+ACCESS_INVITE_PLUS = "invite+"
+ACCESS_INVITE = "invite"
+ACCESS_GROUP_PUBLIC = "group-public"
+ACCESS_GROUP_PLUS = "group+"
+ACCESS_GROUP = "group"
+
+_GROUP_ACCESS = {"public": ACCESS_GROUP_PUBLIC, "plus": ACCESS_GROUP_PLUS, "members": ACCESS_GROUP}
+
+
+def intern_id(s: str | None) -> str | None:
+    """何千回も出てくる usr_/wrld_/grp_ ID を intern して同じ文字列オブジェクトを使い回す。"""
+    return sys.intern(s) if s else s
+
+
+@dataclass(frozen=True, slots=True)
+class Location:
+    """
+    location 文字列 (例: wrld_xxx:12345~private(usr_yyy)~canRequestInvite~region(jp)) の解析結果。
+    kind は "world" / "offline" / "private" / "traveling" / "unknown"。
+    """
+    raw: str
+    kind: str
+    world_id: str | None = None
+    instance_name: str | None = None
+    access: str | None = None
+    region: str | None = None
+    owner_id: str | None = None
+    group_id: str | None = None
+    # 同じインスタンスかどうかの判定用キー "wrld_xxx:12345" (nonce などは含めない)
+    instance_key: str | None = None
+
+    @property
+    def in_world(self) -> bool:
+        return self.kind == "world"
+
+    @property
+    def label(self) -> str:
+        """表示用の短い説明: 'invite+ jp' など。"""
+        if not self.in_world:
+            return self.kind
+        return " ".join(p for p in (self.access, self.region) if p)
+
+
+def _split_tag(tag: str) -> tuple[str, str | None]:
+    # "private(usr_xxx)" -> ("private", "usr_xxx")
+    name, sep, rest = tag.partition("(")
+    return name, (rest[:-1] if sep and rest.endswith(")") else None)
+
+
+@lru_cache(maxsize=4096)
+def parse_location(raw: str | None) -> Location:
+    """location を 1 回だけ解析する。同じ文字列はキャッシュから返す。"""
+    raw = raw or ""
+    if not raw:
+        return Location(raw, "unknown")
+    head = raw.split(":", 1)[0]
+    if head in SPECIAL_LOCATIONS:
+        return Location(sys.intern(raw), head)
+    if not head.startswith("wrld_"):
+        return Location(raw, "unknown")
+
+    world_id = intern_id(head)
+    rest = raw[len(head) + 1:] if ":" in raw else ""
+    parts = rest.split("~") if rest else []
+    instance_name = parts[0] if parts else None
+
+    access, region, owner_id, group_id = ACCESS_PUBLIC, None, None, None
+    can_request_invite = False
+    group_access = None
+    for tag in parts[1:]:
+        name, arg = _split_tag(tag)
+        if name == "hidden":
+            access, owner_id = ACCESS_FRIENDS_PLUS, arg
+        elif name == "friends":
+            access, owner_id = ACCESS_FRIENDS, arg
+        elif name == "private":
+            access, owner_id = ACCESS_INVITE, arg
+        elif name == "canRequestInvite":
+            can_request_invite = True
+        elif name == "group":
+            group_id = arg
+        elif name == "groupAccessType":
+            group_access = arg
+        elif name == "region":
+            region = arg
+    if not instance_name:
+        access = None
+    elif access == ACCESS_INVITE and can_request_invite:
+        access = ACCESS_INVITE_PLUS
+    if group_id and instance_name:
+        access = _GROUP_ACCESS.get(group_access or "members", ACCESS_GROUP)
+    if instance_name and region is None:
+        region = "us"  # region 指定なしは US
+
+    instance_key = f"{world_id}:{instance_name}" if instance_name else world_id
+    return Location(
+        sys.intern(raw), "world", world_id,
+        intern_id(instance_name), access, intern_id(region),
+        intern_id(owner_id), intern_id(group_id), intern_id(instance_key),
+    )
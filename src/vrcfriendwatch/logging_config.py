@@ -1,12 +1,169 @@
 from __future__ import annotations
-import logging, sys
+import logging, sys, os, gzip, shutil, time, random, atexit, queue
+from logging.handlers import QueueHandler, QueueListener, RotatingFileHandler
 from .paths import LOG_PATH
 
-def configure_logging(debug:bool = False)->None:
+_LISTENER: QueueListener | None = None
+_SAMPLER: "SamplingFilter | None" = None
+
+
+class SizeAndTimeRotatingFileHandler(RotatingFileHandler):
+    """
+    サイズ or 経過時間のどちらかを超えたらローテーションする FileHandler。
+    compress=True なら古いセグメントを .gz に圧縮する。
+    """
+    def __init__(self, filename, *, max_bytes: int, backup_count: int,
+                 interval_sec: float, compress: bool = True, encoding: str = "utf-8"):
+        super().__init__(filename, maxBytes=max_bytes, backupCount=backup_count, encoding=encoding)
+        self.interval_sec = float(interval_sec)
+        self.compress = compress
+        if compress:
+            self.namer = lambda name: name + ".gz"
+            self.rotator = self._gzip_rotator
+        try:
+            start = os.path.getmtime(filename)
+        except OSError:
+            start = time.time()
+        self.rollover_at = start + self.interval_sec if self.interval_sec > 0 else float("inf")
+
+    @staticmethod
+    def _gzip_rotator(source: str, dest: str) -> None:
+        with open(source, "rb") as fi, gzip.open(dest, "wb") as fo:
+            shutil.copyfileobj(fi, fo)
+        os.remove(source)
+
+    def shouldRollover(self, record) -> bool:
+        if time.time() >= self.rollover_at:
+            # 空ファイルを回しても意味がないので中身がある時だけ
+            if self.stream is None or self.stream.tell() > 0:
+                return True
+            self.rollover_at = time.time() + self.interval_sec
+        return bool(super().shouldRollover(record))
+
+    def doRollover(self) -> None:
+        if self.backupCount <= 0:
+            # RotatingFileHandler は backupCount=0 だと何も回さず開き直すだけなので、その場で空にする
+            if self.stream:
+                self.stream.close()
+                self.stream = None
+            with open(self.baseFilename, "w", encoding=self.encoding):
+                pass
+            if not self.delay:
+                self.stream = self._open()
+        else:
+            super().doRollover()
+        if self.interval_sec > 0:
+            self.rollover_at = time.time() + self.interval_sec
+
+
+class SamplingFilter(logging.Filter):
+    """
+    DEBUG 以下のレコードをロガー名のプレフィックスごとに間引く。
+    rates: {"vrcfriendwatch.ws_client": 0.1} なら 10% だけ通す。
+    """
+    def __init__(self, rates: dict[str, float]):
+        super().__init__()
+        self.set_rates(rates)
+
+    def set_rates(self, rates: dict[str, float]) -> None:
+        # 長いプレフィックスを優先してマッチさせる (差し替えは代入 1 回なので filter 中でも安全)
+        self.rates = sorted(rates.items(), key=lambda kv: len(kv[0]), reverse=True)
+
+    def _rate_for(self, name: str) -> float:
+        for prefix, rate in self.rates:
+            if name == prefix or name.startswith(prefix + "."):
+                return rate
+        return 1.0
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if record.levelno > logging.DEBUG or not self.rates:
+            return True
+        rate = self._rate_for(record.name)
+        return rate >= 1.0 or random.random() < rate
+
+
+def parse_sample_rates(spec: str | None) -> dict[str, float]:
+    """'a.b=0.1,c=0.5' 形式を dict に。壊れたエントリは無視する。"""
+    out: dict[str, float] = {}
+    for part in (spec or "").split(","):
+        name, sep, val = part.strip().partition("=")
+        if not sep or not name:
+            continue
+        try:
+            out[name.strip()] = max(0.0, min(1.0, float(val)))
+        except ValueError:
+            continue
+    return out
+
+
+def resolve_level(debug: bool, level: str = "") -> int:
+    """LOG_LEVEL が空なら DEBUG 設定に従う。"""
+    if level:
+        return logging.getLevelName(level.upper())
+    return logging.DEBUG if debug else logging.INFO
+
+
+def set_level(level: int) -> None:
+    """動作中にルートロガーのレベルを変える (設定の再読み込み用)。"""
+    logging.getLogger().setLevel(level)
+
+
+def set_sample_rates(rates: dict[str, float]) -> None:
+    """動作中にサンプリング率を差し替える。configure_logging 前なら何もしない。"""
+    if _SAMPLER is not None:
+        _SAMPLER.set_rates(rates)
+
+
+def configure_logging(debug:bool = False, *,
+                      level: str = "",
+                      max_bytes: int = 5 * 1024 * 1024,
+                      backup_count: int = 5,
+                      rotate_hours: float = 24.0,
+                      compress: bool = True,
+                      sample_rates: dict[str, float] | None = None,
+                      stream=None)->None:
+    """
+    ルートロガーには QueueHandler だけを付け、実際の I/O (stdout/ファイル) は
+    QueueListener のスレッドで行う。WebSocket スレッドでファイル書き込みを待たないため。
+    """
+    global _LISTENER, _SAMPLER
     fmt = "%(asctime)s [%(levelname)s] %(name)s: %(message)s"
-    level = logging.DEBUG if debug else logging.INFO
-    handlers = [
-        logging.StreamHandler(sys.stdout),
-        logging.FileHandler(LOG_PATH,encoding="utf-8"),
+    root_level = resolve_level(debug, level)
+    formatter = logging.Formatter(fmt)
+
+    sinks: list[logging.Handler] = [
+        logging.StreamHandler(stream or sys.stdout),
+        SizeAndTimeRotatingFileHandler(
+            LOG_PATH, max_bytes=max_bytes, backup_count=backup_count,
+            interval_sec=rotate_hours * 3600.0, compress=compress,
+        ),
     ]
-    logging.basicConfig(level=level,format=fmt,handlers=handlers)
\ No newline at end of file
+    for h in sinks:
+        h.setFormatter(formatter)
+
+    q: queue.SimpleQueue = queue.SimpleQueue()
+    qh = QueueHandler(q)
+    # 整形はリスナー側で行う (basicConfig に既定フォーマットを付けさせない)
+    qh.setFormatter(logging.Formatter("%(message)s"))
+    # 後から set_sample_rates で変えられるように、率が空でも付けておく
+    _SAMPLER = SamplingFilter(sample_rates or {})
+    qh.addFilter(_SAMPLER)
+
+    if _LISTENER is not None:
+        _LISTENER.stop()
+    _LISTENER = QueueListener(q, *sinks, respect_handler_level=True)
+    _LISTENER.start()
+
+    logging.basicConfig(level=root_level, handlers=[qh], force=True)
+
+
+def shutdown_logging() -> None:
+    """キューに残ったレコードを書き出してリスナーを止める。"""
+    global _LISTENER
+    if _LISTENER is not None:
+        _LISTENER.stop()
+        for h in _LISTENER.handlers:
+            h.close()
+        _LISTENER = None
+
+atexit.register(shutdown_logging)
@@ -1,23 +1,296 @@
 from __future__ import annotations
-from contextlib import redirect_stdout
-from io import StringIO
-import logging
+from dataclasses import dataclass, field, asdict
+from pathlib import Path
+import json, logging, threading, time, atexit
+import requests
+
+from .settings import SETTINGS
+from .paths import app_dir
+from .stats import Series
+from .event_queue import EventQueue, POLICY_SHED
+from .tracing import TRACER
 
 log = logging.getLogger(__name__)
 
 try:
-    from win11toast import toast as win_toast
+    # toast() は通知が閉じられるまで戻らないので、表示だけして戻る notify() を使う
+    from win11toast import notify as win_toast
     _HAS_WIN_TOAST = True
 except Exception:
     _HAS_WIN_TOAST =False
 
-def notify(title: str, msg:str , duration:int =5)->None:
-    if _HAS_WIN_TOAST:
-        buf = StringIO()
-        with redirect_stdout(buf):
-            if duration and duration>=25:
-                win_toast(title,msg,duration="long")
+
+@dataclass
+class Notification:
+    title: str
+    msg: str
+    duration: int = 5
+    ts: float = field(default_factory=time.time)
+
+
+# --- sinks ---
+class Sink:
+    """通知の出力先。send は例外を投げれば失敗扱いでリトライされる。"""
+    name = "sink"
+    # False なら timeout を「表示はされた」とみなして再送しない (同じ通知が何度も出ないように)
+    retry_on_timeout = True
+
+    def send(self, note: Notification) -> None:
+        raise NotImplementedError
+
+    def close(self) -> None:
+        pass
+
+
+class ToastSink(Sink):
+    """Windows トースト。win11toast が無い環境ではログに出すだけ。"""
+    name = "toast"
+    retry_on_timeout = False
+
+    def send(self, note: Notification) -> None:
+        # ワーカースレッドから呼ばれるので redirect_stdout はしない (プロセス全体の sys.stdout を奪ってしまう)
+        if _HAS_WIN_TOAST:
+            if note.duration and note.duration>=25:
+                win_toast(note.title,note.msg,duration="long")
             else:
-                win_toast(title,msg)
-    else:
-        log.info("[NOTIFY] %s - %s",title,msg)
\ No newline at end of file
+                win_toast(note.title,note.msg)
+        else:
+            log.info("[NOTIFY] %s - %s",note.title,note.msg)
+
+
+class StdoutSink(Sink):
+    name = "stdout"
+
+    def send(self, note: Notification) -> None:
+        print(f"[NOTIFY] {note.title} - {note.msg}", flush=True)
+
+
+class JsonlSink(Sink):
+    """1 通知 = 1 行の JSON を追記する。"""
+    name = "jsonl"
+
+    def __init__(self, path: Path):
+        self.path = Path(path)
+        self._fh = None
+
+    def send(self, note: Notification) -> None:
+        if self._fh is None:
+            self._fh = open(self.path, "a", encoding="utf-8")
+        self._fh.write(json.dumps(asdict(note), ensure_ascii=False) + "\n")
+        self._fh.flush()
+
+    def close(self) -> None:
+        if self._fh is not None:
+            self._fh.close()
+            self._fh = None
+
+
+class WebhookSink(Sink):
+    """ローカルの webhook に JSON を POST する。2xx 以外は失敗。"""
+    name = "webhook"
+
+    def __init__(self, url: str, timeout: float = 3.0):
+        self.url, self.timeout = url, float(timeout)
+        self.s = requests.Session()
+
+    def send(self, note: Notification) -> None:
+        r = self.s.post(self.url, json=asdict(note), timeout=self.timeout)
+        r.raise_for_status()
+
+
+# --- delivery ---
+class SinkWorker:
+    """
+    sink 1 つにつき専用スレッド + 有界キュー。
+    満杯なら古い通知から捨てるので、呼び出し側 (イベント処理) は待たされない。
+    """
+    def __init__(self, sink: Sink, *, capacity: int = 100, retries: int = 2,
+                 timeout: float = 5.0, retry_sleep: float = 1.0):
+        self.sink = sink
+        self.queue = EventQueue(capacity, on_discard=TRACER.discarder("sink:" + sink.name))
+        self.retries, self.timeout, self.retry_sleep = int(retries), float(timeout), float(retry_sleep)
+        self.latency = Series()      # enqueue → 配信完了
+        self.send_time = Series()    # send 1 回の所要時間
+        self.delivered = 0
+        self.failed = 0
+        self.timeouts = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name=f"sink-{sink.name}", daemon=True)
+        self._thread.start()
+
+    def submit(self, note: Notification) -> bool:
+        return self.queue.put((time.monotonic(), note, TRACER.hold("sink:" + self.sink.name)), POLICY_SHED)
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def join(self, timeout: float | None = None) -> bool:
+        """stop() の後に。配信中の 1 件 (send の timeout まで) を終えてスレッドが抜けたら True。"""
+        self._thread.join(timeout)
+        return not self._thread.is_alive()
+
+    def _send_with_timeout(self, note: Notification) -> None:
+        # send が固まってもワーカーは timeout で先に進む (固まったスレッドは daemon のまま放置)
+        err: list[BaseException] = []
+
+        def run():
+            try:
+                self.sink.send(note)
+            except BaseException as e:
+                err.append(e)
+
+        t = threading.Thread(target=run, name=f"sink-{self.sink.name}-send", daemon=True)
+        t.start()
+        t.join(self.timeout)
+        if t.is_alive():
+            self.timeouts += 1
+            raise TimeoutError(f"{self.sink.name} send timed out after {self.timeout:.1f}s")
+        if err:
+            raise err[0]
+
+    def _should_retry(self, i: int, e: Exception) -> bool:
+        """i 回目の失敗。まだ再送するなら待ってから True、諦めたら数えて False。"""
+        log.debug("[%s] send failed (try %d/%d): %s", self.sink.name, i+1, self.retries+1, e)
+        if i < self.retries and not self._stop.wait(self.retry_sleep * (2 ** i)):
+            return True
+        self.failed += 1
+        log.warning("[%s] notification dropped: %s", self.sink.name, e)
+        return False
+
+    def _deliver(self, queued_at: float, note: Notification) -> None:
+        for i in range(self.retries + 1):
+            start = time.monotonic()
+            try:
+                self._send_with_timeout(note)
+            except TimeoutError as e:
+                if self.sink.retry_on_timeout:
+                    if self._should_retry(i, e):
+                        continue
+                    return
+                log.debug("[%s] %s; treating as delivered", self.sink.name, e)
+            except Exception as e:
+                if self._should_retry(i, e):
+                    continue
+                return
+            now = time.monotonic()
+            self.send_time.add(now - start)
+            self.latency.add(now - queued_at)
+            self.delivered += 1
+            return
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            item = self.queue.get(timeout=1.0)
+            if item is not None:
+                queued_at, note, trace = item
+                with TRACER.stage(trace, "sink:" + self.sink.name):
+                    self._deliver(queued_at, note)
+
+    def stats(self) -> dict:
+        q = self.queue.stats()
+        return {
+            "delivered": self.delivered,
+            "failed": self.failed,
+            "timeouts": self.timeouts,
+            "dropped": q["policies"][POLICY_SHED]["dropped"],
+            "depth": q["depth"],
+            "latency": self.latency.as_dict(),
+            "send": self.send_time.as_dict(),
+        }
+
+
+class Notifier:
+    """全 sink に配る。publish はキューに積むだけで即座に戻る。"""
+    def __init__(self, sinks: list[Sink], **worker_kw):
+        self.workers = [SinkWorker(s, **worker_kw) for s in sinks]
+
+    def publish(self, note: Notification) -> None:
+        for w in self.workers:
+            w.submit(note)
+
+    def close(self, timeout: float = 2.0) -> None:
+        # 残っている通知を少しだけ待ってから止める
+        deadline = time.monotonic() + timeout
+        while any(len(w.queue) for w in self.workers) and time.monotonic() < deadline:
+            time.sleep(0.05)
+        for w in self.workers:
+            w.stop()
+        # 送信中の sink を閉じると書きかけが失敗 (dropped) になるので、抜けるのを待ってから
+        for w in self.workers:
+            if w.join(w.timeout + 1.5):
+                w.sink.close()
+            else:
+                log.warning("[%s] worker still sending; leaving the sink open", w.sink.name)
+
+    def stats(self) -> dict:
+        return {w.sink.name: w.stats() for w in self.workers}
+
+
+def build_sinks(spec: str) -> list[Sink]:
+    """'toast,stdout,jsonl,webhook' 形式から sink を作る。"""
+    sinks: list[Sink] = []
+    for name in (p.strip().lower() for p in (spec or "").split(",")):
+        if not name:
+            continue
+        if name == "toast":
+            sinks.append(ToastSink())
+        elif name == "stdout":
+            sinks.append(StdoutSink())
+        elif name == "jsonl":
+            sinks.append(JsonlSink(Path(SETTINGS.notify_jsonl_path or app_dir()/"notifications.jsonl")))
+        elif name == "webhook":
+            if SETTINGS.notify_webhook_url:
+                sinks.append(WebhookSink(SETTINGS.notify_webhook_url, timeout=SETTINGS.notify_timeout))
+            else:
+                log.warning("webhook sink requires NOTIFY_WEBHOOK_URL; skipped")
+        else:
+            log.warning("unknown notify sink: %s", name)
+    return sinks or [ToastSink()]
+
+
+_NOTIFIER: Notifier | None = None
+_NOTIFIER_LOCK = threading.Lock()
+
+
+def _build_notifier() -> Notifier:
+    return Notifier(
+        build_sinks(SETTINGS.notify_sinks),
+        capacity=SETTINGS.notify_queue_size,
+        retries=SETTINGS.notify_retries,
+        timeout=SETTINGS.notify_timeout,
+    )
+
+
+def get_notifier() -> Notifier:
+    global _NOTIFIER
+    with _NOTIFIER_LOCK:
+        if _NOTIFIER is None:
+            _NOTIFIER = _build_notifier()
+        return _NOTIFIER
+
+
+def reload_notifier() -> None:
+    """
+    設定の再読み込み用。新しい Notifier を作って差し替え、古い方はロックの外で閉じる
+    (閉じる間も notify() は新しい方に積めて待たされない)。
+    """
+    global _NOTIFIER
+    new = _build_notifier()
+    with _NOTIFIER_LOCK:
+        old, _NOTIFIER = _NOTIFIER, new
+    if old is not None:
+        old.close()
+
+
+def shutdown_notifier() -> None:
+    global _NOTIFIER
+    with _NOTIFIER_LOCK:
+        old, _NOTIFIER = _NOTIFIER, None
+    if old is not None:
+        old.close()
+
+atexit.register(shutdown_notifier)
+
+
+def notify(title: str, msg:str , duration:int =5)->None:
+    get_notifier().publish(Notification(title, msg, duration))
@@ -0,0 +1,105 @@
+from __future__ import annotations
+import threading, logging
+from typing import Callable
+from .location import Location, parse_location
+
+log = logging.getLogger(__name__)
+
+
+class OccupancyIndex:
+    """
+    ワールド / インスタンス → 在室フレンド集合の索引 (thread-safe)。
+    move / leave は O(1) で、ロスターを舐め直さずに「今どこに何人いるか」に答えられる。
+
+    threshold > 0 のとき、インスタンスの人数が threshold に達した瞬間に
+    on_gathering(location, members) を呼ぶ (threshold 未満に戻ったら再度発火可能)。
+    """
+    def __init__(self, threshold: int = 0,
+                 on_gathering: Callable[[Location, list[str]], None] | None = None):
+        self.threshold = int(threshold)
+        self.on_gathering = on_gathering
+        self.by_world: dict[str, set[str]] = {}
+        self.by_instance: dict[str, set[str]] = {}
+        self.where: dict[str, Location] = {}
+        self.lock = threading.Lock()
+        self.version = 0
+
+    def _discard_locked(self, uid: str) -> None:
+        old = self.where.pop(uid, None)
+        if old is None:
+            return
+        for index, key in ((self.by_world, old.world_id), (self.by_instance, old.instance_key)):
+            members = index.get(key)
+            if members is not None:
+                members.discard(uid)
+                if not members:
+                    del index[key]
+
+    def move(self, uid: str, location: str | None) -> None:
+        """uid の現在地を location にする。ワールド外 (offline/private など) なら索引から外す。"""
+        loc = parse_location(location)
+        fire: list[str] | None = None
+        with self.lock:
+            old = self.where.get(uid)
+            if old is not None and old.instance_key == loc.instance_key and loc.world_id:
+                return
+            self._discard_locked(uid)
+            if loc.world_id:
+                self.where[uid] = loc
+                self.by_world.setdefault(loc.world_id, set()).add(uid)
+                members = self.by_instance.setdefault(loc.instance_key, set())
+                members.add(uid)
+                if self.threshold > 0 and len(members) == self.threshold:
+                    fire = list(members)
+            self.version += 1
+        if fire is not None and self.on_gathering is not None:
+            try:
+                self.on_gathering(loc, fire)
+            except Exception:
+                log.exception("on_gathering failed")
+
+    def leave(self, uid: str) -> None:
+        with self.lock:
+            if uid in self.where:
+                self._discard_locked(uid)
+                self.version += 1
+
+    def seed(self, friends: dict[str, dict]) -> None:
+        """ロスターのスナップショット {uid: {"location": ...}} から作り直す (起動時に 1 回)。"""
+        with self.lock:
+            self.by_world.clear()
+            self.by_instance.clear()
+            self.where.clear()
+            for uid, rec in friends.items():
+                loc = parse_location(rec.get("location"))
+                if loc.world_id:
+                    self.where[uid] = loc
+                    self.by_world.setdefault(loc.world_id, set()).add(uid)
+                    self.by_instance.setdefault(loc.instance_key, set()).add(uid)
+            self.version += 1
+
+    def world_members(self, world_id: str) -> set[str]:
+        with self.lock:
+            return set(self.by_world.get(world_id, ()))
+
+    def instance_members(self, instance_key: str) -> set[str]:
+        with self.lock:
+            return set(self.by_instance.get(instance_key, ()))
+
+    def top_worlds(self, n: int = 10) -> list[tuple[str, int]]:
+        with self.lock:
+            counts = [(wid, len(m)) for wid, m in self.by_world.items()]
+        counts.sort(key=lambda kv: -kv[1])
+        return counts[:n]
+
+    def snapshot(self) -> dict[str, dict]:
+        """ワールドID → {count, instances: {instance_key: {access, region, friends}}} (人数の多い順)。"""
+        with self.lock:
+            result: dict[str, dict] = {}
+            for key, members in self.by_instance.items():
+                loc = self.where[next(iter(members))]
+                w = result.setdefault(loc.world_id, {"count": 0, "instances": {}})
+                w["count"] += len(members)
+                w["instances"][key] = {"access": loc.access, "region": loc.region,
+                                       "friends": sorted(members)}
+        return dict(sorted(result.items(), key=lambda kv: -kv[1]["count"]))
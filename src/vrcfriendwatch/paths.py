@@ -18,4 +18,8 @@ def app_dir()->Path:
 
 COOKIES_PATH = app_dir()/".vrchat_cookies.pkl"
 LOG_PATH = app_dir()/"app.log"
+CHECKPOINT_PATH = app_dir()/"state.ckpt"
+TRACE_PATH = app_dir()/"trace.json"
 
+CONFIG_PATH = app_dir()/"config.toml"
+RATE_LIMIT_PATH = app_dir()/"ratelimit.shm"
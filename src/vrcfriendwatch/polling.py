@@ -0,0 +1,222 @@
+from __future__ import annotations
+import logging, threading
+from typing import Callable
+from .vrchat_api import VRChatAPI
+from .records import FriendRecord
+from .roster import Roster
+from .reconnect import ReconnectPolicy
+from .rate_limiter import RateLimiter
+from .location import intern_id
+from .stats import Series
+from .clock import Clock, SYSTEM_CLOCK
+
+log = logging.getLogger(__name__)
+
+
+def diff_online(snapshot: dict[str, dict], online: dict[str, dict]) -> list[tuple[str, dict]]:
+    """
+    ロスターの状態 (Roster.snapshot()) とオンライン一覧を比べ、pipeline と同じ形の
+    (type, content) を返す。online/active 以外の相手が一覧から消えていたら friend-offline。
+    """
+    out: list[tuple[str, dict]] = []
+    for uid, f in online.items():
+        rec = FriendRecord.from_api(f)
+        if rec is None or rec.state == "offline":
+            continue
+        old = snapshot.get(uid) or {}
+        before = old.get("state")
+        content = {"userId": uid, "user": f, "location": rec.location}
+        if rec.state == "active":
+            if before != "active":
+                out.append(("friend-active", content))
+        elif before != "online":
+            out.append(("friend-online", content))
+        elif (rec.location or "") != (old.get("location") or ""):
+            out.append(("friend-location", content))
+        if before in ("online", "active") and (
+                (rec.status or None) != (old.get("status") or None)
+                or (rec.status_description or None) != (old.get("statusDescription") or None)):
+            out.append(("friend-update", {"userId": uid, "user": f, "status": rec.status,
+                                          "statusDescription": rec.status_description or ""}))
+    for uid, old in snapshot.items():
+        if old.get("state") in ("online", "active") and uid not in online:
+            out.append(("friend-offline", {"userId": uid}))
+    return out
+
+
+class PollingFallback:
+    """
+    pipeline に繋がらない間のつなぎ。オンラインのフレンド一覧をページごとの If-None-Match 付きで取り直し、
+    ロスターとの差分を WS と同じイベントにして ingest(type, content) に流す。
+
+    間隔は min_interval..max_interval 秒で、変化があれば半分に、無ければ 1.5 倍に。
+    ただしレート枠は budget_share の割合までしか使わない (1 回のページ数 / (補充レート * share) 秒より
+    短くしない)。表示用の解決が limiter で待たされている間はさらに倍にして譲る。
+    WS の接続が switch_back_after 秒続いたら自分で止まる。
+    """
+    def __init__(self, api: VRChatAPI, roster: Roster, ingest: Callable[[str, dict], None],
+                 reconnect: ReconnectPolicy, limiter: RateLimiter, clock: Clock | None = None,
+                 min_interval: float = 15.0, max_interval: float = 120.0, budget_share: float = 0.5,
+                 switch_back_after: float = 30.0, page_size: int = 100):
+        self.api, self.roster, self.ingest = api, roster, ingest
+        self.reconnect, self.limiter = reconnect, limiter
+        self.clock = clock or SYSTEM_CLOCK
+        self.min_interval, self.max_interval = float(min_interval), float(max_interval)
+        self.budget_share = float(budget_share)
+        self.switch_back_after = float(switch_back_after)
+        self.page_size = min(int(page_size), 100)
+        self.interval = self.min_interval
+        self._pages: dict[int, list] = {}
+        self._etags: dict[int, str] = {}
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.lock = threading.Lock()
+        self.entered_at: float | None = None
+        self.last_ok: float | None = None
+        self.activations = 0
+        self.polls = 0
+        self.requests = 0
+        self.not_modified = 0
+        self.errors = 0
+        self.changes = 0
+        self.degraded = Series()
+
+    @property
+    def active(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def start(self) -> None:
+        if self.active:
+            return
+        # WS が動いていた間にロスターは先へ進んでいるので、前回のページは使わない
+        self._pages.clear()
+        self._etags.clear()
+        self._stop.clear()
+        self.interval = self.min_interval
+        with self.lock:
+            self.entered_at = self.clock.monotonic()
+            self.last_ok = None
+            self.activations += 1
+        self._thread = threading.Thread(target=self._run, name="poll-fallback", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _fetch(self) -> tuple[dict[str, dict], bool, int] | None:
+        """全ページを取る。(uid → friend, 1 ページでも変わったか, ページ数)。失敗したら None。"""
+        n, offset, fresh = self.page_size, 0, False
+        online: dict[str, dict] = {}
+        while True:
+            i = offset // n
+            # 前のページが変わったら以降はずれているかもしれないので条件なしで取り直す
+            etag = None if fresh else self._etags.get(i)
+            chunk, new_etag = self.api.online_friends_page(offset, n, etag)
+            self.requests += 1
+            if chunk is None:
+                if new_etag is None or i not in self._pages:
+                    self.errors += 1
+                    return None
+                chunk = self._pages[i]
+                self.not_modified += 1
+            else:
+                fresh = True
+                self._pages[i] = chunk
+                if new_etag:
+                    self._etags[i] = new_etag
+                else:
+                    self._etags.pop(i, None)
+            for f in chunk:
+                uid = f.get("id") or f.get("userId")
+                if uid:
+                    online[intern_id(uid)] = f
+            if len(chunk) < n:
+                break
+            offset += n
+        for k in [k for k in self._pages if k > i]:
+            del self._pages[k]
+            self._etags.pop(k, None)
+        return online, fresh, i + 1
+
+    def poll_once(self) -> int:
+        """1 回ポーリングして流したイベント数を返す。"""
+        got = self._fetch()
+        self.polls += 1
+        if got is None:
+            self._adapt(0, 1)
+            return 0
+        online, fresh, pages = got
+        events = diff_online(self.roster.snapshot(), online) if fresh else []
+        for typ, content in events:
+            self.ingest(typ, content)
+        with self.lock:
+            self.last_ok = self.clock.monotonic()
+            self.changes += len(events)
+        self._adapt(len(events), pages)
+        log.debug("[POLL] %d pages (%s), %d changes, next in %.0fs",
+                  pages, "changed" if fresh else "304", len(events), self.interval)
+        return len(events)
+
+    def _adapt(self, changes: int, pages: int) -> None:
+        floor = max(self.min_interval, pages / (self.limiter.refill_rate * self.budget_share))
+        if self.limiter.waiting():
+            floor *= 2
+        if changes:
+            interval = self.interval / 2
+        else:
+            interval = min(self.max_interval, self.interval * 1.5)
+        # 枠の下限は max_interval より優先する
+        self.interval = max(floor, interval)
+
+    def _ws_healthy(self) -> bool:
+        connected_at = self.reconnect.connected_at
+        return connected_at is not None and self.clock.monotonic() - connected_at >= self.switch_back_after
+
+    def _run(self) -> None:
+        log.warning("[POLL] pipeline unavailable; polling online friends every %.0f-%.0fs",
+                    self.min_interval, self.max_interval)
+        while not self._stop.is_set() and not self._ws_healthy():
+            try:
+                self.poll_once()
+            except Exception as e:
+                self.errors += 1
+                log.warning("[POLL] poll failed: %s", e)
+            # WS の回復に早めに気付けるよう細切れに待つ
+            deadline = self.clock.monotonic() + self.interval
+            while not self._ws_healthy():
+                left = deadline - self.clock.monotonic()
+                if left <= 0 or self.clock.wait(self._stop, min(left, 5.0)):
+                    break
+        with self.lock:
+            lasted = self.clock.monotonic() - self.entered_at
+            self.degraded.add(lasted)
+            self.entered_at = None
+        log.info("[POLL] back on pipeline after %.0fs of polling (%d polls, %d changes)",
+                 lasted, self.polls, self.changes)
+
+    def staleness(self) -> float:
+        """今見えている在室状態が何秒前のものか。WS 接続中は 0。"""
+        now = self.clock.monotonic()
+        with self.lock:
+            if self.entered_at is not None:
+                return now - (self.last_ok if self.last_ok is not None else self.entered_at)
+        if self.reconnect.connected_at is not None:
+            return 0.0
+        since = self.reconnect.disconnected_at
+        return now - since if since is not None else 0.0
+
+    def stats(self) -> dict:
+        with self.lock:
+            polling = self.entered_at is not None
+        return {
+            "mode": "polling" if polling else "websocket",
+            "staleness": round(self.staleness(), 1),
+            "interval": round(self.interval, 1),
+            "activations": self.activations,
+            "polls": self.polls,
+            "requests": self.requests,
+            "not_modified": self.not_modified,
+            "errors": self.errors,
+            "changes": self.changes,
+            "degraded": self.degraded.as_dict(),
+        }
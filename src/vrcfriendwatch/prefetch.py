@@ -0,0 +1,200 @@
+from __future__ import annotations
+import logging, threading
+from collections import deque
+from .vrchat_api import VRChatAPI
+from .roster import Roster
+from .rate_limiter import RateLimiter, PRIORITY_PREFETCH
+from .location import parse_location
+from .clock import Clock, SYSTEM_CLOCK
+
+log = logging.getLogger(__name__)
+
+USER, WORLD = "user", "world"
+
+
+class Prefetcher:
+    """
+    名前/ワールド名キャッシュの先読み。
+
+    offer() (WS スレッド) はイベントの content を見て
+    - user オブジェクトの displayName / world オブジェクトの name はその場でキャッシュに入れ (API 不要)
+    - friend-online などで分かった居場所のワールドを先読みキューに積む (後の friend-location / gathering 用)
+    seed() は起動時のロスターから同じことをする。キューは新しいものから処理し、溢れたら古いものを捨てる。
+    ワーカーは limiter に待ち手が居らず、トークンが reserve 個より多く残っているときだけ
+    try_acquire(prefetch 優先度) で 1 つ取って取りに行く。表示用の解決の枠は奪わない。
+
+    dispatch 側は record_display() で「表示に必要な名前/ワールドが全部キャッシュにあったか」を記録し、
+    warm_ratio (上流に 1 度も問い合わせずに出せたイベントの割合) を stats() で返す。
+    """
+    def __init__(self, api: VRChatAPI, limiter: RateLimiter, clock: Clock | None = None,
+                 reserve: float = 2.0, capacity: int = 1000):
+        self.api, self.limiter = api, limiter
+        self.clock = clock or SYSTEM_CLOCK
+        self.reserve = float(reserve)
+        self.capacity = int(capacity)
+        self._queue: deque[tuple[str, str]] = deque()
+        self._pending: set[tuple[str, str]] = set()
+        self._cond = threading.Condition()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.seeded = 0
+        self.queued = 0
+        self.dropped = 0
+        self.fetched = 0
+        self.skipped = 0
+        self.failed = 0
+        self.displayed = 0
+        self.warm = 0
+
+    # --- 入口 (WS スレッド) ---
+    def _cached(self, key: tuple[str, str]) -> bool:
+        if key[0] == USER:
+            return self.api.names.peek(key[1]) is not None
+        # 取れなかったワールドは期限まで積み直さない
+        return self.api.worlds.peek(key[1]) is not None or self.api.world_missing(key[1])
+
+    def _push(self, kind: str, id_: str) -> None:
+        key = (kind, id_)
+        if key in self._pending or self._cached(key):
+            return
+        with self._cond:
+            if key in self._pending:
+                return
+            self._pending.add(key)
+            self._queue.appendleft(key)
+            self.queued += 1
+            if len(self._queue) > self.capacity:
+                self._pending.discard(self._queue.pop())
+                self.dropped += 1
+            self._cond.notify()
+
+    def _seed_name(self, uid: str, name, overwrite: bool = False) -> None:
+        if name and (self.api.names.peek(uid) is None or (overwrite and self.api.names.peek(uid) != name)):
+            self.api.names.put(uid, name)
+            self.seeded += 1
+
+    def offer(self, typ: str, uid: str | None, content: dict) -> None:
+        """
+        イベント 1 件分。O(1) でブロックしない。
+        このイベント自身の表示に要るもの (本人の名前, friend-location のワールド) は dispatch がすぐ引くので
+        キューには積まない (同じものを二重に取りに行かない)。
+        """
+        user = content.get("user")
+        if uid and isinstance(user, dict):
+            # イベントの方が新しいので改名も拾う
+            self._seed_name(uid, user.get("displayName"), overwrite=True)
+        location = content.get("location")
+        if not location and isinstance(user, dict):
+            location = user.get("location")
+        wid = parse_location(location).world_id
+        if wid:
+            world = content.get("world")
+            name = world.get("name") if isinstance(world, dict) else None
+            if name and self.api.worlds.peek(wid) != name:
+                self.api.worlds.put(wid, name)
+                self.seeded += 1
+            elif not name and typ != "friend-location":
+                self._push(WORLD, wid)
+
+    def seed(self, roster: Roster) -> None:
+        """起動時: ロスターの表示名をキャッシュへ、名前の無い相手と居場所のワールドを先読みキューへ。"""
+        for uid, rec in roster.snapshot().items():
+            if rec.get("displayName"):
+                self._seed_name(uid, rec["displayName"])
+            else:
+                self._push(USER, uid)
+            wid = parse_location(rec.get("location")).world_id
+            if wid:
+                self._push(WORLD, wid)
+
+    # --- 表示側 ---
+    def record_display(self, uids, location: str | None = None) -> None:
+        """表示の直前に呼ぶ。必要なものが全部キャッシュにあれば warm。"""
+        warm = all(self.api.names.peek(u) is not None for u in uids if u)
+        if warm and location:
+            wid = parse_location(location).world_id
+            warm = not wid or self._cached((WORLD, wid))
+        with self._cond:
+            self.displayed += 1
+            if warm:
+                self.warm += 1
+
+    # --- ワーカー ---
+    def _pop(self) -> tuple[str, str] | None:
+        with self._cond:
+            return self._queue.popleft() if self._queue else None
+
+    def _requeue(self, key: tuple[str, str]) -> None:
+        with self._cond:
+            self._queue.appendleft(key)
+
+    def step(self) -> bool:
+        """
+        先読みを 1 件進める。キューが空か、余っている枠が無ければ何もせず False。
+        (ワーカースレッドとシミュレーションから呼ぶ)
+        """
+        key = self._pop()
+        if key is None:
+            return False
+        if self._cached(key):
+            with self._cond:
+                self._pending.discard(key)
+            self.skipped += 1
+            return True
+        if not self.limiter.try_acquire(priority=PRIORITY_PREFETCH, reserve=self.reserve):
+            self._requeue(key)
+            return False
+        kind, id_ = key
+        try:
+            if kind == USER:
+                ok = bool(self.api.display_name(id_, preacquired=True, priority=PRIORITY_PREFETCH, max_tries=2))
+            else:
+                ok = self.api.world_name(id_, preacquired=True, priority=PRIORITY_PREFETCH, max_tries=2) != id_
+        except Exception as e:
+            ok = False
+            log.debug("[PREFETCH] %s %s failed: %s", kind, id_, e)
+        with self._cond:
+            self._pending.discard(key)
+        if ok:
+            self.fetched += 1
+        else:
+            self.failed += 1
+        return True
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="prefetch", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        with self._cond:
+            self._cond.notify()
+
+    def _run(self) -> None:
+        # 1 トークン貯まるくらいの間隔で様子を見る
+        idle = max(0.05, 1.0 / self.limiter.refill_rate)
+        while not self._stop.is_set():
+            if self.step():
+                continue
+            with self._cond:
+                if not self._queue:
+                    self._cond.wait(idle * 10)
+                    continue
+            self.clock.wait(self._stop, idle)
+
+    def stats(self) -> dict:
+        with self._cond:
+            return {
+                "pending": len(self._queue),
+                "seeded": self.seeded,
+                "queued": self.queued,
+                "dropped": self.dropped,
+                "fetched": self.fetched,
+                "skipped": self.skipped,
+                "failed": self.failed,
+                "displayed": self.displayed,
+                "warm": self.warm,
+                "warm_ratio": round(self.warm / self.displayed, 3) if self.displayed else 0.0,
+            }
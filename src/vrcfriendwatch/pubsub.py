@@ -0,0 +1,232 @@
+from __future__ import annotations
+import json, logging, os, socket, socketserver, threading
+from collections import deque
+from fnmatch import fnmatchcase
+try:
+    from socketserver import ThreadingUnixStreamServer
+except ImportError:  # Windows
+    ThreadingUnixStreamServer = None
+from .roster import EventLog
+
+log = logging.getLogger(__name__)
+
+
+class Subscriber:
+    def __init__(self, sock: socket.socket, topics: list[str] | None = None,
+                 users: list[str] | None = None, buffer: int = 1000, name: str = ""):
+        self.sock = sock
+        self.name = name
+        self.topics = tuple(topics or ("*",))
+        self.users = set(users) if users else None
+        self.buffer = int(buffer)
+        self._buf: deque[dict] = deque()
+        self._cond = threading.Condition()
+        self.closed = False
+        self.reason = ""
+        self.last_seq = 0
+        self.sent = 0
+
+    def matches(self, ev: dict) -> bool:
+        if self.users is not None and ev.get("userId") not in self.users:
+            return False
+        typ = ev.get("type") or ""
+        return any(fnmatchcase(typ, t) for t in self.topics)
+
+    def offer(self, ev: dict) -> bool:
+        """バッファに積む。溢れたら閉じて False (ブロックしない)。"""
+        with self._cond:
+            if self.closed:
+                return False
+            seq = ev.get("seq")
+            if seq is not None:
+                # 再送と live の重なりは seq で捨てる
+                if seq <= self.last_seq:
+                    return True
+                self.last_seq = seq
+            if len(self._buf) >= self.buffer:
+                self._close_locked("slow consumer")
+                return False
+            self._buf.append(ev)
+            self._cond.notify()
+            return True
+
+    def close(self, reason: str = "closed") -> None:
+        with self._cond:
+            self._close_locked(reason)
+
+    def _close_locked(self, reason: str) -> None:
+        if not self.closed:
+            self.closed, self.reason = True, reason
+            self._cond.notify()
+
+    def run(self) -> None:
+        """書き出しループ (接続ハンドラのスレッドで回す)。"""
+        try:
+            while True:
+                with self._cond:
+                    while not self._buf and not self.closed:
+                        self._cond.wait()
+                    batch = list(self._buf)
+                    self._buf.clear()
+                    closed, reason = self.closed, self.reason
+                if batch:
+                    self.sock.sendall(b"".join(_line(ev) for ev in batch))
+                    self.sent += len(batch)
+                if closed:
+                    if reason == "slow consumer":
+                        self.sock.sendall(_line({"type": "dropped", "reason": reason, "seq": self.last_seq}))
+                    return
+        except OSError as e:
+            log.debug("[PUBSUB] %s disconnected: %s", self.name, e)
+            self.close("disconnected")
+
+
+def _line(obj: dict) -> bytes:
+    return (json.dumps(obj, ensure_ascii=False, separators=(",", ":")) + "\n").encode("utf-8")
+
+
+class _Handler(socketserver.StreamRequestHandler):
+    broker: "PubSub"
+
+    def handle(self):
+        self.request.settimeout(self.broker.handshake_timeout)
+        try:
+            raw = self.rfile.readline(64 * 1024)
+            req = json.loads(raw) if raw.strip() else {}
+            if not isinstance(req, dict):
+                raise ValueError("subscribe request must be an object")
+        except (OSError, ValueError) as e:
+            try:
+                self.wfile.write(_line({"type": "error", "error": str(e)}))
+            except OSError:
+                pass
+            return
+        # 書き込みが詰まったら (相手が読まない) タイムアウトで切る
+        self.request.settimeout(self.broker.write_timeout)
+        sub = Subscriber(self.request, req.get("topics"), req.get("users"),
+                         buffer=self.broker.buffer, name=str(self.client_address))
+        self.broker.attach(sub, since=req.get("since"))
+        try:
+            sub.run()
+        finally:
+            self.broker.detach(sub)
+
+
+if ThreadingUnixStreamServer is not None:
+    class _UnixServer(ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            req, _ = super().get_request()
+            return req, ("unix", 0)
+
+
+class _TCPServer(socketserver.ThreadingTCPServer):
+    daemon_threads = True
+    allow_reuse_address = True
+
+
+class PubSub:
+    """
+    ローカル pub/sub。1 本の pipeline 接続で受けて名前/ワールド解決まで済んだイベント (EventLog と同じ形) を、
+    TCP (localhost) か Unix ソケット越しに複数の購読者へ改行区切り JSON で流す。
+    listen: "127.0.0.1:8766" 形式 / unix_path: 指定時はこちらを優先
+
+    購読者は接続直後に 1 行の JSON を送る (空行なら全部):
+        {"topics": ["friend-online", "friend-*"], "users": ["usr_..."], "since": 120}
+      topics: イベント type の glob (省略で全部) / users: userId で絞る / since: この seq より後から再送
+    サーバは最初に {"type": "hello", "head": 現在の seq, "oldest": 再送できる最古の seq} を返し、以降イベントを流す。
+    publish はブロックしない。buffer 件溢れた遅い購読者には {"type": "dropped"} を送って切断する。
+    """
+    def __init__(self, events: EventLog, listen: str = "127.0.0.1:8766", unix_path: str | None = None,
+                 buffer: int = 1000, handshake_timeout: float = 5.0, write_timeout: float = 10.0):
+        self.events = events
+        self.buffer = int(buffer)
+        self.handshake_timeout, self.write_timeout = float(handshake_timeout), float(write_timeout)
+        self.lock = threading.Lock()
+        self.subscribers: set[Subscriber] = set()
+        self.dropped = 0
+        self.total = 0
+        handler = type("Handler", (_Handler,), {"broker": self})
+        self.unix_path = unix_path
+        if unix_path and ThreadingUnixStreamServer is not None:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self.server = _UnixServer(unix_path, handler)
+            self.address = unix_path
+        else:
+            host, _, port = listen.rpartition(":")
+            self.server = _TCPServer((host or "127.0.0.1", int(port)), handler)
+            self.address = "%s:%d" % self.server.server_address[:2]
+        self._thread: threading.Thread | None = None
+
+    def attach(self, sub: Subscriber, since: int | None = None) -> None:
+        with self.lock:
+            self.subscribers.add(sub)
+            self.total += 1
+            # 登録してから再送分を積むので、その間の live イベントとは seq で重複を除ける
+            sub.offer({"type": "hello", "head": self.events.seq, "oldest": self.events.oldest})
+            if since is not None:
+                for ev in self.events.since(int(since)):
+                    if sub.matches(ev) and not sub.offer(ev):
+                        break
+        log.info("[PUBSUB] subscriber %s topics=%s since=%s", sub.name, list(sub.topics), since)
+
+    def detach(self, sub: Subscriber) -> None:
+        sub.close()
+        with self.lock:
+            self.subscribers.discard(sub)
+            if sub.reason == "slow consumer":
+                self.dropped += 1
+        if sub.reason == "slow consumer":
+            log.warning("[PUBSUB] dropped slow subscriber %s", sub.name)
+        else:
+            log.info("[PUBSUB] subscriber %s left (%s)", sub.name, sub.reason)
+
+    def publish(self, ev: dict) -> None:
+        with self.lock:
+            subs = list(self.subscribers)
+        for sub in subs:
+            if sub.matches(ev):
+                # 溢れたら offer 側で閉じる。後始末は購読者のスレッド (detach) で
+                sub.offer(ev)
+
+    def start(self) -> None:
+        self.events.listeners.append(self.publish)
+        self._thread = threading.Thread(target=self.server.serve_forever, name="pubsub", daemon=True)
+        self._thread.start()
+        log.info("[PUBSUB] listening on %s", self.address)
+
+    def stop(self) -> None:
+        if self.publish in self.events.listeners:
+            self.events.listeners.remove(self.publish)
+        with self.lock:
+            subs = list(self.subscribers)
+        for sub in subs:
+            sub.close("server shutdown")
+        self.server.shutdown()
+        self.server.server_close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {"subscribers": len(self.subscribers), "total": self.total, "dropped": self.dropped}
+
+
+def subscribe(address: str, topics: list[str] | None = None, users: list[str] | None = None,
+              since: int | None = None):
+    """
+    購読クライアント。address は "host:port" か Unix ソケットのパス。イベント dict を順に yield する。
+    """
+    if os.path.sep in address or not address.rpartition(":")[2].isdigit():
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        sock.connect(address)
+    else:
+        host, _, port = address.rpartition(":")
+        sock = socket.create_connection((host or "127.0.0.1", int(port)))
+    req = {k: v for k, v in (("topics", topics), ("users", users), ("since", since)) if v is not None}
+    with sock, sock.makefile("rb") as fh:
+        sock.sendall(_line(req))
+        for raw in fh:
+            yield json.loads(raw)
@@ -1,21 +1,47 @@
 from __future__ import annotations
-import time, threading , random
+import threading, asyncio
+from collections import deque
+from typing import Callable
+from .stats import Series
+from .clock import Clock, SYSTEM_CLOCK
+
+# 優先度クラス (小さいほど優先)。同じクラス内は到着順 (FIFO)
+PRIORITY_INTERACTIVE = 0   # 表示に必要な名前/ワールド解決など
+PRIORITY_RESYNC = 1        # 定期的な整合性チェック
+PRIORITY_PREFETCH = 2      # 先読み (余った枠だけ使う)
+PRIORITY_NAMES = ("interactive", "resync", "prefetch")
+
+
+class _Waiter:
+    __slots__ = ("tokens", "priority", "wake", "enqueued_at")
+
+    def __init__(self, tokens: float, priority: int, wake: Callable[[], None], now: float):
+        self.tokens, self.priority, self.wake, self.enqueued_at = tokens, priority, wake, now
+
 
 class RateLimiter:
     """
-    Token-bucket rate limiter (thread-safe).
+    Token-bucket rate limiter (thread-safe / asyncio 対応)。
     capacity: 最大トークン (=瞬間バーストの上限)
     refill_rate: 1秒あたりの補充トークン数 (=平均レート)
+    clock: 時刻と待ちの窓口 (シミュレーションでは VirtualClock)
+
+    待ち手は優先度クラスごとの FIFO に並び、トークンを待って眠るのは先頭の 1 人だけ。
+    先頭が取得したら次の先頭だけを起こすので、全員が一斉に起きて奪い合うことはない。
     """
-    def __init__(self,capacity: int,refill_rate: float):
+    def __init__(self,capacity: int,refill_rate: float,clock: Clock | None = None):
         if capacity <= 0 or refill_rate <=0:
             raise ValueError("capacity and refill_rate must be positive")
         self.capacity = float(capacity)
         self.refill_rate = float(refill_rate)
+        self.clock = clock or SYSTEM_CLOCK
         self.tokens = float(capacity)
-        self.last_refill = time.monotonic()
+        self.last_refill = self.clock.monotonic()
         self.lock = threading.Lock()
-        pass
+        self._queues: list[deque[_Waiter]] = [deque() for _ in PRIORITY_NAMES]
+        self.wait_time = [Series() for _ in PRIORITY_NAMES]
+        self.granted = [0 for _ in PRIORITY_NAMES]
+        self.abandoned = [0 for _ in PRIORITY_NAMES]
 
     def _refill_locked(self,now: float)->None:
         elapsed = now - self.last_refill
@@ -24,41 +50,192 @@ class RateLimiter:
             self.last_refill = now
 
     def _compute_wait_locked(self,need: float)->float:
-        if self.tokens >= need:
+        # 丸め誤差で 0.9999.. 止まりになり、極小の待ちを繰り返さないように
+        if self.tokens >= need - 1e-9:
             return 0.0
         return (need - self.tokens) / self.refill_rate
 
-    def try_acquire(self,tokens: float = 1.0) ->bool:
-        now = time.monotonic()
-        with self.lock:
-            self._refill_locked(now)
-            if self.tokens >= tokens:
-                self.tokens -= tokens
-                return True
-            return False
+    def _take_locked(self, need: float, priority: int, now: float, reserve: float = 0.0,
+                     head: _Waiter | None = None) -> float:
+        """
+        トークンの置き場への窓口 (SharedRateLimiter はここをファイル上のバケツに差し替える)。
+        need 個取った後に reserve 個残るなら取って 0.0、取れなければ待つべき秒数。
+        head: 列の先頭の待ち手として取りに来たとき (ファストパスでは None)
+        """
+        self._refill_locked(now)
+        wait = self._compute_wait_locked(need + reserve)
+        if wait > 0:
+            return wait
+        self.tokens = max(0.0, self.tokens - need)
+        return 0.0
+
+    def _head_left_locked(self) -> None:
+        """先頭の待ち手が取らずに列を抜けた (タイムアウト/キャンセル)。"""
 
+    def _set_rate_locked(self, capacity: float | None, refill_rate: float | None, now: float) -> None:
+        self._refill_locked(now)
+        if capacity is not None:
+            self.capacity = float(capacity)
+            self.tokens = min(self.tokens, self.capacity)
+        if refill_rate is not None:
+            self.refill_rate = float(refill_rate)
+
+    def _head_locked(self) -> _Waiter | None:
+        for q in self._queues:
+            if q:
+                return q[0]
+        return None
+
+    def _blocked_locked(self, priority: int) -> bool:
+        """priority 以上に優先される待ち手がいるか。"""
+        return any(self._queues[p] for p in range(priority + 1))
+
+    def _record_locked(self, priority: int, waited: float) -> None:
+        self.granted[priority] += 1
+        self.wait_time[priority].add(waited)
+
+    def _try_fast_locked(self, tokens: float, priority: int, now: float, reserve: float = 0.0) -> bool:
+        if not self._blocked_locked(priority) and self._take_locked(tokens, priority, now, reserve) == 0.0:
+            self._record_locked(priority, 0.0)
+            return True
+        return False
+
+    def _poll_locked(self, w: _Waiter, now: float) -> float | None:
+        """
+        w が先頭ならトークンを試す。取れたら 0.0、足りなければ待つべき秒数。
+        先頭でなければ None (起こされるまで待つ)。
+        """
+        if self._head_locked() is not w:
+            return None
+        wait = self._take_locked(w.tokens, w.priority, now, head=w)
+        if wait > 0:
+            return wait
+        self._queues[w.priority].popleft()
+        self._record_locked(w.priority, now - w.enqueued_at)
+        nxt = self._head_locked()
+        if nxt is not None:
+            nxt.wake()
+        return 0.0
+
+    def _abandon_locked(self, w: _Waiter) -> None:
+        was_head = self._head_locked() is w
+        try:
+            self._queues[w.priority].remove(w)
+        except ValueError:
+            return
+        self.abandoned[w.priority] += 1
+        if was_head:
+            self._head_left_locked()
+            nxt = self._head_locked()
+            if nxt is not None:
+                nxt.wake()
+
+    def _enqueue_locked(self, w: _Waiter) -> None:
+        old_head = self._head_locked()
+        self._queues[w.priority].append(w)
+        # 割り込んで先頭になったら、元の先頭は次に起こされるまで眠ればよい
+        if old_head is not None and self._head_locked() is w:
+            old_head.wake()
+
+    def try_acquire(self,tokens: float = 1.0, priority: int = PRIORITY_INTERACTIVE, reserve: float = 0.0) ->bool:
+        """
+        待たずに取れるときだけ取る。同じか上の優先度の待ち手がいれば譲る。
+        reserve: 取った後にこれだけ残らないなら取らない (先読みがバースト枠を食い潰さないように)
+        """
+        now = self.clock.monotonic()
+        with self.lock:
+            return self._try_fast_locked(tokens, priority, now, reserve)
 
-    def acquire(self,tokens: float =1.0, cancel_event: threading.Event | None = None,timeout: float | None = None)->bool:
-        start = time.monotonic()
+    def acquire(self,tokens: float =1.0, cancel_event: threading.Event | None = None,timeout: float | None = None,
+                priority: int = PRIORITY_INTERACTIVE)->bool:
+        start = self.clock.monotonic()
+        with self.lock:
+            if self._try_fast_locked(tokens, priority, start):
+                return True
+            ev = threading.Event()
+            w = _Waiter(tokens, priority, ev.set, start)
+            self._enqueue_locked(w)
         while True:
-            now = time.monotonic()
             with self.lock:
-                self._refill_locked(now)
-                wait = self._compute_wait_locked(tokens)
-                if wait <= 0:
-                    self.tokens -= tokens
+                now = self.clock.monotonic()
+                wait = self._poll_locked(w, now)
+                if wait == 0.0:
                     return True
-            jitter = random.uniform(0,0.02)
-            sleep_for = wait + jitter
-
-            if timeout is not None:
-                remain = timeout - (now -start)
-                if remain <=0:
-                    return False
-                sleep_for = min(sleep_for,remain)
-
+                if timeout is not None:
+                    remain = timeout - (now - start)
+                    if remain <= 0:
+                        self._abandon_locked(w)
+                        return False
+                    wait = remain if wait is None else min(wait, remain)
+                ev.clear()
             if cancel_event is not None:
-                if cancel_event.wait(sleep_for):
+                # Event を 2 つ同時には待てないので短く区切って cancel を見る
+                self.clock.wait(ev, 0.05 if wait is None else min(wait, 0.05))
+                if cancel_event.is_set():
+                    with self.lock:
+                        self._abandon_locked(w)
                     return False
             else:
-                time.sleep(sleep_for)
\ No newline at end of file
+                self.clock.wait(ev, wait)
+
+    async def acquire_async(self, tokens: float = 1.0, timeout: float | None = None,
+                            priority: int = PRIORITY_INTERACTIVE) -> bool:
+        """asyncio 用の acquire。スレッド側の待ち手と同じ列に並ぶ。"""
+        start = self.clock.monotonic()
+        with self.lock:
+            if self._try_fast_locked(tokens, priority, start):
+                return True
+            loop = asyncio.get_running_loop()
+            ev = asyncio.Event()
+            w = _Waiter(tokens, priority, lambda: loop.call_soon_threadsafe(ev.set), start)
+            self._enqueue_locked(w)
+        try:
+            while True:
+                with self.lock:
+                    now = self.clock.monotonic()
+                    wait = self._poll_locked(w, now)
+                    if wait == 0.0:
+                        return True
+                    if timeout is not None:
+                        remain = timeout - (now - start)
+                        if remain <= 0:
+                            self._abandon_locked(w)
+                            return False
+                        wait = remain if wait is None else min(wait, remain)
+                    ev.clear()
+                try:
+                    await asyncio.wait_for(ev.wait(), wait)
+                except asyncio.TimeoutError:
+                    pass
+        except asyncio.CancelledError:
+            with self.lock:
+                self._abandon_locked(w)
+            raise
+
+    def reconfigure(self, capacity: int | None = None, refill_rate: float | None = None) -> None:
+        """
+        動作中に容量/補充レートを変える。それまでの経過分は古いレートで補充してから切り替え、
+        先頭の待ち手を起こして待ち時間を計算し直させる。
+        """
+        if (capacity is not None and capacity <= 0) or (refill_rate is not None and refill_rate <= 0):
+            raise ValueError("capacity and refill_rate must be positive")
+        with self.lock:
+            self._set_rate_locked(capacity, refill_rate, self.clock.monotonic())
+            head = self._head_locked()
+            if head is not None:
+                head.wake()
+
+    def close(self) -> None:
+        """SharedRateLimiter 用。プロセス内のバケツでは何もしない。"""
+
+    def waiting(self) -> int:
+        with self.lock:
+            return sum(len(q) for q in self._queues)
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                name: {"granted": self.granted[i], "abandoned": self.abandoned[i],
+                       "waiting": len(self._queues[i]), "wait": self.wait_time[i].as_dict()}
+                for i, name in enumerate(PRIORITY_NAMES)
+            }
@@ -0,0 +1,155 @@
+from __future__ import annotations
+import random, threading, logging
+from .stats import Series
+from .clock import Clock, SYSTEM_CLOCK
+
+log = logging.getLogger(__name__)
+
+# サーバ側からの正常クローズ。続けて来なければ待たずに繋ぎ直す
+CLEAN_CLOSE_CODES = (1000, 1001)
+
+
+class ReconnectPolicy:
+    """
+    接続の健康状態を見て再接続までの待ち時間を決める。
+    - stable_after 秒以上続いた接続の後は backoff を初期値に戻す
+    - サーバの正常クローズ (1000/1001) は即再接続。ただし stable_after 未満の接続で続けて来たら
+      (トークン拒否やメンテナンス中) 通常の backoff に回し、失敗として数える
+    - 失敗が続く間は base から cap まで倍々 + ジッター
+    """
+    def __init__(self, base: float = 1.0, cap: float = 30.0, stable_after: float = 120.0,
+                 clock: Clock | None = None, rng: random.Random | None = None):
+        self.base, self.cap, self.stable_after = float(base), float(cap), float(stable_after)
+        self.clock = clock or SYSTEM_CLOCK
+        self.rng = rng or random.Random()
+        self.backoff = self.base
+        self.lock = threading.Lock()
+        self.connected_at: float | None = None
+        self.disconnected_at: float | None = None
+        self.last_activity: float | None = None
+        self._gap_start: float | None = None
+        self.close_code: int | None = None
+        # 一度も開かずに終わった (か、開いてすぐ正常クローズされた) 接続試行の連続回数
+        self.failures = 0
+        # stable_after 未満で正常クローズされた接続の連続回数
+        self.clean_streak = 0
+        self.reconnect_latency = Series()
+        self.gap = Series()
+        self.sessions = Series()
+
+    def on_connected(self) -> None:
+        now = self.clock.monotonic()
+        with self.lock:
+            self.connected_at = now
+            self.last_activity = now
+            self.close_code = None
+            if self.disconnected_at is not None:
+                self.reconnect_latency.add(now - self.disconnected_at)
+            if self._gap_start is not None:
+                self.gap.add(now - self._gap_start)
+                self._gap_start = None
+
+    def on_activity(self) -> None:
+        self.last_activity = self.clock.monotonic()
+
+    def on_closed(self, code: int | None) -> None:
+        with self.lock:
+            self.close_code = code
+
+    def on_disconnected(self) -> None:
+        """run_forever から戻ったときに呼ぶ。"""
+        now = self.clock.monotonic()
+        with self.lock:
+            if self.connected_at is not None:
+                lived = now - self.connected_at
+                self.sessions.add(lived)
+                clean = self.close_code in CLEAN_CLOSE_CODES
+                if lived >= self.stable_after:
+                    self.backoff = self.base
+                    self.failures = 0
+                    self.clean_streak = 1 if clean else 0
+                elif clean:
+                    self.clean_streak += 1
+                    if self.clean_streak > 1:
+                        self.failures += 1
+                else:
+                    self.failures = 0
+                    self.clean_streak = 0
+            else:
+                self.failures += 1
+            if self._gap_start is None:
+                # 最後に何か受け取った時点からイベントが見えていない
+                self._gap_start = self.last_activity if self.last_activity is not None else now
+            self.disconnected_at = now
+            self.connected_at = None
+            # 次の接続が開くまで watchdog に古い値を見せない
+            self.last_activity = None
+
+    def next_delay(self) -> float:
+        with self.lock:
+            clean, self.close_code = self.close_code in CLEAN_CLOSE_CODES, None
+            if clean and self.clean_streak <= 1:
+                return 0.0
+            delay = min(self.backoff, self.cap) + self.rng.uniform(0, 1.0)
+            self.backoff = min(self.backoff * 2, self.cap)
+            return delay
+
+    def reset(self) -> None:
+        with self.lock:
+            self.backoff = self.base
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "backoff": self.backoff,
+                "failures": self.failures,
+                "clean_streak": self.clean_streak,
+                "reconnect_latency": self.reconnect_latency.as_dict(),
+                "gap": self.gap.as_dict(),
+                "sessions": self.sessions.as_dict(),
+            }
+
+
+class StallWatchdog:
+    """
+    アプリ層の無通信を監視する。stall_after 秒何も来なければ ping を打ち、
+    さらに grace 秒以内に pong もメッセージも来なければ接続を閉じる。
+    """
+    def __init__(self, policy: ReconnectPolicy, close, ping,
+                 stall_after: float = 30.0, grace: float = 10.0, tick: float = 1.0):
+        self.policy, self.close, self.ping = policy, close, ping
+        self.stall_after, self.grace, self.tick = float(stall_after), float(grace), float(tick)
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="ws-watchdog", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _run(self) -> None:
+        pinged_for: float | None = None
+        while not self._stop.wait(self.tick):
+            last = self.policy.last_activity
+            if last is None:
+                continue
+            silent = self.policy.clock.monotonic() - last
+            if silent < self.stall_after:
+                pinged_for = None
+                continue
+            if pinged_for != last:
+                pinged_for = last
+                try:
+                    self.ping()
+                except Exception as e:
+                    log.debug("watchdog ping failed: %s", e)
+                continue
+            if silent >= self.stall_after + self.grace:
+                log.warning("[WS] no traffic for %.1fs; closing stalled connection", silent)
+                try:
+                    self.close()
+                except Exception as e:
+                    log.debug("watchdog close failed: %s", e)
+                return
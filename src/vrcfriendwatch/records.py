@@ -0,0 +1,73 @@
+from __future__ import annotations
+import sys
+from .location import intern_id, parse_location
+
+# API のキー名 → スロット名 (ウォッチャーが使うものだけ)
+_API_KEYS = {
+    "displayName": "display_name",
+    "status": "status",
+    "statusDescription": "status_description",
+    "location": "location",
+    "state": "state",
+}
+
+
+class FriendRecord:
+    """
+    フレンド 1 人分のコンパクトな表現。API の dict 全体 (bio, tags, 画像 URL ...) は持たず、
+    __slots__ と intern 済み文字列で 1 件あたりのメモリを抑える。
+    """
+    __slots__ = ("id", "display_name", "status", "status_description", "location", "state")
+
+    def __init__(self, id: str, display_name: str | None = None, status: str | None = None,
+                 status_description: str | None = None, location: str | None = None,
+                 state: str | None = None):
+        self.id = intern_id(id)
+        self.display_name = display_name
+        self.status = sys.intern(status) if status else status
+        self.status_description = status_description or None
+        # location は parse_location のキャッシュと同じ intern 済み文字列を使う
+        self.location = parse_location(location).raw if location else location
+        self.state = sys.intern(state) if state else state
+
+    @classmethod
+    def from_api(cls, d: dict) -> "FriendRecord | None":
+        uid = d.get("id") or d.get("userId")
+        if not uid:
+            return None
+        location = d.get("location")
+        state = d.get("state") or ("offline" if (location or "offline") == "offline" else "online")
+        return cls(uid, d.get("displayName"), d.get("status"),
+                   d.get("statusDescription"), location, state)
+
+    def update(self, fields: dict) -> None:
+        """API 形式のキー (displayName など) で部分更新する。"""
+        for k, v in fields.items():
+            slot = _API_KEYS.get(k)
+            if slot is None:
+                continue
+            if slot == "location" and v:
+                v = parse_location(v).raw
+            elif slot in ("status", "state") and v:
+                v = sys.intern(v)
+            setattr(self, slot, v)
+
+    def as_tuple(self) -> tuple:
+        """__slots__ の順のタプル (チェックポイント用)。"""
+        return (self.id, self.display_name, self.status, self.status_description, self.location, self.state)
+
+    @classmethod
+    def from_tuple(cls, t: tuple) -> "FriendRecord":
+        return cls(*t)
+
+    def as_dict(self) -> dict:
+        """API と同じキー名の dict (None は省く)。"""
+        out = {}
+        for k, slot in _API_KEYS.items():
+            v = getattr(self, slot)
+            if v is not None:
+                out[k] = v
+        return out
+
+    def __repr__(self) -> str:
+        return f"FriendRecord({self.id!r}, {self.display_name!r}, state={self.state!r})"
@@ -0,0 +1,196 @@
+from __future__ import annotations
+import threading, logging, time
+from collections import deque
+from typing import Callable
+from .vrchat_api import VRChatAPI
+from .records import FriendRecord
+from .location import intern_id
+
+log = logging.getLogger(__name__)
+
+# ロスターに残すフィールド (API の応答全体は持たない)
+_FIELDS = ("displayName", "status", "statusDescription", "location")
+
+
+def _user_fields(content: dict) -> dict:
+    """イベント content から user オブジェクトの必要なフィールドだけ抜く。"""
+    user = content.get("user") if isinstance(content.get("user"), dict) else {}
+    out = {k: user[k] for k in _FIELDS if user.get(k) is not None}
+    for k in ("status", "statusDescription", "location"):
+        if content.get(k) is not None:
+            out[k] = content[k]
+    return out
+
+
+class Roster:
+    """
+    フレンド集合と各フレンドの最新状態 (thread-safe)。
+    ids は WSRunner のフィルタがそのまま参照するので、作り直さず in-place で更新する。
+    """
+    def __init__(self, ids: set[str] | None = None):
+        self.ids: set[str] = ids if ids is not None else set()
+        self.friends: dict[str, FriendRecord] = {}
+        self.lock = threading.Lock()
+        self.version = 0
+
+    def __len__(self) -> int:
+        return len(self.ids)
+
+    def __contains__(self, uid: str) -> bool:
+        return uid in self.ids
+
+    def get(self, uid: str) -> dict | None:
+        with self.lock:
+            rec = self.friends.get(uid)
+            return rec.as_dict() if rec is not None else None
+
+    def location_of(self, uid: str) -> str | None:
+        with self.lock:
+            rec = self.friends.get(uid)
+            return rec.location if rec is not None else None
+
+    def snapshot(self) -> dict[str, dict]:
+        with self.lock:
+            return {uid: rec.as_dict() for uid, rec in self.friends.items()}
+
+    def records(self) -> list[tuple]:
+        """全レコードを FriendRecord.as_tuple() の形で (チェックポイント用)。"""
+        with self.lock:
+            return [rec.as_tuple() for rec in self.friends.values()]
+
+    def upsert(self, uid: str, **fields) -> None:
+        with self.lock:
+            self.ids.add(uid)
+            rec = self.friends.get(uid)
+            if rec is None:
+                rec = self.friends[uid] = FriendRecord(uid)
+            rec.update(fields)
+            self.version += 1
+
+    def seed(self, friend: dict) -> None:
+        """friends API のレコード 1 件から登録する。"""
+        rec = FriendRecord.from_api(friend)
+        if rec is None:
+            return
+        with self.lock:
+            self.ids.add(rec.id)
+            self.friends[rec.id] = rec
+            self.version += 1
+
+    def remove(self, uid: str) -> FriendRecord | None:
+        with self.lock:
+            self.ids.discard(uid)
+            self.version += 1
+            return self.friends.pop(uid, None)
+
+    def apply_event(self, typ: str, uid: str, content: dict) -> None:
+        """pipeline イベント 1 件をロスターに反映する。O(1)。"""
+        if typ == "friend-delete":
+            self.remove(uid)
+            return
+        if typ != "friend-add" and uid not in self.ids:
+            return
+        fields = _user_fields(content)
+        if typ == "friend-online":
+            fields["state"] = "online"
+        elif typ == "friend-offline":
+            fields["state"] = "offline"
+            fields["location"] = "offline"
+        elif typ == "friend-active":
+            # Web/アプリでアクティブ (ゲーム内ではない)
+            fields["state"] = "active"
+            fields["location"] = "offline"
+        self.upsert(uid, **fields)
+
+    def reconcile(self, live_ids: set[str]) -> tuple[set[str], set[str]]:
+        """サーバ側の ID 集合に合わせる。(追加, 削除) を返す。"""
+        with self.lock:
+            added = live_ids - self.ids
+            removed = self.ids - live_ids
+            for uid in map(intern_id, added):
+                self.ids.add(uid)
+                self.friends.setdefault(uid, FriendRecord(uid))
+            for uid in removed:
+                self.ids.discard(uid)
+                self.friends.pop(uid, None)
+            if added or removed:
+                self.version += 1
+        return added, removed
+
+
+class EventLog:
+    """
+    直近イベントのリングバッファ。各イベントに連番 seq を振る。
+    since(seq) でそれより新しいものだけ取れる。
+    """
+    def __init__(self, maxlen: int = 500):
+        self._buf: deque[dict] = deque(maxlen=maxlen)
+        self.lock = threading.Lock()
+        self.seq = 0
+        # append のたびに呼ばれる (pub/sub への転送など)。速く終わること
+        self.listeners: list[Callable[[dict], None]] = []
+
+    def append(self, typ: str, uid: str | None, **fields) -> dict:
+        with self.lock:
+            self.seq += 1
+            ev = {"seq": self.seq, "ts": time.time(), "type": typ, "userId": uid, **fields}
+            self._buf.append(ev)
+        for fn in self.listeners:
+            try:
+                fn(ev)
+            except Exception:
+                log.exception("event listener failed")
+        return ev
+
+    @property
+    def oldest(self) -> int:
+        """バッファに残っている最古の seq (空なら次に振る seq)。"""
+        with self.lock:
+            return self._buf[0]["seq"] if self._buf else self.seq + 1
+
+    def since(self, seq: int = 0, limit: int | None = None) -> list[dict]:
+        """seq より後のイベントを古い順に。limit 指定時は先頭の limit 件 (続きは最後の seq から取る)。"""
+        with self.lock:
+            out = [ev for ev in self._buf if ev["seq"] > seq]
+        return out[:limit] if limit else out
+
+
+class RosterSync:
+    """
+    interval 秒ごとに /auth/user の friends 配列を If-None-Match 付きで確認し、
+    取りこぼした friend-add / friend-delete を補正する。変化がなければ 304 で終わる。
+    """
+    def __init__(self, api: VRChatAPI, roster: Roster, interval: float = 900.0,
+                 on_removed: Callable[[set[str]], None] | None = None):
+        self.api, self.roster, self.interval = api, roster, float(interval)
+        self.on_removed = on_removed
+        self.etag: str | None = None
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        if self.interval <= 0 or (self._thread and self._thread.is_alive()):
+            return
+        self._thread = threading.Thread(target=self._run, name="roster-sync", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def check_once(self) -> tuple[set[str], set[str]]:
+        ids, self.etag = self.api.friend_ids_conditional(self.etag)
+        if ids is None:
+            return set(), set()
+        added, removed = self.roster.reconcile(ids)
+        if added or removed:
+            log.info("[ROSTER] resync: +%d -%d", len(added), len(removed))
+        if removed and self.on_removed is not None:
+            self.on_removed(removed)
+        return added, removed
+
+    def _run(self) -> None:
+        while not self._stop.wait(self.interval):
+            try:
+                self.check_once()
+            except Exception as e:
+                log.warning("[ROSTER] resync failed: %s", e)
@@ -0,0 +1,152 @@
+from __future__ import annotations
+import logging, threading
+from .http_client import VRChatHTTP
+from .rate_limiter import PRIORITY_RESYNC
+from .settings import SETTINGS
+from .stats import Series
+from .clock import Clock, SYSTEM_CLOCK
+
+log = logging.getLogger(__name__)
+
+
+class SessionManager:
+    """
+    auth トークンを裏で見張り、再接続ループには常に使えるトークンを渡す。
+    - 普段のリクエストが 401 以外で返っていれば生きているとみなし、check_interval 秒
+      何も通っていない (アイドル) ときだけ /auth/user で確かめる (resync 優先度)
+    - 401 を見たら、またはトークンが refresh_after 秒経つか cookie の期限まで margin 秒を切ったら、
+      別 Session でログインし直して (TOTP も limiter 経由) cookie とトークンを差し替える
+    - WS が切れたら on_disconnected() で起こすので、backoff で寝ている間に確認が済む
+
+    メール OTP しか使えない (TOTP 未設定) ときはコンソール入力が要るので裏ではログインせず、
+    token を None にして再接続ループ側の ensure_login に任せる。
+    """
+    def __init__(self, http: VRChatHTTP, token: str | None, clock: Clock | None = None,
+                 check_interval: float = 600.0, refresh_after: float = 86400.0, margin: float = 3600.0):
+        self.http = http
+        self.clock = clock or SYSTEM_CLOCK
+        self.check_interval, self.refresh_after, self.margin = float(check_interval), float(refresh_after), float(margin)
+        self.lock = threading.Lock()
+        self._token = token
+        self.issued_at = self.clock.monotonic()
+        self.valid = token is not None
+        # 切断直後は直近のリクエストが通っていても確かめに行く
+        self._verify = False
+        self._wake = threading.Event()
+        self._stop = threading.Event()
+        self._thread: threading.Thread | None = None
+        self.validations = 0
+        self.refreshes = 0
+        self.failures = 0
+        self.refresh_time = Series()
+
+    @property
+    def token(self) -> str | None:
+        """今使えるはずのトークン。無効と分かっていて取り直せていなければ None。"""
+        with self.lock:
+            return self._token if self.valid else None
+
+    def adopt(self, token: str) -> None:
+        """再接続ループなど別の経路でログインし直したトークンを引き継ぐ。"""
+        with self.lock:
+            if token != self._token:
+                self.issued_at = self.clock.monotonic()
+            self._token, self.valid = token, True
+
+    def on_disconnected(self) -> None:
+        # WS スレッドから。check() の読み捨てと競合しないようにロックの中で立てる
+        with self.lock:
+            self._verify = True
+        self._wake.set()
+
+    def reconfigure(self, check_interval: float, refresh_after: float) -> None:
+        """設定の再読み込みから。短くなった間隔がすぐ効くように見回りを起こす。"""
+        self.check_interval, self.refresh_after = float(check_interval), float(refresh_after)
+        self._wake.set()
+
+    def start(self) -> None:
+        if self._thread and self._thread.is_alive():
+            return
+        self._thread = threading.Thread(target=self._run, name="session", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+        self._wake.set()
+
+    def _can_relogin(self) -> bool:
+        return bool(SETTINGS.totp_secret)
+
+    def _expiring(self, now: float) -> bool:
+        if self.refresh_after > 0 and now - self.issued_at >= self.refresh_after:
+            return True
+        expires = self.http.auth_cookie_expires()
+        return expires is not None and expires - self.clock.time() <= self.margin
+
+    def check(self) -> bool:
+        """
+        1 回分の見回り。必要ならログインし直す。トークンが使える状態なら True。
+        """
+        now = self.clock.monotonic()
+        ok_at, bad_at = self.http.last_ok_at, self.http.last_401_at
+        alive = not (bad_at is not None and (ok_at is None or bad_at > ok_at))
+        with self.lock:
+            verify, self._verify = self._verify, False
+        if alive and (verify or ok_at is None or now - ok_at >= self.check_interval):
+            # アイドル中だけ確かめに行く (普段のリクエストが通っていればそれで足りる)
+            self.validations += 1
+            alive = self.http.session_valid(priority=PRIORITY_RESYNC)
+        if alive and not self._expiring(now):
+            with self.lock:
+                self.valid = True
+            return True
+        if not self._can_relogin():
+            with self.lock:
+                self.valid = alive
+            if not alive:
+                log.warning("[SESSION] session expired; TOTP is not configured, so login waits for the reconnect loop")
+            return alive
+        return self.refresh(reason="expired" if not alive else "ageing")
+
+    def refresh(self, reason: str = "manual") -> bool:
+        t = self.clock.monotonic()
+        try:
+            token, name = self.http.relogin()
+        except Exception as e:
+            self.failures += 1
+            log.warning("[SESSION] re-login (%s) failed: %s", reason, e)
+            with self.lock:
+                # 古いトークンがまだ通るならそれを使い続ける
+                self.valid = reason == "ageing"
+            return self.valid
+        took = self.clock.monotonic() - t
+        self.refresh_time.add(took)
+        self.refreshes += 1
+        self.adopt(token)
+        log.info("[SESSION] re-logged in as %s (%s) in %.1fs", name, reason, took)
+        return True
+
+    def _run(self) -> None:
+        # 一定間隔で見回るが、切断時には即座に起こされる。間隔は設定の再読み込みで変わるので毎回計算する
+        while not self._stop.is_set():
+            tick = max(1.0, min(self.check_interval, self.margin) / 4)
+            try:
+                self.check()
+            except Exception as e:
+                log.warning("[SESSION] check failed: %s", e)
+            self.clock.wait(self._wake, tick)
+            self._wake.clear()
+
+    def stats(self) -> dict:
+        now = self.clock.monotonic()
+        expires = self.http.auth_cookie_expires()
+        with self.lock:
+            return {
+                "valid": self.valid,
+                "token_age": round(now - self.issued_at, 1),
+                "expires_in": round(expires - self.clock.time(), 1) if expires is not None else None,
+                "validations": self.validations,
+                "refreshes": self.refreshes,
+                "failures": self.failures,
+                "refresh_time": self.refresh_time.as_dict(),
+            }
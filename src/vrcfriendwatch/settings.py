@@ -1,28 +1,345 @@
 from __future__ import annotations
-import os
-from dataclasses import dataclass
+import os, json, logging, threading
 from dotenv import load_dotenv
 from pathlib import Path
 import sys
 from shutil import copyfile
+from typing import Any, Callable, Mapping
+
+try:
+    import tomllib
+except ImportError:  # Python 3.10
+    tomllib = None
+
+log = logging.getLogger(__name__)
+
+
+class ConfigError(ValueError):
+    """設定値が不正。errors に見つかった問題を全部持つ。"""
+    def __init__(self, errors: list[str]):
+        super().__init__("; ".join(errors))
+        self.errors = errors
+
+
+def _parse_bool(v: Any) -> bool:
+    if isinstance(v, bool):
+        return v
+    s = str(v).strip().lower()
+    if s in ("1", "true", "yes", "on"):
+        return True
+    if s in ("0", "false", "no", "off", ""):
+        return False
+    raise ValueError(f"not a boolean: {v!r}")
+
+
+def _parse_optional_str(v: Any) -> str | None:
+    return str(v) if v not in (None, "") else None
+
+
+# Settings の注釈 (文字列) → 変換関数
+_CONVERTERS: dict[str, Callable[[Any], Any]] = {
+    "str": str, "int": int, "float": float, "bool": _parse_bool, "str | None": _parse_optional_str,
+}
+
+
+class Option:
+    """
+    設定項目 1 つ分の宣言。型は Settings の注釈から取る。
+    env: 環境変数名 (設定ファイルではフィールド名でもこの名前でも書ける)
+    live: 動作中の再読み込みで反映してよい項目か (False の変更は再起動まで保留)
+    """
+    __slots__ = ("env", "default", "min", "max", "choices", "live", "name", "type")
+
+    def __init__(self, env: str, default: Any, *, min: float | None = None, max: float | None = None,
+                 choices: tuple[str, ...] | None = None, live: bool = False):
+        self.env, self.default = env, default
+        self.min, self.max, self.choices, self.live = min, max, choices, live
+        self.name = ""
+        self.type = "str"
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.name = name
+
+    def __get__(self, obj, objtype=None):
+        # 読み込み後はインスタンスの値が優先される (非データディスクリプタ)
+        return self if obj is None else self.default
+
+    def convert(self, raw: Any) -> Any:
+        value = _CONVERTERS[self.type](raw.strip() if isinstance(raw, str) and self.type != "str" else raw)
+        if self.choices is not None:
+            for c in self.choices:
+                if str(value).lower() == c.lower():
+                    return c
+            raise ValueError(f"must be one of {', '.join(c or '(empty)' for c in self.choices)}")
+        if self.min is not None and value < self.min:
+            raise ValueError(f"must be >= {self.min}")
+        if self.max is not None and value > self.max:
+            raise ValueError(f"must be <= {self.max}")
+        return value
+
 
-load_dotenv()
 class Settings:
-    username:str = os.getenv("VRCHAT_USERNAME","")
-    password: str = os.getenv("VRCHAT_PASSWORD","")
-    user_agent:str = os.getenv("VRCHAT_USER_AGENT","VRCFriendWatch/1.0 your-contact@example.com")
-    totp_secret: str | None = os.getenv("VRCHAT_TOTP_SECRET")or None
-    debug: bool = os.getenv("DEBUG","0")=="1"
-    twofa_preferred: str = os.getenv("VRCHAT_2FA_PREFERRED", "AUTO").upper()
+    """
+    型付きの設定。既定値 < 設定ファイル (TOML / JSON) < 環境変数 (.env 含む) の順に上書きし、
+    全項目を検証してから反映する (不正な値が 1 つでもあれば ConfigError)。
+    reload() は設定ファイルを読み直し、live な項目だけをその場で差し替えて on_change の購読者に知らせる。
+    """
+    username: str = Option("VRCHAT_USERNAME", "")
+    password: str = Option("VRCHAT_PASSWORD", "")
+    user_agent: str = Option("VRCHAT_USER_AGENT", "VRCFriendWatch/1.0 your-contact@example.com")
+    totp_secret: str | None = Option("VRCHAT_TOTP_SECRET", None)
+    debug: bool = Option("DEBUG", False, live=True)
+    twofa_preferred: str = Option("VRCHAT_2FA_PREFERRED", "AUTO", choices=("AUTO", "TOTP", "EMAIL"))
+
+    # VRChat API のレートリミット (1 分あたりの平均と瞬間バースト)
+    rate_limit_per_minute: float = Option("RATE_LIMIT_PER_MINUTE", 60.0, min=1, live=True)
+    rate_burst_capacity: int = Option("RATE_BURST_CAPACITY", 10, min=1, live=True)
+    # 同じホストで動く複数のウォッチャーで上の枠を分け合う (メモリマップしたファイル経由、空ならアプリデータ)
+    rate_limit_shared: bool = Option("RATE_LIMIT_SHARED", False)
+    rate_limit_shared_path: str = Option("RATE_LIMIT_SHARED_PATH", "")
+
+    # HTTP: (接続, 読み取り) タイムアウト秒と keep-alive プールの大きさ
+    http_connect_timeout: float = Option("HTTP_CONNECT_TIMEOUT", 5.0, min=0.1)
+    http_read_timeout: float = Option("HTTP_READ_TIMEOUT", 15.0, min=0.1)
+    http_pool_size: int = Option("HTTP_POOL_SIZE", 8, min=1)
+
+    # ログ: レベル (空なら DEBUG に従う) / ローテーション/圧縮/サンプリング
+    log_level: str = Option("LOG_LEVEL", "", choices=("", "DEBUG", "INFO", "WARNING", "ERROR"), live=True)
+    log_max_bytes: int = Option("LOG_MAX_BYTES", 5 * 1024 * 1024, min=1024)
+    log_backup_count: int = Option("LOG_BACKUP_COUNT", 5, min=0)
+    log_rotate_hours: float = Option("LOG_ROTATE_HOURS", 24.0, min=0)
+    log_compress: bool = Option("LOG_COMPRESS", True)
+    # 例: "vrcfriendwatch.ws_client=0.05" (DEBUG 行だけ 5% 残す)
+    log_sample: str = Option("LOG_SAMPLE", "", live=True)
+
+    # イベントキュー: ステージごとの上限件数と種別ごとの溢れ方 (never/latest/shed)
+    event_queue_size: int = Option("EVENT_QUEUE_SIZE", 1000, min=1)
+    event_policies: str = Option("EVENT_POLICIES", "", live=True)
+
+    # 再接続: この秒数続いた接続の後は backoff をリセット / 無通信検知
+    ws_backoff_cap: float = Option("WS_BACKOFF_CAP", 30.0, min=1, live=True)
+    ws_stable_after: float = Option("WS_STABLE_AFTER", 120.0, min=0)
+    ws_stall_after: float = Option("WS_STALL_AFTER", 30.0, min=1, live=True)
+    ws_stall_grace: float = Option("WS_STALL_GRACE", 10.0, min=0, live=True)
+
+    # pipeline に続けてこの回数繋がらなければオンライン一覧のポーリングに切り替える (0 で無効)
+    poll_fallback_after: int = Option("POLL_FALLBACK_AFTER", 3, min=0, live=True)
+    poll_min_seconds: float = Option("POLL_MIN_SECONDS", 15.0, min=1, live=True)
+    poll_max_seconds: float = Option("POLL_MAX_SECONDS", 120.0, min=1, live=True)
+    # ポーリングに使ってよいレート枠の割合
+    poll_budget_share: float = Option("POLL_BUDGET_SHARE", 0.5, min=0.01, max=1, live=True)
+    # WS の接続がこの秒数続いたらポーリングをやめる
+    poll_switch_back_after: float = Option("POLL_SWITCH_BACK_AFTER", 30.0, min=0, live=True)
+
+    # pipeline の圧縮: off / estimate (deflate した場合の削減量と伸長コストを見積もる) / deflate
+    ws_compression: str = Option("WS_COMPRESSION", "off", choices=("off", "estimate", "deflate"))
+
+    # フレンド集合の整合性チェック間隔 (分)。0 で無効
+    friend_resync_minutes: float = Option("FRIEND_RESYNC_MINUTES", 15.0, min=0)
+
+    # 通知先: toast,stdout,jsonl,webhook をカンマ区切りで
+    notify_sinks: str = Option("NOTIFY_SINKS", "toast", live=True)
+    notify_jsonl_path: str = Option("NOTIFY_JSONL_PATH", "", live=True)
+    notify_webhook_url: str = Option("NOTIFY_WEBHOOK_URL", "", live=True)
+    notify_queue_size: int = Option("NOTIFY_QUEUE_SIZE", 100, min=1, live=True)
+    notify_retries: int = Option("NOTIFY_RETRIES", 2, min=0, live=True)
+    notify_timeout: float = Option("NOTIFY_TIMEOUT", 5.0, min=0.1, live=True)
 
-    rate_limit_per_minute: int =60
-    rate_limit_per_minute :int =10
+    # セッション: アイドル時に確認する間隔 (分) / この時間経ったトークンは裏でログインし直す (時間、0 で無効)
+    session_check_minutes: float = Option("SESSION_CHECK_MINUTES", 10.0, min=0.1, live=True)
+    session_refresh_hours: float = Option("SESSION_REFRESH_HOURS", 24.0, min=0, live=True)
+
+    # daemon モード: 状態 API の待受先と保持する直近イベント数
+    daemon_listen: str = Option("DAEMON_LISTEN", "127.0.0.1:8765")
+    daemon_unix_socket: str = Option("DAEMON_UNIX_SOCKET", "")
+    recent_events: int = Option("RECENT_EVENTS", 500, min=1)
+
+    # ローカル pub/sub: 待受先 (空で無効) と購読者ごとのバッファ件数
+    pubsub_listen: str = Option("PUBSUB_LISTEN", "")
+    pubsub_unix_socket: str = Option("PUBSUB_UNIX_SOCKET", "")
+    pubsub_buffer: int = Option("PUBSUB_BUFFER", 1000, min=1)
+
+    # 名前/ワールド名の先読み: 余ったレート枠だけ使う。reserve はバースト用に残すトークン数
+    prefetch: bool = Option("PREFETCH", True)
+    prefetch_reserve: float = Option("PREFETCH_RESERVE", 2.0, min=0, live=True)
+
+    # トレース: 書き出す割合 (0〜1) / 合計がこの ms を超えたイベントは必ず残して WARNING (どちらも 0 で無効)
+    trace_sample: float = Option("TRACE_SAMPLE", 0.0, min=0, max=1, live=True)
+    trace_slow_ms: float = Option("TRACE_SLOW_MS", 3000.0, min=0, live=True)
+    trace_path: str = Option("TRACE_PATH", "")
+
+    # ロスターと名前/ワールドキャッシュのチェックポイント間隔 (分)。0 で無効
+    checkpoint_minutes: float = Option("CHECKPOINT_MINUTES", 5.0, min=0)
+
+    # 同じインスタンスにこの人数のフレンドが揃ったら通知 (0 で無効)
+    gathering_threshold: int = Option("GATHERING_THRESHOLD", 3, min=0, live=True)
+
+    def __init__(self, env: Mapping[str, str] | None = None, config_file: Path | None = None):
+        self.config_file = config_file
+        self.lock = threading.Lock()
+        self.listeners: list[Callable[[dict[str, tuple]], None]] = []
+        values, self.sources, _ = self._resolve(os.environ if env is None else env)
+        self.__dict__.update(values)
+
+    @classmethod
+    def options(cls) -> list[Option]:
+        out = []
+        for name, opt in vars(cls).items():
+            if isinstance(opt, Option):
+                opt.type = cls.__annotations__[name]
+                out.append(opt)
+        return out
+
+    def _read_file(self) -> dict:
+        path = self.config_file
+        if path is None or not path.exists():
+            return {}
+        try:
+            if path.suffix == ".json":
+                data = json.loads(path.read_text(encoding="utf-8"))
+            elif tomllib is not None:
+                data = tomllib.loads(path.read_text(encoding="utf-8"))
+            else:
+                raise ConfigError([f"{path}: TOML needs Python 3.11+ (use .json)"])
+        except (OSError, ValueError) as e:
+            raise ConfigError([f"{path}: {e}"]) from e
+        if not isinstance(data, dict):
+            raise ConfigError([f"{path}: top level must be a table"])
+        return data
+
+    def _resolve(self, env: Mapping[str, str]) -> tuple[dict[str, Any], dict[str, str], list[str]]:
+        """既定値 → ファイル → 環境変数 の順に重ねて検証する。(値, 出どころ, ファイルの値が環境変数に負けた項目) を返す。"""
+        options = self.options()
+        by_key = {k.lower(): opt for opt in options for k in (opt.name, opt.env)}
+        values = {opt.name: opt.default for opt in options}
+        sources = {opt.name: "default" for opt in options}
+        errors: list[str] = []
+        for key, raw in self._read_file().items():
+            opt = by_key.get(str(key).lower())
+            if opt is None:
+                errors.append(f"{self.config_file}: unknown setting {key!r}")
+                continue
+            try:
+                values[opt.name] = opt.convert(raw)
+                sources[opt.name] = "file"
+            except (TypeError, ValueError) as e:
+                errors.append(f"{self.config_file}: {key}: {e}")
+        shadowed: list[str] = []
+        for opt in options:
+            raw = env.get(opt.env)
+            if raw is None:
+                continue
+            if sources[opt.name] == "file":
+                shadowed.append(opt.name)
+            try:
+                values[opt.name] = opt.convert(raw)
+                sources[opt.name] = "env"
+            except (TypeError, ValueError) as e:
+                errors.append(f"{opt.env}={raw!r}: {e}")
+        if values["poll_min_seconds"] > values["poll_max_seconds"]:
+            errors.append("poll_min_seconds must be <= poll_max_seconds")
+        if errors:
+            raise ConfigError(errors)
+        return values, sources, shadowed
+
+    def on_change(self, fn: Callable[[dict[str, tuple]], None]) -> None:
+        """reload() で live な項目が変わったら fn({name: (old, new)}) が呼ばれる。"""
+        self.listeners.append(fn)
+
+    def reload(self) -> dict[str, tuple]:
+        """
+        設定ファイル (と環境変数) を読み直して live な項目だけ反映する。変わった項目を返す。
+        不正なら何も変えずに ConfigError。live でない項目の変更は警告して次回起動まで保留。
+        """
+        with self.lock:
+            values, sources, shadowed = self._resolve(os.environ)
+            changed: dict[str, tuple] = {}
+            pending: list[str] = []
+            for opt in self.options():
+                old, new = getattr(self, opt.name), values[opt.name]
+                if old == new:
+                    continue
+                if opt.live:
+                    changed[opt.name] = (old, new)
+                    setattr(self, opt.name, new)
+                    self.sources[opt.name] = sources[opt.name]
+                else:
+                    pending.append(opt.name)
+        if shadowed:
+            log.warning("[CONFIG] overridden by environment variables: %s", ", ".join(shadowed))
+        if pending:
+            log.warning("[CONFIG] restart required to apply: %s", ", ".join(pending))
+        if changed:
+            log.info("[CONFIG] reloaded: %s", ", ".join(f"{k}={v[1]!r}" for k, v in changed.items()))
+        for fn in list(self.listeners):
+            if not changed:
+                break
+            try:
+                fn(changed)
+            except Exception:
+                log.exception("[CONFIG] applying settings failed")
+        return changed
 
     def validate(self)->None:
         if not (self.username and self.password):
             raise SystemExit("環境変数 VRCHAT_USERNAME/VRCHAT_PASSWORD を設定してください　(.env 推奨)")
 
-SETTINGS = Settings()
+
+class ConfigWatcher:
+    """設定ファイルの更新時刻を interval 秒ごとに見て、変わっていたら reload() する。trigger() で即時。"""
+    def __init__(self, settings: Settings, interval: float = 2.0):
+        self.settings, self.interval = settings, float(interval)
+        self._mtime = self._stat()
+        self._wake = threading.Event()
+        self._stop = False
+        self._force = False
+        self._thread: threading.Thread | None = None
+        self.reloads = 0
+        self.errors = 0
+
+    def _stat(self) -> float | None:
+        path = self.settings.config_file
+        try:
+            return path.stat().st_mtime if path is not None else None
+        except OSError:
+            return None
+
+    def check(self, force: bool = False) -> bool:
+        mtime = self._stat()
+        if not force and mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            self.settings.reload()
+        except ConfigError as e:
+            self.errors += 1
+            log.error("[CONFIG] keeping previous settings: %s", e)
+            return False
+        self.reloads += 1
+        return True
+
+    def trigger(self) -> None:
+        """SIGHUP などから。次の見回りを待たずに読み直す。"""
+        self._force = True
+        self._wake.set()
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self._run, name="config-watch", daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stop = True
+        self._wake.set()
+
+    def _run(self) -> None:
+        while not self._stop:
+            self._wake.wait(self.interval)
+            self._wake.clear()
+            if self._stop:
+                return
+            force, self._force = self._force, False
+            self.check(force)
+
 
 def load_env():
     # PyInstaller --onefileでも.exeのあるフォルダを指す
@@ -36,7 +353,20 @@ def load_env():
     if dotenv_path.exists():
         load_dotenv(dotenv_path=dotenv_path,override =False)
 
-load_env()
+
+def _load_settings() -> Settings:
+    # 読み込みは SETTINGS を作る前に (以前はクラス定義の評価後に load_env していたので効いていなかった)
+    load_dotenv()
+    load_env()
+    from .paths import CONFIG_PATH
+    path = os.getenv("VRCFW_CONFIG")
+    try:
+        return Settings(config_file=Path(path) if path else CONFIG_PATH)
+    except ConfigError as e:
+        raise SystemExit("設定が不正です:\n  " + "\n  ".join(e.errors))
+
+
+SETTINGS = _load_settings()
 
 
 def ensure_env(base_dir: Path):
@@ -0,0 +1,221 @@
+from __future__ import annotations
+import contextlib, logging, mmap, os, struct
+from pathlib import Path
+from .rate_limiter import RateLimiter, _Waiter
+from .clock import Clock
+
+log = logging.getLogger(__name__)
+
+MAGIC = b"VFWRL\x00\x00\x01"
+MAX_SLOTS = 32
+# magic, capacity, refill_rate, tokens, last_refill (壁時計), slots
+_HEADER = struct.Struct("<8sddddI4x")
+# pid, seen, head_since, granted (トークン数), grants (回数), head_priority
+_SLOT = struct.Struct("<qdddQi4x")
+SIZE = _HEADER.size + _SLOT.size * MAX_SLOTS
+
+# この秒数ファイルに触れていない先頭の待ち手は居ないものとして扱う (落ちたプロセス)
+STALE_AFTER = 10.0
+# 他プロセスの先頭に順番を譲っている間の見直し間隔
+POLL_INTERVAL = 0.05
+# 待ちは細切れにして seen を更新し続ける (STALE_AFTER より十分短く)
+MAX_WAIT = 1.0
+
+if os.name == "nt":
+    import msvcrt
+
+    def _lock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_LOCK, 1)
+
+    def _unlock(fd: int) -> None:
+        os.lseek(fd, 0, os.SEEK_SET)
+        msvcrt.locking(fd, msvcrt.LK_UNLCK, 1)
+
+    def _pid_alive(pid: int) -> bool:
+        import ctypes
+        h = ctypes.windll.kernel32.OpenProcess(0x1000, False, pid)  # PROCESS_QUERY_LIMITED_INFORMATION
+        if not h:
+            return False
+        ctypes.windll.kernel32.CloseHandle(h)
+        return True
+else:
+    import fcntl
+
+    def _lock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+
+    def _unlock(fd: int) -> None:
+        fcntl.flock(fd, fcntl.LOCK_UN)
+
+    def _pid_alive(pid: int) -> bool:
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            return True
+        return True
+
+
+class SharedRateLimiter(RateLimiter):
+    """
+    同じホストの複数プロセスで 1 つのトークンバケツを分け合う RateLimiter。
+    バケツはメモリマップしたファイル (path) に置き、読み書きはファイルロック (flock / msvcrt.locking) の中で行う。
+    外部サービスは要らない。時刻はプロセス間で比べられる壁時計 (clock.time()) を使う。
+
+    プロセス内の優先度つき FIFO は RateLimiter のまま。プロセス間では各プロセスの列の先頭だけが
+    (優先度, 先頭になった時刻) の順に並び、取れたプロセスの次の先頭は後ろに付き直すので、
+    待ち手の多いプロセスが枠を独占することはない (プロセス単位のラウンドロビン)。
+    プロセスごとの消費量はファイルのスロットに残り、stats()["shared"] で全プロセス分を見られる。
+    """
+    def __init__(self, path: Path | str, capacity: int, refill_rate: float, clock: Clock | None = None):
+        super().__init__(capacity, refill_rate, clock)
+        self.path = Path(path)
+        self.pid = os.getpid()
+        self._fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o600)
+        try:
+            with self._locked():
+                if os.fstat(self._fd).st_size < SIZE:
+                    os.ftruncate(self._fd, SIZE)
+                self._mm = mmap.mmap(self._fd, SIZE)
+                self._init_locked()
+        except Exception:
+            os.close(self._fd)
+            raise
+
+    # --- ファイル上のバケツ ---
+    @contextlib.contextmanager
+    def _locked(self):
+        _lock(self._fd)
+        try:
+            yield
+        finally:
+            _unlock(self._fd)
+
+    def _header(self) -> tuple:
+        return _HEADER.unpack_from(self._mm, 0)
+
+    def _put_header(self, capacity: float, refill_rate: float, tokens: float, last: float) -> None:
+        _HEADER.pack_into(self._mm, 0, MAGIC, capacity, refill_rate, tokens, last, MAX_SLOTS)
+
+    def _slot(self, i: int) -> list:
+        return list(_SLOT.unpack_from(self._mm, _HEADER.size + i * _SLOT.size))
+
+    def _put_slot(self, i: int, slot: list) -> None:
+        _SLOT.pack_into(self._mm, _HEADER.size + i * _SLOT.size, *slot)
+
+    def _init_locked(self) -> None:
+        now = self.clock.time()
+        magic, capacity, refill_rate, tokens, last, _ = self._header()
+        if magic != MAGIC:
+            self._mm[:] = bytes(SIZE)
+            self._put_header(self.capacity, self.refill_rate, self.capacity, now)
+        elif (capacity, refill_rate) != (self.capacity, self.refill_rate):
+            # 設定はどのプロセスも同じはず。違えば後から来た方に合わせる
+            log.warning("[RATE] shared bucket %s was %.0f/min burst %.0f; switching to %.0f/min burst %.0f",
+                        self.path, refill_rate * 60, capacity, self.refill_rate * 60, self.capacity)
+            self._put_header(self.capacity, self.refill_rate, min(tokens, self.capacity), last)
+        self.slot = self._claim_locked(now)
+
+    def _claim_locked(self, now: float) -> int:
+        free = None
+        for i in range(MAX_SLOTS):
+            pid = self._slot(i)[0]
+            if pid == self.pid:
+                # 同じプロセスで 2 つ目を作ったときは記録を引き継ぐ
+                return i
+            if free is None and (pid == 0 or not _pid_alive(pid)):
+                free = i
+        if free is None:
+            raise RuntimeError(f"{self.path}: more than {MAX_SLOTS} processes share this rate limit")
+        self._put_slot(free, [self.pid, now, 0.0, 0.0, 0, 0])
+        return free
+
+    def _refill_shared(self, now: float) -> float:
+        """ヘッダを読んで経過分を補充する。ローカルの capacity/refill_rate も他プロセスの変更に合わせる。"""
+        _, capacity, refill_rate, tokens, last, _ = self._header()
+        if now > last:
+            tokens = min(capacity, tokens + (now - last) * refill_rate)
+            last = now
+        self.capacity, self.refill_rate, self.tokens, self.last_refill = capacity, refill_rate, tokens, last
+        return tokens
+
+    def _ahead(self, key: tuple, now: float) -> bool:
+        """key (優先度, 先頭になった時刻, pid) より前に並んでいる他プロセスの先頭がいるか。"""
+        for i in range(MAX_SLOTS):
+            if i == self.slot:
+                continue
+            pid, seen, head_since, _, _, head_priority = self._slot(i)
+            if pid and head_since and now - seen < STALE_AFTER and (head_priority, head_since, pid) < key:
+                return True
+        return False
+
+    def _take_locked(self, need: float, priority: int, now: float, reserve: float = 0.0,
+                     head: _Waiter | None = None) -> float:
+        with self._locked():
+            t = self.clock.time()
+            tokens = self._refill_shared(t)
+            slot = self._slot(self.slot)
+            slot[1] = t
+            # ファストパスは今並んだのと同じ扱い (同じ優先度で待っている他プロセスがいれば譲る)
+            since = slot[2] if head is not None and slot[2] else t
+            ahead = self._ahead((priority, since, self.pid), t)
+            if not ahead and tokens >= need + reserve - 1e-9:
+                self.tokens = max(0.0, tokens - need)
+                slot[3] += need
+                slot[4] += 1
+                if head is not None:
+                    # 次の先頭は後ろに並び直す
+                    slot[2] = 0.0
+                wait = 0.0
+            else:
+                if head is not None:
+                    slot[2], slot[5] = since, priority
+                wait = POLL_INTERVAL if ahead else (need + reserve - tokens) / self.refill_rate
+                wait = min(max(wait, 1e-3), MAX_WAIT)
+            self._put_header(self.capacity, self.refill_rate, self.tokens, self.last_refill)
+            self._put_slot(self.slot, slot)
+        return wait
+
+    def _head_left_locked(self) -> None:
+        with self._locked():
+            slot = self._slot(self.slot)
+            slot[2] = 0.0
+            self._put_slot(self.slot, slot)
+
+    def _set_rate_locked(self, capacity: float | None, refill_rate: float | None, now: float) -> None:
+        with self._locked():
+            self._refill_shared(self.clock.time())
+            super()._set_rate_locked(capacity, refill_rate, self.last_refill)
+            self._put_header(self.capacity, self.refill_rate, self.tokens, self.last_refill)
+
+    def close(self) -> None:
+        """スロットは消費量の記録として残し、待ちの表明だけ取り下げる。"""
+        with self.lock:
+            if self._mm.closed:
+                return
+            self._head_left_locked()
+            self._mm.close()
+            os.close(self._fd)
+
+    def stats(self) -> dict:
+        out = super().stats()
+        with self.lock, self._locked():
+            now = self.clock.time()
+            tokens = self._refill_shared(now)
+            slots = [s for s in map(self._slot, range(MAX_SLOTS)) if s[0]]
+        total = sum(s[3] for s in slots) or 1.0
+        out["shared"] = {
+            "path": str(self.path),
+            "tokens": round(tokens, 2),
+            "capacity": self.capacity,
+            "per_minute": round(self.refill_rate * 60, 1),
+            "processes": [
+                {"pid": pid, "self": pid == self.pid, "granted": round(granted, 1), "grants": grants,
+                 "share": round(granted / total, 3), "waiting": bool(head_since) and now - seen < STALE_AFTER,
+                 "idle": round(now - seen, 1)}
+                for pid, seen, head_since, granted, grants, _ in slots
+            ],
+        }
+        return out
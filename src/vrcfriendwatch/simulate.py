@@ -0,0 +1,364 @@
+from __future__ import annotations
+import heapq, json, logging, random, time
+from dataclasses import dataclass, asdict
+from typing import Callable
+
+from .settings import SETTINGS
+from .clock import VirtualClock
+from .http_client import VRChatHTTP
+from .vrchat_api import VRChatAPI
+from .ws_client import WSRunner
+from .event_queue import Stage
+from .tracing import TRACER
+from .rate_limiter import PRIORITY_NAMES
+
+log = logging.getLogger(__name__)
+
+# 合成イベントの種別と比率
+EVENT_MIX = (
+    ("friend-location", 0.45),
+    ("friend-update", 0.20),
+    ("friend-online", 0.12),
+    ("friend-offline", 0.12),
+    ("friend-active", 0.10),
+    ("friend-add", 0.005),
+    ("friend-delete", 0.005),
+)
+
+
+@dataclass
+class SimConfig:
+    hours: float = 24.0
+    friends: int = 500
+    worlds: int = 300
+    events_per_hour: float = 600.0
+    disconnects_per_hour: float = 0.5
+    # 切断のうちサーバの正常クローズ (1000) の割合。残りは 1006
+    clean_close_ratio: float = 0.3
+    # 接続確立にかかる秒数
+    connect_seconds: float = 0.5
+    # サーバ側の制限 (これを超えると 429) と、無関係に混ざる 429 の確率
+    server_rate_per_minute: float = 60.0
+    server_burst: int = 20
+    p429: float = 0.01
+    # 1 日あたりの 429 ストーム (window 秒のあいだ全リクエストが 429) の回数
+    storms_per_day: float = 1.0
+    storm_seconds: float = 120.0
+    retry_after: float = 30.0
+    seed: int = 1
+    # 余った枠での名前/ワールド先読み
+    prefetch: bool = True
+
+
+class _SimResponse:
+    def __init__(self, status_code: int, data=None, headers: dict | None = None):
+        self.status_code = status_code
+        self.ok = status_code < 400
+        self.reason = "OK" if self.ok else "Too Many Requests" if status_code == 429 else "Error"
+        self.headers = headers or {}
+        self._data = data
+        self.text = json.dumps(data) if data is not None else ""
+
+    def json(self):
+        return self._data
+
+
+class SimServer:
+    """
+    requests.Session.request の代わりに VRChat API のふりをする。時刻は仮想時計。
+    サーバ側のトークンバケット、ランダムな 429、429 ストームを再現する。
+    """
+    def __init__(self, cfg: SimConfig, clock: VirtualClock, rng: random.Random):
+        self.cfg, self.clock, self.rng = cfg, clock, rng
+        self.tokens = float(cfg.server_burst)
+        self.last = clock.monotonic()
+        self.storms: list[tuple[float, float]] = []
+        self.requests = 0
+        self.per_hour: dict[int, int] = {}
+        self.status: dict[int, int] = {}
+        self.limited = 0
+
+    def _limited(self, now: float) -> bool:
+        rate = self.cfg.server_rate_per_minute / 60.0
+        self.tokens = min(self.cfg.server_burst, self.tokens + (now - self.last) * rate)
+        self.last = now
+        if any(s <= now < e for s, e in self.storms):
+            return True
+        if self.tokens < 1:
+            self.limited += 1
+            return True
+        self.tokens -= 1
+        return self.rng.random() < self.cfg.p429
+
+    def request(self, method: str, url: str, params=None, json=None, headers=None, auth=None):
+        now = self.clock.monotonic()
+        self.requests += 1
+        hour = int(now // 3600)
+        self.per_hour[hour] = self.per_hour.get(hour, 0) + 1
+        if self._limited(now):
+            resp = _SimResponse(429, {"error": "rate limited"}, {"Retry-After": str(self.cfg.retry_after)})
+        elif "/users/" in url:
+            uid = url.rsplit("/", 1)[1]
+            resp = _SimResponse(200, {"id": uid, "displayName": "name-" + uid[4:12]})
+        elif "/worlds/" in url:
+            wid = url.rsplit("/", 1)[1]
+            resp = _SimResponse(200, {"id": wid, "name": "World " + wid[5:13]})
+        elif url.endswith("/auth/user"):
+            resp = _SimResponse(200, {"id": "usr_self", "displayName": "self"})
+        else:
+            resp = _SimResponse(404, {"error": "not found"})
+        self.status[resp.status_code] = self.status.get(resp.status_code, 0) + 1
+        return resp
+
+
+class _SimHTTP(VRChatHTTP):
+    def _load_cookies(self) -> None:
+        pass
+
+    def _save_cookies(self) -> None:
+        pass
+
+
+def _pct(xs: list[float], q: float) -> float:
+    if not xs:
+        return 0.0
+    xs = sorted(xs)
+    return round(xs[min(len(xs) - 1, int(q * len(xs)))], 3)
+
+
+def _dist(xs: list[float]) -> dict:
+    return {"count": len(xs), "p50": _pct(xs, 0.5), "p90": _pct(xs, 0.9),
+            "p99": _pct(xs, 0.99), "max": round(max(xs, default=0.0), 3)}
+
+
+class Simulation:
+    """
+    仮想時計の上で本物の WSRunner / VRChatAPI / VRChatHTTP / RateLimiter / ReconnectPolicy を動かす。
+
+    モデル:
+      - WS スレッドの処理 (on_message / on_close) は即時に終わるものとしてタイマーで実行する
+      - dispatch ワーカーは 1 本。limiter の待ちや 429 の backoff で仮想時計が進み、
+        その間に届いた WS イベントはタイマーとして順に積まれる
+      - 再接続 (session_valid → on_open) は dispatch の合間に実行する (スレッドの直列化による近似)
+      - 切断中に届くはずだったイベントは取りこぼしとして数える
+    """
+    def __init__(self, cfg: SimConfig):
+        self.cfg = cfg
+        self.clock = VirtualClock()
+        self.rng = random.Random(cfg.seed)
+        self.server = SimServer(cfg, self.clock, random.Random(cfg.seed + 1))
+        self.http = _SimHTTP(clock=self.clock, rng=random.Random(cfg.seed + 2))
+        self.http.s = self.server
+        self.api = VRChatAPI(self.http, clock=self.clock)
+        self.runner = WSRunner(self.http, self.api, clock=self.clock, rng=random.Random(cfg.seed + 3))
+        self.runner.console = False
+        # ワーカースレッドは起動せずにこちらで回す。満杯で待つと実時間で止まるので put_timeout=0
+        self.runner.dispatch = Stage("dispatch", self.runner._dispatch,
+                                     capacity=SETTINGS.event_queue_size, put_timeout=0,
+                                     on_discard=TRACER.discarder("dispatch"))
+        self.runner.notifier = Stage("notify", lambda item: None,
+                                     capacity=SETTINGS.event_queue_size, put_timeout=0,
+                                     on_discard=TRACER.discarder("notify"))
+        self.end = cfg.hours * 3600.0
+        self.uids = [f"usr_{i:08d}-0000-4000-8000-000000000000" for i in range(cfg.friends)]
+        self.world_ids = [f"wrld_{i:08d}-0000-4000-8000-000000000000" for i in range(cfg.worlds)]
+        self._types = [t for t, _ in EVENT_MIX]
+        self._weights = [w for _, w in EVENT_MIX]
+        self._jobs: list[tuple[float, int, Callable[[], None]]] = []
+        self._job_seq = 0
+
+        self.connected = True
+        self.down_since: float | None = None
+        self.windows: list[dict] = []
+        self.sent = 0
+        self.missed = 0
+        self._missed_in_window = 0
+        self.delivered = 0
+        self.notifications = 0
+        self.queue_delay: list[float] = []
+        self.service_time: list[float] = []
+        self.end_to_end: list[float] = []
+
+    # --- 合成負荷 ---
+    def _pick(self, seq: list[str]) -> str:
+        # 一部のフレンド/ワールドに偏らせる
+        return seq[int(len(seq) * self.rng.random() ** 2)]
+
+    def _message(self, typ: str, uid: str) -> str:
+        content: dict = {"userId": uid, "_simT": self.clock.now}
+        if typ in ("friend-location", "friend-online"):
+            wid = self._pick(self.world_ids)
+            content["location"] = f"{wid}:{self.rng.randrange(1, 99999)}~region(jp)"
+        elif typ == "friend-update":
+            content["user"] = {"id": uid, "status": self.rng.choice(("active", "busy", "join me", "ask me"))}
+        return json.dumps({"type": typ, "content": json.dumps(content)})
+
+    def _schedule_next_event(self) -> None:
+        t = self.clock.now + self.rng.expovariate(self.cfg.events_per_hour / 3600.0)
+        if t < self.end:
+            self.clock.call_at(t, self._on_event)
+
+    def _on_event(self) -> None:
+        self._schedule_next_event()
+        self.sent += 1
+        if not self.connected:
+            self.missed += 1
+            self._missed_in_window += 1
+            return
+        typ = self.rng.choices(self._types, self._weights)[0]
+        self.delivered += 1
+        self.runner.on_message(None, self._message(typ, self._pick(self.uids)))
+
+    def _schedule_next_disconnect(self) -> None:
+        if self.cfg.disconnects_per_hour <= 0:
+            return
+        t = self.clock.now + self.rng.expovariate(self.cfg.disconnects_per_hour / 3600.0)
+        if t < self.end:
+            self.clock.call_at(t, self._on_disconnect)
+
+    def _on_disconnect(self) -> None:
+        self._schedule_next_disconnect()
+        if not self.connected:
+            return
+        code = 1000 if self.rng.random() < self.cfg.clean_close_ratio else 1006
+        self.connected = False
+        self.down_since = self.clock.now
+        self._missed_in_window = 0
+        self.runner.on_close(None, code, "simulated")
+        self.runner.reconnect.on_disconnected()
+        delay = self.runner.reconnect.next_delay()
+        self._add_job(self.clock.now + delay, self._reconnect)
+
+    def _reconnect(self) -> None:
+        # run_forever_with_reconnect と同じ順: session_valid → 接続 → on_open
+        self.http.session_valid()
+        self.clock.sleep(self.cfg.connect_seconds)
+        self.runner.on_open(None)
+        self.connected = True
+        self.windows.append({"start": round(self.down_since, 1),
+                             "seconds": round(self.clock.now - self.down_since, 2),
+                             "missed": self._missed_in_window})
+
+    def _schedule_storms(self) -> None:
+        n = int(self.cfg.storms_per_day * self.cfg.hours / 24.0 + self.rng.random())
+        for _ in range(n):
+            s = self.rng.uniform(0, self.end)
+            self.server.storms.append((s, s + self.cfg.storm_seconds))
+
+    def _add_job(self, when: float, fn: Callable[[], None]) -> None:
+        self._job_seq += 1
+        heapq.heappush(self._jobs, (when, self._job_seq, fn))
+
+    # --- 実行 ---
+    def _drain_notifier(self) -> None:
+        while self.runner.notifier.queue.get(timeout=0) is not None:
+            self.notifications += 1
+
+    def _dispatch_one(self) -> bool:
+        item = self.runner.dispatch.queue.get(timeout=0)
+        if item is None:
+            return False
+        content = item[2] if isinstance(item[2], dict) else {}
+        sched = content.get("_simT")
+        start = self.clock.now
+        try:
+            self.runner._dispatch(item)
+        except Exception:
+            log.exception("[SIM] dispatch failed")
+        if sched is not None:
+            self.queue_delay.append(start - sched)
+            self.service_time.append(self.clock.now - start)
+            self.end_to_end.append(self.clock.now - sched)
+        self._drain_notifier()
+        return True
+
+    def run(self) -> dict:
+        wall = time.perf_counter()
+        for i, uid in enumerate(self.uids):
+            self.runner.roster.seed({"id": uid, "displayName": f"friend{i}", "status": "active",
+                                     "location": "offline"})
+        self.runner.seed_occupancy()
+        if self.cfg.prefetch:
+            self.runner.prefetcher.seed(self.runner.roster)
+        self.runner.on_open(None)
+        self._schedule_storms()
+        self._schedule_next_event()
+        self._schedule_next_disconnect()
+        while True:
+            if self._jobs and self._jobs[0][0] <= self.clock.now:
+                heapq.heappop(self._jobs)[2]()
+                continue
+            if self._dispatch_one():
+                continue
+            # dispatch が空いている間に先読み (ワーカースレッドの代わり)
+            if self.cfg.prefetch and self.runner.prefetcher.step():
+                continue
+            nxt = [t for t in (self.clock.next_timer(), self._jobs[0][0] if self._jobs else None) if t is not None]
+            if not nxt:
+                break
+            self.clock.run_until(min(nxt))
+        return self.report(time.perf_counter() - wall)
+
+    def report(self, wall_seconds: float) -> dict:
+        lim = self.http.limiter
+        lstats = lim.stats()
+        granted = sum(v["granted"] for v in lstats.values())
+        duration = max(self.clock.now, 1e-9)
+        budget = lim.capacity + lim.refill_rate * duration
+        per_hour_cap = lim.refill_rate * 3600.0
+        busiest = max(self.server.per_hour.values(), default=0)
+        qstats = self.runner.dispatch.queue.stats()
+        dropped = sum(c["dropped"] for c in qstats["policies"].values())
+        overflow = sum(c["overflow"] for c in qstats["policies"].values())
+        coalesced = sum(c["coalesced"] for c in qstats["policies"].values())
+        return {
+            "config": asdict(self.cfg),
+            "simulated_hours": round(self.clock.now / 3600.0, 2),
+            "wall_seconds": round(wall_seconds, 2),
+            "events": {"sent": self.sent, "delivered": self.delivered, "missed_while_disconnected": self.missed,
+                       "dropped_by_queue": dropped, "queue_overflow": overflow, "coalesced": coalesced,
+                       "dispatched": len(self.end_to_end), "notifications": self.notifications},
+            "rate_budget": {
+                "limit_per_minute": round(lim.refill_rate * 60.0, 2),
+                "requests": granted,
+                "used_pct": round(100.0 * granted / budget, 2),
+                "busiest_hour_pct": round(100.0 * busiest / per_hour_cap, 2) if per_hour_cap else 0.0,
+                "by_priority": {p: lstats[p]["granted"] for p in PRIORITY_NAMES},
+                "limiter_wait": {p: lstats[p]["wait"] for p in PRIORITY_NAMES},
+                "server_status": dict(sorted(self.server.status.items())),
+                "retries": dict(self.http.retry_counts),
+                "sleep_seconds": round(self.clock.slept, 1),
+            },
+            "queueing_delay_s": _dist(self.queue_delay),
+            "service_time_s": _dist(self.service_time),
+            "end_to_end_s": _dist(self.end_to_end),
+            "missed_windows": {
+                "count": len(self.windows),
+                "total_seconds": round(sum(w["seconds"] for w in self.windows), 1),
+                "longest": max(self.windows, key=lambda w: w["seconds"], default=None),
+                "reconnect": self.runner.reconnect.stats(),
+            },
+            "caches": self.api.cache_stats(),
+            "prefetch": self.runner.prefetcher.stats(),
+        }
+
+
+def run_simulation(cfg: SimConfig) -> dict:
+    return Simulation(cfg).run()
+
+
+def format_report(r: dict) -> str:
+    ev, rb, mw = r["events"], r["rate_budget"], r["missed_windows"]
+    lines = [
+        f"simulated {r['simulated_hours']}h in {r['wall_seconds']}s",
+        f"events: sent={ev['sent']} delivered={ev['delivered']} missed={ev['missed_while_disconnected']} "
+        f"dropped={ev['dropped_by_queue']} coalesced={ev['coalesced']} dispatched={ev['dispatched']}",
+        f"rate budget: {rb['requests']} requests @ {rb['limit_per_minute']}/min = {rb['used_pct']}% "
+        f"(busiest hour {rb['busiest_hour_pct']}%) server={rb['server_status']} retries={rb['retries']}",
+        f"queueing delay: {r['queueing_delay_s']}",
+        f"end-to-end:     {r['end_to_end_s']}",
+        f"missed windows: {mw['count']} totalling {mw['total_seconds']}s, longest {mw['longest']}",
+        f"prefetch: warm {r['prefetch']['warm']}/{r['prefetch']['displayed']} = {r['prefetch']['warm_ratio']:.1%} "
+        f"(fetched={r['prefetch']['fetched']} seeded={r['prefetch']['seeded']} dropped={r['prefetch']['dropped']})",
+    ]
+    return "\n".join(lines)
@@ -1,7 +1,9 @@
 # snapshot.py
 from __future__ import annotations
+import time
 from colorama import Fore, Style
 from .vrchat_api import VRChatAPI
+from .roster import Roster
 
 def _status_color(status: str | None) -> str:
     if not status: return Fore.WHITE
@@ -12,30 +14,62 @@ def _status_color(status: str | None) -> str:
     if s in ("ask me", "askme", "away"): return Fore.YELLOW
     return Fore.WHITE
 
-def print_initial_snapshot(api: VRChatAPI, target_ids: set[str]) -> None:
-    all_friends = api.list_friends(offline=True) + api.list_friends(offline=False)
-
-    by_id: dict[str, dict] = {}
-    for f in all_friends:
-        uid = f.get("id") or f.get("userId") or (f.get("user") or {}).get("id") or f.get("userID")
-        if uid:
-            by_id[uid] = f
-    all_friends = list(by_id.values())
-    show_ids = target_ids or {(f.get("id") or f.get("userId")) for f in all_friends if (f.get("id") or f.get("userId"))}
+def seed_roster(api: VRChatAPI, roster: Roster) -> None:
+    """表示なしでロスターだけ埋める (daemon モード用)。"""
+    for f in api.iter_all_friends():
+        uid = f.get("id") or f.get("userId")
+        if not roster.ids or uid in roster.ids:
+            roster.seed(f)
 
+def print_initial_snapshot(api: VRChatAPI, target_ids: set[str], roster: Roster | None = None) -> None:
+    # ページ単位で流しながら表示する (全件リストは作らない)
     print("---- Initial Snapshot ----")
-    dropped = 0
-    for f in all_friends:
-        uid = f.get("id") or f.get("userId") or (f.get("user") or {}).get("id") or f.get("userID")
-        if not uid or uid not in show_ids:
+    total = shown = dropped = 0
+    for f in api.iter_all_friends():
+        total += 1
+        uid = f.get("id") or f.get("userId")
+        if target_ids and uid not in target_ids:
             dropped += 1
             continue
+        shown += 1
+        if roster is not None:
+            roster.seed(f)
         name   = f.get("displayName") or api.display_name(uid) or uid
         status = f.get("status") or "unknown"
-        world  = api.parse_location_to_world(f.get("location") or "")
+        world, _ = api.describe_location(f.get("location") or "")
         color  = _status_color(status)
         print(color + f"{name} ({uid}) status={status} location={world}" + Style.RESET_ALL)
 
     if dropped:
         print(Fore.MAGENTA + f"[SNAPSHOT] dropped: {dropped}" + Style.RESET_ALL)
-    print(Fore.CYAN + f"[SNAPSHOT] |all_friends|={len(all_friends)} |targets|={len(show_ids)}" + Style.RESET_ALL)
+    print(Fore.CYAN + f"[SNAPSHOT] |all_friends|={total} |targets|={len(target_ids) if target_ids else shown}" + Style.RESET_ALL)
+
+def _ago(seconds: float) -> str:
+    m = int(seconds // 60)
+    return f"{m // 60}h{m % 60:02d}m" if m >= 60 else f"{m}m"
+
+def print_away_changes(api: VRChatAPI, changes: list[dict], saved_at: float, limit: int = 30) -> None:
+    """チェックポイントからの差分 (離れている間の変化) を表示する。"""
+    print(Fore.CYAN + f"---- While you were away ({_ago(time.time() - saved_at)}) ----" + Style.RESET_ALL)
+    if not changes:
+        print("(no changes)")
+        return
+    for c in changes[:limit]:
+        name = c.get("displayName") or c["userId"]
+        typ = c["type"]
+        if typ == "friend-add":
+            print(Fore.CYAN + f"[FRIEND+] {name}" + Style.RESET_ALL)
+        elif typ == "friend-delete":
+            print(Fore.MAGENTA + f"[FRIEND-] {name}" + Style.RESET_ALL)
+        elif typ == "online":
+            print(Fore.GREEN + f"[ONLINE] {name}" + Style.RESET_ALL)
+        elif typ == "offline":
+            print(Fore.RED + f"[OFFLINE] {name}" + Style.RESET_ALL)
+        elif typ == "moved":
+            print(f"[MOVE] {name} -> {api.parse_location_to_world(c['after'] or '')}")
+        elif typ == "status":
+            print(_status_color(c["after"]) + f"[UPDATE] {name} status={c['before']} -> {c['after']}" + Style.RESET_ALL)
+        elif typ == "renamed":
+            print(f"[RENAME] {c['before']} -> {c['after']}")
+    if len(changes) > limit:
+        print(f"... and {len(changes) - limit} more")
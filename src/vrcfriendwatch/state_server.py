@@ -0,0 +1,149 @@
+from __future__ import annotations
+import json, logging, os, threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+try:
+    from socketserver import ThreadingUnixStreamServer
+except ImportError:  # Windows
+    ThreadingUnixStreamServer = None
+from urllib.parse import urlsplit, parse_qs
+from .tracing import TRACER
+from typing import TYPE_CHECKING
+
+if TYPE_CHECKING:
+    from .ws_client import WSRunner
+
+log = logging.getLogger(__name__)
+
+
+def _int_param(q: dict[str, str], name: str) -> int:
+    """クエリの非負整数。壊れていれば ValueError (→ 400)。"""
+    raw = q.get(name, "") or "0"
+    try:
+        value = int(raw)
+    except ValueError:
+        raise ValueError(f"{name} must be an integer: {raw!r}") from None
+    if value < 0:
+        raise ValueError(f"{name} must be >= 0")
+    return value
+
+
+class _Handler(BaseHTTPRequestHandler):
+    """
+    メモリ上の状態だけを返す読み取り専用 API。ここから VRChat API は一切叩かない。
+    ETag は状態のバージョン番号で、If-None-Match が一致すれば 304 を返す。
+    """
+    server_version = "vrcfriendwatch"
+    runner: "WSRunner"
+
+    def log_message(self, fmt, *args):
+        log.debug("[API] " + fmt, *args)
+
+    def _send_json(self, body, etag: str | None = None, status: int = 200) -> None:
+        if etag is not None and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        data = json.dumps(body, ensure_ascii=False).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-cache")
+        if etag is not None:
+            self.send_header("ETag", etag)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        parts = urlsplit(self.path)
+        q = {k: v[-1] for k, v in parse_qs(parts.query).items()}
+        path = parts.path.rstrip("/") or "/"
+        roster = self.runner.roster
+        try:
+            if path == "/friends":
+                etag = f'W/"r{roster.version}"'
+                friends = roster.snapshot()
+                state = q.get("state")
+                body = [
+                    {"id": uid, **rec} for uid, rec in friends.items()
+                    if not state or rec.get("state") == state
+                ]
+                self._send_json(body, etag)
+            elif path.startswith("/friends/"):
+                uid = path.split("/", 2)[2]
+                rec = roster.get(uid)
+                if rec is None:
+                    self._send_json({"error": "not found"}, status=404)
+                else:
+                    self._send_json({"id": uid, **rec}, f'W/"r{roster.version}"')
+            elif path == "/worlds":
+                # 中身は在室索引なので、索引の版で (ロスターの版は seed/移動で変わらないことがある)
+                version = self.runner.occupancy.version
+                self._send_json(self.runner.world_occupancy(), f'W/"o{version}"')
+            elif path == "/events":
+                since = _int_param(q, "since")
+                limit = _int_param(q, "limit") or None
+                log_ = self.runner.events
+                latest = log_.seq
+                events = log_.since(since, limit)
+                # 次のページは seq から (limit で切ったときは最後に返した分まで)
+                seq = events[-1]["seq"] if events else latest
+                self._send_json({"seq": seq, "events": events}, f'W/"e{seq}-{since}-{limit or 0}"')
+            elif path in ("/", "/health"):
+                self._send_json({
+                    "friends": len(roster),
+                    "queues": self.runner.queue_stats(),
+                    "reconnect": self.runner.reconnect.stats(),
+                    "bandwidth": self.runner.bandwidth.stats(),
+                    "fallback": self.runner.poller.stats(),
+                    "session": self.runner.session.stats() if self.runner.session is not None else None,
+                    "tracing": TRACER.stats(),
+                    "prefetch": self.runner.prefetcher.stats(),
+                    "rate_limit": self.runner.http.limiter.stats(),
+                })
+            else:
+                self._send_json({"error": "not found"}, status=404)
+        except (ValueError, KeyError) as e:
+            self._send_json({"error": str(e)}, status=400)
+
+
+if ThreadingUnixStreamServer is not None:
+    class _UnixHTTPServer(ThreadingUnixStreamServer):
+        daemon_threads = True
+
+        def get_request(self):
+            # BaseHTTPRequestHandler は client_address[0] を参照するのでタプルにしておく
+            req, _ = super().get_request()
+            return req, ("unix", 0)
+
+
+class StateServer:
+    """
+    WSRunner の状態を localhost の HTTP か Unix ソケットで公開する。
+    listen: "127.0.0.1:8765" 形式 / unix_path: 指定時はこちらを優先
+    """
+    def __init__(self, runner: "WSRunner", listen: str = "127.0.0.1:8765", unix_path: str | None = None):
+        handler = type("Handler", (_Handler,), {"runner": runner})
+        self.unix_path = unix_path
+        if unix_path and ThreadingUnixStreamServer is not None:
+            if os.path.exists(unix_path):
+                os.unlink(unix_path)
+            self.httpd = _UnixHTTPServer(unix_path, handler)
+            self.address = unix_path
+        else:
+            host, _, port = listen.rpartition(":")
+            self.httpd = ThreadingHTTPServer((host or "127.0.0.1", int(port)), handler)
+            self.httpd.daemon_threads = True
+            self.address = "http://%s:%d" % self.httpd.server_address[:2]
+        self._thread: threading.Thread | None = None
+
+    def start(self) -> None:
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="state-server", daemon=True)
+        self._thread.start()
+        log.info("[API] listening on %s", self.address)
+
+    def stop(self) -> None:
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self.unix_path and os.path.exists(self.unix_path):
+            os.unlink(self.unix_path)
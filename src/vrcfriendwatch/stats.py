@@ -0,0 +1,20 @@
+from __future__ import annotations
+
+
+class Series:
+    """直近の値と件数/平均/最大だけ持つ軽い集計。"""
+    __slots__ = ("count", "total", "max", "last")
+
+    def __init__(self):
+        self.count, self.total, self.max, self.last = 0, 0.0, 0.0, 0.0
+
+    def add(self, v: float) -> None:
+        self.count += 1
+        self.total += v
+        self.max = max(self.max, v)
+        self.last = v
+
+    def as_dict(self) -> dict:
+        avg = self.total / self.count if self.count else 0.0
+        return {"count": self.count, "last": round(self.last, 3),
+                "avg": round(avg, 3), "max": round(self.max, 3)}
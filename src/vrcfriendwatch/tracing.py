@@ -0,0 +1,298 @@
+from __future__ import annotations
+import itertools, json, logging, os, random, threading, time
+from collections import deque
+from pathlib import Path
+
+log = logging.getLogger(__name__)
+
+
+class Trace:
+    """
+    pipeline のフレーム 1 つ分のトレース。ステージをまたいで item と一緒に運ばれ、
+    hold した数だけ release されたら (= 全ステージを抜けたら) 終わる。
+    """
+    __slots__ = ("id", "start", "spans", "marks", "pending", "type", "uid", "lock")
+
+    def __init__(self, id: int, start: float):
+        self.id, self.start = id, start
+        # (name, start, end, tid, args)
+        self.spans: list[tuple] = []
+        self.marks: dict[str, float] = {}
+        self.pending = 1
+        self.type: str | None = None
+        self.uid: str | None = None
+        self.lock = threading.Lock()
+
+    def hold(self, stage: str) -> None:
+        """ステージのキューに積む直前に呼ぶ (待ち時間の起点も記録する)。"""
+        with self.lock:
+            self.pending += 1
+        self.marks[stage] = time.perf_counter()
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+    def set(self, **args) -> None:
+        pass
+
+
+_NULL = _NullSpan()
+
+
+class _Span:
+    __slots__ = ("trace", "name", "args", "start")
+
+    def __init__(self, trace: Trace, name: str, args: dict):
+        self.trace, self.name, self.args = trace, name, args
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.spans.append((self.name, self.start, time.perf_counter(), threading.get_ident(), self.args))
+        return False
+
+    def set(self, **args) -> None:
+        self.args.update(args)
+
+
+class _StageSpan(_Span):
+    """ステージ 1 つ分: キュー待ちを記録し、処理中はトレースをこのスレッドの current にする。"""
+    __slots__ = ("tracer", "prev")
+
+    def __init__(self, tracer: "Tracer", trace: Trace, name: str):
+        super().__init__(trace, name, {})
+        self.tracer = tracer
+
+    def __enter__(self):
+        super().__enter__()
+        queued = self.trace.marks.pop(self.name, None)
+        if queued is not None:
+            self.trace.spans.append(("queue:" + self.name, queued, self.start, threading.get_ident(), {}))
+        self.prev = self.tracer.current()
+        self.tracer._local.trace = self.trace
+        return self
+
+    def __exit__(self, *exc):
+        super().__exit__(*exc)
+        self.tracer._local.trace = self.prev
+        self.tracer.release(self.trace)
+        return False
+
+
+class Tracer:
+    """
+    フレーム受信 → 名前/ワールド解決 (limiter 待ち, 429 の backoff 含む) → 通知 までのスパンを取る。
+
+    有効なら全イベントをメモリ上でトレースし (1 スパン数 µs)、終わった時点で
+    - sample の割合で選ばれたもの
+    - 合計が slow_ms を超えたもの (サンプルから漏れていても)
+    を Chrome trace event 形式 (JSON Array, chrome://tracing / Perfetto で開ける) で path に追記する。
+    遅いものはスパン別の内訳を WARNING で出し、直近 exemplars 件を stats() に残す。
+    """
+    def __init__(self):
+        self.enabled = False
+        self.path: Path | None = None
+        self.sample = 0.0
+        self.slow_ms = 0.0
+        self.rng = random.Random()
+        self._local = threading.local()
+        self._ids = itertools.count(1)
+        self.lock = threading.Lock()
+        self._fh = None
+        self._named_tids: set[int] = set()
+        self.t0 = time.perf_counter()
+        self.pid = os.getpid()
+        self.exemplars: deque[dict] = deque(maxlen=20)
+        self.traced = 0
+        self.finished = 0
+        self.written = 0
+        self.slow = 0
+        self.discarded = 0
+
+    def configure(self, path: Path | str | None, sample: float = 0.0, slow_ms: float = 0.0,
+                  exemplars: int = 20, rng: random.Random | None = None) -> None:
+        self.close()
+        self.path = Path(path) if path else None
+        self.sample = max(0.0, min(1.0, float(sample)))
+        self.slow_ms = float(slow_ms)
+        self.exemplars = deque(self.exemplars, maxlen=max(1, int(exemplars)))
+        self.rng = rng or self.rng
+        self.enabled = self.sample > 0 or self.slow_ms > 0
+
+    # --- 記録 ---
+    def current(self) -> Trace | None:
+        return getattr(self._local, "trace", None)
+
+    def begin(self) -> Trace | None:
+        """フレームを受け取った時点で呼ぶ。無効なら None。"""
+        if not self.enabled:
+            return None
+        self.traced += 1
+        return Trace(next(self._ids), time.perf_counter())
+
+    def span(self, name: str, **args):
+        trace = self.current()
+        if trace is None:
+            return _NULL
+        return _Span(trace, name, args)
+
+    def stage(self, trace: Trace | None, name: str):
+        """ステージのハンドラを包む。trace を hold したステージでだけ使う。"""
+        if trace is None:
+            return _NULL
+        return _StageSpan(self, trace, name)
+
+    def activate(self, trace: Trace | None):
+        """受信スレッド用: begin() したトレースを current にして、抜けるとき release する。"""
+        if trace is None:
+            return _NULL
+        self.span_from(trace, "decode", trace.start, time.perf_counter())
+        return _StageSpan(self, trace, "ingest")
+
+    def span_from(self, trace: Trace, name: str, start: float, end: float, **args) -> None:
+        trace.spans.append((name, start, end, threading.get_ident(), args))
+
+    def hold(self, stage: str) -> Trace | None:
+        """current のトレースを stage に持っていく。item に添える Trace (無ければ None) を返す。"""
+        trace = self.current()
+        if trace is not None:
+            trace.hold(stage)
+        return trace
+
+    def discard(self, trace: Trace, stage: str, reason: str) -> None:
+        """stage のキューで捨てられた (reason: dropped / coalesced) ときに hold の代わりに呼ぶ。"""
+        queued = trace.marks.pop(stage, None)
+        if queued is not None:
+            self.span_from(trace, "queue:" + stage, queued, time.perf_counter(), **{reason: True})
+        with self.lock:
+            self.discarded += 1
+        self.release(trace)
+
+    def discarder(self, stage: str):
+        """EventQueue の on_discard 用。item の末尾に添えた Trace を discard する。"""
+        def on_discard(item, reason: str) -> None:
+            if isinstance(item, tuple) and item and isinstance(item[-1], Trace):
+                self.discard(item[-1], stage, reason)
+        return on_discard
+
+    def release(self, trace: Trace) -> None:
+        with trace.lock:
+            trace.pending -= 1
+            if trace.pending:
+                return
+        self._finish(trace)
+
+    # --- 終了時 ---
+    def _finish(self, trace: Trace) -> None:
+        # 振り分けで捨てたフレーム (対象外/未対応の type) は残さない
+        if trace.type is None:
+            return
+        spans = sorted(trace.spans, key=lambda s: s[1])
+        end = max(s[2] for s in spans) if spans else trace.start
+        total_ms = (end - trace.start) * 1000
+        slow = self.slow_ms > 0 and total_ms >= self.slow_ms
+        with self.lock:
+            self.finished += 1
+            if slow:
+                self.slow += 1
+        if slow:
+            self._exemplar(trace, spans, total_ms)
+        if slow or (self.sample > 0 and self.rng.random() < self.sample):
+            self._write(trace, spans, end)
+
+    def _exemplar(self, trace: Trace, spans: list[tuple], total_ms: float) -> None:
+        breakdown: dict[str, float] = {}
+        for name, s, e, _, _ in spans:
+            breakdown[name] = breakdown.get(name, 0.0) + (e - s) * 1000
+        top = sorted(breakdown.items(), key=lambda kv: -kv[1])
+        ex = {"trace": trace.id, "ts": time.time(), "type": trace.type, "userId": trace.uid,
+              "total_ms": round(total_ms, 1), "spans": {k: round(v, 1) for k, v in top}}
+        with self.lock:
+            self.exemplars.append(ex)
+        log.warning("[TRACE] slow %s %s: %.0fms (%s)", trace.type, trace.uid, total_ms,
+                    ", ".join(f"{k}={v:.0f}ms" for k, v in top[:4]))
+
+    def _us(self, t: float) -> float:
+        return round((t - self.t0) * 1e6, 1)
+
+    def _write(self, trace: Trace, spans: list[tuple], end: float) -> None:
+        if self.path is None:
+            return
+        events: list[dict] = []
+        base = {"pid": self.pid, "cat": "vrcfriendwatch"}
+        # スレッドをまたぐ全体は async イベントで、各スパンはスレッドごとの complete イベントで
+        events.append({**base, "ph": "b", "name": trace.type, "id": trace.id, "ts": self._us(trace.start),
+                       "args": {"userId": trace.uid}})
+        events.append({**base, "ph": "e", "name": trace.type, "id": trace.id, "ts": self._us(end)})
+        for name, s, e, tid, args in spans:
+            if name.startswith("queue:"):
+                # キュー待ちは受け取ったスレッドの前の処理と重なるので async 側に置く
+                events.append({**base, "ph": "b", "name": name, "id": trace.id, "ts": self._us(s)})
+                events.append({**base, "ph": "e", "name": name, "id": trace.id, "ts": self._us(e)})
+                continue
+            events.append({**base, "ph": "X", "name": name, "tid": tid, "ts": self._us(s),
+                           "dur": round((e - s) * 1e6, 1), "args": {"trace": trace.id, **args}})
+        with self.lock:
+            try:
+                fh = self._open()
+                for tid in {ev["tid"] for ev in events if "tid" in ev} - self._named_tids:
+                    self._named_tids.add(tid)
+                    fh.write(json.dumps({"ph": "M", "name": "thread_name", "pid": self.pid, "tid": tid,
+                                         "args": {"name": _thread_name(tid)}}) + ",\n")
+                fh.write("".join(json.dumps(ev, ensure_ascii=False) + ",\n" for ev in events))
+                fh.flush()
+                self.written += 1
+            except OSError as e:
+                log.warning("[TRACE] write failed: %s", e)
+
+    def _open(self):
+        if self._fh is None:
+            new = not self.path.exists() or self.path.stat().st_size == 0
+            self._fh = open(self.path, "a", encoding="utf-8")
+            self._named_tids.clear()
+            # 閉じ括弧と末尾のカンマは無くても読める形式
+            if new:
+                self._fh.write("[\n")
+        return self._fh
+
+    def close(self) -> None:
+        with self.lock:
+            if self._fh is not None:
+                self._fh.close()
+                self._fh = None
+
+    def stats(self) -> dict:
+        with self.lock:
+            return {
+                "enabled": self.enabled,
+                "traced": self.traced,
+                "finished": self.finished,
+                "written": self.written,
+                "slow": self.slow,
+                "discarded": self.discarded,
+                "exemplars": list(self.exemplars),
+            }
+
+
+def _thread_name(tid: int) -> str:
+    for t in threading.enumerate():
+        if t.ident == tid:
+            return t.name
+    return str(tid)
+
+
+TRACER = Tracer()
+
+
+def span(name: str, **args):
+    """current のトレースにスパンを足す。トレース中でなければ何もしない。"""
+    return TRACER.span(name, **args)
@@ -1,17 +1,38 @@
 from __future__ import annotations
-import logging, re
-from functools import lru_cache
+import logging
+from typing import Iterator
+import requests
 from .http_client import VRChatHTTP
+from .location import Location, parse_location, intern_id
+from .records import FriendRecord
+from .cache import LRUCache
+from .rate_limiter import PRIORITY_RESYNC
+from .clock import Clock, SYSTEM_CLOCK
+from .tracing import span
 
 log = logging.getLogger(__name__)
-_LOC_RE = re.compile(r"^(wrld_[0-9a-fA-F-]+)(?::(.+))?$")
+
+# 取れなかったワールド (private / 削除済み) を覚えておく秒数。一時的な失敗 (429/5xx/接続) は短め
+MISSING_WORLD_TTL = 3600.0
+FAILED_WORLD_TTL = 60.0
+
+def world_id_of(location: str | None)->str | None:
+    """location 文字列からワールドIDだけ取り出す (API は叩かない)。"""
+    return parse_location(location).world_id
 
 class VRChatAPI:
-    def __init__(self,http: VRChatHTTP)->None:
+    def __init__(self,http: VRChatHTTP,cache_size: int = 2048,clock: Clock | None = None)->None:
         self.http = http
+        self.clock = clock or SYSTEM_CLOCK
+        # lru_cache(self, id) だと API インスタンスごと保持されるので自前の LRU を持つ
+        self.names: LRUCache[str,str] = LRUCache(cache_size)
+        self.worlds: LRUCache[str,str] = LRUCache(cache_size)
+        # world_id → 次に問い合わせてよい時刻。worlds (チェックポイントに残る) には混ぜない
+        self.missing_worlds: LRUCache[str,float] = LRUCache(cache_size)
 
-    def list_friends(self,*,offline:bool,n:int =100)->list[dict]:
-        out,offset,n=[],0,min(int(n),100)
+    def iter_friends(self,*,offline:bool,n:int =100)->Iterator[dict]:
+        """friends API をページ単位で取りながら 1 件ずつ yield する (全件をメモリに溜めない)。"""
+        offset,n=0,min(int(n),100)
         while True:
             r = self.http.get(
                 "https://api.vrchat.cloud/api/1/auth/user/friends",
@@ -20,41 +41,134 @@ class VRChatAPI:
             if not r.ok:
                 log.warning("Failed to fetch friends (offline=%s): %s %s",
                             offline,r.status_code,r.reason)
-                break
+                return
             chunk = r.json() or []
             if not isinstance(chunk,list)or not chunk:
-                break
-            out.extend(chunk)
+                return
+            yield from chunk
             if len(chunk)<n:
-                break
+                return
             offset += n
-        return out
 
-    def fetch_all_friend_ids(self)->set[str]:
-        ids : set[str]=set()
+    def iter_all_friends(self)->Iterator[dict]:
+        """オフライン → オンラインの順に全フレンドを流す。ページ境界の重複は ID で除く。"""
+        seen: set[str] = set()
         for offline in (True,False):
-            for f in self.list_friends(offline=offline):
+            for f in self.iter_friends(offline=offline):
                 uid = f.get("id")or f.get("userId")
-                if uid:
-                    ids.add(uid)
-        return ids
+                if not uid or uid in seen:
+                    continue
+                seen.add(uid)
+                yield f
 
-    @lru_cache(maxsize=2048)
-    def display_name(self,user_id:str)->str:
+    def list_friends(self,*,offline:bool,n:int =100)->list[FriendRecord]:
+        """全ページを FriendRecord (必要なフィールドだけ) のリストで返す。"""
+        out = []
+        for f in self.iter_friends(offline=offline,n=n):
+            rec = FriendRecord.from_api(f)
+            if rec is not None:
+                out.append(rec)
+        return out
+
+    def fetch_all_friend_ids(self)->set[str]:
+        return {f.get("id")or f.get("userId") for f in self.iter_all_friends()}
+
+    def friend_ids_conditional(self,etag: str | None = None)->tuple[set[str] | None,str | None]:
+        """
+        /auth/user の friends 配列 (ID のみ) を If-None-Match 付きで取得。
+        変化なし(304)や失敗時は (None, etag) を返す。
+        """
+        headers = {"If-None-Match":etag} if etag else None
+        # 定期同期なので表示用の名前/ワールド解決より後ろに並ぶ
+        r = self.http.get("https://api.vrchat.cloud/api/1/auth/user",headers=headers,priority=PRIORITY_RESYNC)
+        if r.status_code == 304:
+            return None,etag
+        if not r.ok:
+            log.warning("Failed to fetch friend ids: %s %s",r.status_code,r.reason)
+            return None,etag
+        data = r.json() or {}
+        friends = data.get("friends") if isinstance(data,dict) else None
+        if not isinstance(friends,list):
+            return None,etag
+        return set(friends),(r.headers.get("ETag") or etag)
+
+    def online_friends_page(self,offset:int,n:int =100,etag: str | None = None)->tuple[list | None,str | None]:
+        """
+        オンラインのフレンド 1 ページを If-None-Match 付きで取得 (ポーリング用)。
+        変化なし(304)は (None, etag)、失敗時は (None, None) を返す。
+        """
+        headers = {"If-None-Match":etag} if etag else None
+        r = self.http.get(
+            "https://api.vrchat.cloud/api/1/auth/user/friends",
+            params={"offset":offset,"n":n,"offline":"false"},
+            headers=headers,priority=PRIORITY_RESYNC,
+        )
+        if r.status_code == 304:
+            return None,etag
+        if not r.ok:
+            log.warning("Failed to poll online friends: %s %s",r.status_code,r.reason)
+            return None,None
+        chunk = r.json() or []
+        return (chunk if isinstance(chunk,list) else []),(r.headers.get("ETag") or None)
+
+    def display_name(self,user_id:str,**kw)->str:
+        """kw は http.get へ (先読みの priority など)。"""
         if not user_id:return ""
-        r = self.http.get(f"https://api.vrchat.cloud/api/1/users/{user_id}")
-        return (r.json() or {}).get("displayName","")if r.ok else ""
+        name = self.names.get(user_id)
+        if name is not None:
+            return name
+        try:
+            with span("api.user",id=user_id):
+                r = self.http.get(f"https://api.vrchat.cloud/api/1/users/{user_id}",**kw)
+        except requests.RequestException as e:
+            # リトライし尽くした接続エラーなど。名前なしで通知は出す
+            log.warning("[API] user %s lookup failed: %s",user_id,e)
+            return ""
+        if not r.ok:
+            return ""
+        name = (r.json() or {}).get("displayName","")
+        self.names.put(intern_id(user_id),name)
+        return name
 
-    @lru_cache(maxsize=2048)
-    def world_name(self,world_id:str)->str:
+    def world_name(self,world_id:str,**kw)->str:
         if not world_id:return ""
-        r = self.http.get(f"https://api.vrchat.cloud/api/1/worlds/{world_id}")
-        if r.ok:
-            name = (r.json() or {}).get("name","")
-            return name or world_id
-        return world_id
+        name = self.worlds.get(world_id)
+        if name is not None:
+            return name
+        if self.world_missing(world_id):
+            return world_id
+        try:
+            with span("api.world",id=world_id):
+                r = self.http.get(f"https://api.vrchat.cloud/api/1/worlds/{world_id}",**kw)
+        except requests.RequestException as e:
+            # 一時的な失敗として短めに覚え、ID のまま表示する
+            log.warning("[API] world %s lookup failed: %s",world_id,e)
+            self.missing_worlds.put(intern_id(world_id),self.clock.monotonic()+FAILED_WORLD_TTL)
+            return world_id
+        if not r.ok:
+            permanent = 400 <= r.status_code < 500 and r.status_code != 429
+            ttl = MISSING_WORLD_TTL if permanent else FAILED_WORLD_TTL
+            self.missing_worlds.put(intern_id(world_id),self.clock.monotonic()+ttl)
+            return world_id
+        name = (r.json() or {}).get("name","") or world_id
+        self.worlds.put(intern_id(world_id),name)
+        return name
+
+    def world_missing(self,world_id:str)->bool:
+        """最近取れなかったワールドなら True (期限までは問い合わせず ID のまま表示する)。"""
+        until = self.missing_worlds.peek(world_id)
+        return until is not None and self.clock.monotonic() < until
+
+    def cache_stats(self)->dict:
+        return {"names":self.names.stats(),"worlds":self.worlds.stats(),"missing_worlds":self.missing_worlds.stats()}
 
     def parse_location_to_world(self,location: str)->str:
         if not location: return "(unknown)"
-        m = _LOC_RE.match(location)
-        return self.world_name(m.group(1)) if m else location
\ No newline at end of file
+        loc = parse_location(location)
+        return self.world_name(loc.world_id) if loc.world_id else location
+
+    def describe_location(self,location: str)->tuple[str,Location]:
+        """表示用: 'ワールド名 [invite+ jp]' と解析結果を返す。"""
+        loc = parse_location(location)
+        world = self.parse_location_to_world(location)
+        return (f"{world} [{loc.label}]" if loc.in_world and loc.label else world),loc
\ No newline at end of file
@@ -1,16 +1,57 @@
 # ws_client.py（該当部分だけ差し替え）
 
 from __future__ import annotations
-import time, random, logging, traceback, json
-from websocket import WebSocketApp
+import logging, traceback, json, random
+from websocket import WebSocketApp, __version__ as WEBSOCKET_VERSION
 from colorama import Fore, Back, Style
 from .settings import SETTINGS
 from .notify import notify
 from .vrchat_api import VRChatAPI
+from .location import intern_id
 from .http_client import VRChatHTTP
+from .roster import Roster, RosterSync, EventLog
+from .occupancy import OccupancyIndex
+from .reconnect import ReconnectPolicy, StallWatchdog
+from .event_queue import Stage, POLICIES, POLICY_NEVER, POLICY_LATEST, POLICY_SHED
+from .clock import Clock, SYSTEM_CLOCK
+from .bandwidth import BandwidthMeter
+from .polling import PollingFallback
+from .session import SessionManager
+from .tracing import TRACER
+from .prefetch import Prefetcher
 
 log = logging.getLogger(__name__)
 
+HANDLED_TYPES = ("friend-online", "friend-offline", "friend-location", "friend-update",
+                 "friend-add", "friend-delete", "friend-active")
+# フレンド集合そのものを変えるイベント (target フィルタより前に反映する)
+ROSTER_TYPES = ("friend-add", "friend-delete")
+
+# イベント種別ごとの溢れ方。online/offline は絶対に捨てない、位置とステータスはユーザごとに最新だけ。
+DEFAULT_POLICIES: dict[str, str] = {
+    "friend-online": POLICY_NEVER,
+    "friend-offline": POLICY_NEVER,
+    "friend-location": POLICY_LATEST,
+    "friend-update": POLICY_LATEST,
+    "friend-add": POLICY_NEVER,
+    "friend-delete": POLICY_NEVER,
+    "friend-active": POLICY_LATEST,
+    "gathering": POLICY_LATEST,
+    "debug": POLICY_SHED,
+}
+
+def parse_policies(spec: str | None) -> dict[str, str]:
+    """'friend-update=shed,friend-location=latest' 形式で DEFAULT_POLICIES を上書き。"""
+    out = dict(DEFAULT_POLICIES)
+    for part in (spec or "").split(","):
+        typ, sep, pol = part.strip().partition("=")
+        pol = pol.strip().lower()
+        if sep and typ and pol in POLICIES:
+            out[typ.strip()] = pol
+        elif part.strip():
+            log.warning("ignored EVENT_POLICIES entry: %r", part)
+    return out
+
 def status_color(s: str | None) -> str:
     if not s: return ""
     s = s.lower()
@@ -21,9 +62,124 @@ def status_color(s: str | None) -> str:
     return Fore.WHITE
 
 class WSRunner:
-    def __init__(self, http: VRChatHTTP, api: VRChatAPI):
+    def __init__(self, http: VRChatHTTP, api: VRChatAPI,
+                 clock: Clock | None = None, rng: random.Random | None = None):
         self.http, self.api = http, api
-        self.target_ids: set[str] = set()
+        self.clock = clock or SYSTEM_CLOCK
+        self.roster = Roster()
+        self.occupancy = OccupancyIndex(SETTINGS.gathering_threshold, on_gathering=self._on_gathering)
+        self.roster_sync = RosterSync(api, self.roster, interval=SETTINGS.friend_resync_minutes * 60.0,
+                                      on_removed=self._forget)
+        self.policies = parse_policies(SETTINGS.event_policies)
+        # stage 1: 名前/ワールド解決と表示, stage 2: 通知
+        self.dispatch = Stage("dispatch", self._dispatch, capacity=SETTINGS.event_queue_size,
+                              on_discard=TRACER.discarder("dispatch"))
+        self.notifier = Stage("notify", self._notify, capacity=SETTINGS.event_queue_size,
+                              on_discard=TRACER.discarder("notify"))
+        self.reconnect = ReconnectPolicy(cap=SETTINGS.ws_backoff_cap, stable_after=SETTINGS.ws_stable_after,
+                                         clock=self.clock, rng=rng)
+        self.events = EventLog(SETTINGS.recent_events)
+        if SETTINGS.ws_compression == "deflate":
+            # websocket-client は RSV1 付きフレームを protocol error にするので交渉できない
+            log.warning("[WS] permessage-deflate is not supported by websocket-client %s; "
+                        "estimating the savings instead", WEBSOCKET_VERSION)
+        self.bandwidth = BandwidthMeter(estimate=SETTINGS.ws_compression in ("estimate", "deflate"))
+        self.poller = PollingFallback(
+            api, self.roster, self.ingest, self.reconnect, http.limiter, clock=self.clock,
+            min_interval=SETTINGS.poll_min_seconds, max_interval=SETTINGS.poll_max_seconds,
+            budget_share=SETTINGS.poll_budget_share, switch_back_after=SETTINGS.poll_switch_back_after,
+        )
+        self.prefetcher = Prefetcher(api, http.limiter, clock=self.clock, reserve=SETTINGS.prefetch_reserve)
+        # 指定されていれば再接続時のトークンはここから貰う (ログイン/2FA を待たない)
+        self.session: SessionManager | None = None
+        self.watchdog: StallWatchdog | None = None
+        # daemon モードでは False (コンソールに出さない)
+        self.console = True
+
+    @property
+    def target_ids(self) -> set[str]:
+        return self.roster.ids
+
+    @target_ids.setter
+    def target_ids(self, ids: set[str]) -> None:
+        self.roster.reconcile(set(ids))
+
+    def start_workers(self) -> None:
+        self.dispatch.start()
+        self.notifier.start()
+        self.roster_sync.start()
+        if SETTINGS.prefetch:
+            self.prefetcher.start()
+
+    def apply_settings(self, changed: dict[str, tuple]) -> None:
+        """
+        SETTINGS.reload() の購読者。変わった live 項目を動いている部品に反映する (再接続はしない)。
+        値は SETTINGS から読み直すので changed はどれが変わったかだけ見る。
+        """
+        if changed.keys() & {"rate_limit_per_minute", "rate_burst_capacity"}:
+            self.http.limiter.reconfigure(capacity=SETTINGS.rate_burst_capacity,
+                                          refill_rate=SETTINGS.rate_limit_per_minute / 60.0)
+        if "event_policies" in changed:
+            self.policies = parse_policies(SETTINGS.event_policies)
+        if "gathering_threshold" in changed:
+            self.occupancy.threshold = SETTINGS.gathering_threshold
+        if "ws_backoff_cap" in changed:
+            self.reconnect.cap = SETTINGS.ws_backoff_cap
+        dog = self.watchdog
+        if dog is not None and changed.keys() & {"ws_stall_after", "ws_stall_grace"}:
+            dog.stall_after, dog.grace = SETTINGS.ws_stall_after, SETTINGS.ws_stall_grace
+        with self.poller.lock:
+            self.poller.min_interval = SETTINGS.poll_min_seconds
+            self.poller.max_interval = SETTINGS.poll_max_seconds
+            self.poller.interval = min(max(self.poller.interval, self.poller.min_interval), self.poller.max_interval)
+            self.poller.budget_share = SETTINGS.poll_budget_share
+            self.poller.switch_back_after = SETTINGS.poll_switch_back_after
+        self.prefetcher.reserve = SETTINGS.prefetch_reserve
+        if self.session is not None:
+            self.session.reconfigure(SETTINGS.session_check_minutes * 60, SETTINGS.session_refresh_hours * 3600)
+
+    def queue_stats(self) -> dict:
+        return {"dispatch": self.dispatch.queue.stats(), "notify": self.notifier.queue.stats()}
+
+    def world_occupancy(self) -> dict[str, dict]:
+        """ワールドID → インスタンスごとの在室フレンド。索引を読むだけで API は叩かない。"""
+        return self.occupancy.snapshot()
+
+    def seed_occupancy(self) -> None:
+        self.occupancy.seed(self.roster.snapshot())
+
+    def _track(self, typ: str, uid: str, content: dict) -> None:
+        """ロスターと在室索引を更新する (WS スレッドで呼ぶ、O(1))。"""
+        self.roster.apply_event(typ, uid, content)
+        if typ in ("friend-delete", "friend-offline", "friend-active"):
+            self.occupancy.leave(uid)
+        elif typ in ("friend-online", "friend-location", "friend-add") and uid in self.roster:
+            self.occupancy.move(uid, self.roster.location_of(uid))
+
+    def _forget(self, uids: set[str]) -> None:
+        for uid in uids:
+            self.occupancy.leave(uid)
+
+    def _on_gathering(self, loc, members: list[str]) -> None:
+        # 名前解決は dispatch ステージで
+        self._enqueue(self.dispatch, "gathering", loc.instance_key,
+                      ("gathering", loc.instance_key, {"location": loc.raw, "friends": members}))
+
+    def _print(self, line: str) -> None:
+        if self.console:
+            print(line)
+
+    def _enqueue(self, stage: Stage, typ: str, uid: str | None, item: tuple) -> bool:
+        policy = self.policies.get(typ, POLICY_NEVER)
+        key = (typ, uid) if policy == POLICY_LATEST and uid else None
+        if typ != "debug":
+            # トレース中なら次のステージへ持っていく (item の末尾に添える)
+            trace = TRACER.hold(stage.name)
+            if trace is not None:
+                if trace.type is None:
+                    trace.type, trace.uid = typ, uid
+                item = item + (trace,)
+        return stage.put(item, policy, key)
 
     def make_ws(self, auth_token: str) -> WebSocketApp:
         url = f"wss://pipeline.vrchat.cloud/?authToken={auth_token}"
@@ -33,35 +189,69 @@ class WSRunner:
             url, header=headers,
             on_open=self.on_open, on_message=self.on_message,
             on_error=self.on_error, on_close=self.on_close,
+            on_ping=self.on_ping, on_pong=self.on_pong,
         )
 
     def run_forever_with_reconnect(self, initial_auth: str | None = None) -> None:
-        backoff, auth = 1, initial_auth
+        self.start_workers()
+        auth = initial_auth
         while True:
             if not auth:
                 auth, name = self.http.ensure_login()
                 log.info("Logged in as: %s", name)
-                backoff = 1
+                self.reconnect.reset()
+                if self.session is not None:
+                    self.session.adopt(auth)
             ws = self.make_ws(auth)
+            dog = self.watchdog = StallWatchdog(
+                self.reconnect, close=ws.close, ping=lambda: ws.sock and ws.sock.ping(),
+                stall_after=SETTINGS.ws_stall_after, grace=SETTINGS.ws_stall_grace,
+            )
+            dog.start()
             try:
                 ws.run_forever(ping_interval=55, ping_timeout=20, skip_utf8_validation=True)
             except Exception as e:
                 log.error("WS run_forever error: %s", e)
+            finally:
+                dog.stop()
+            self.reconnect.on_disconnected()
+            if self.session is not None:
+                # backoff で寝ている間に裏でトークンを確かめておいてもらう
+                self.session.on_disconnected()
+            if (SETTINGS.poll_fallback_after > 0 and not self.poller.active
+                    and self.reconnect.failures >= SETTINGS.poll_fallback_after):
+                self.poller.start()
+                self.notifier.put(("VRChat", "WebSocketに繋がらないためポーリングで監視しています"))
 
-            sleep = min(backoff, 30) + random.uniform(0, 1.0)
-            log.info("Reconnecting in %.1fs...", sleep)
-            time.sleep(sleep)
-            backoff = min(backoff * 2, 30)
+            sleep = self.reconnect.next_delay()
+            if sleep > 0:
+                log.info("Reconnecting in %.1fs...", sleep)
+                self.clock.sleep(sleep)
+            else:
+                log.info("Server closed the connection cleanly; reconnecting now")
 
-            try:
-                r = self.http.s.get("https://api.vrchat.cloud/api/1/auth/user")
-                if r.status_code == 401:
-                    auth = None
-            except Exception:
-                pass
+            if self.session is not None:
+                auth = self.session.token
+            elif not self.http.session_valid():
+                auth = None
 
     # --- Handlers ---
-    def on_open(self, ws): log.info("WS connected")
+    def on_open(self, ws):
+        self.reconnect.on_connected()
+        st = self.reconnect.stats()
+        if st["reconnect_latency"]["count"]:
+            log.info("WS connected (reconnect latency %.2fs, gap %.2fs)",
+                     st["reconnect_latency"]["last"], st["gap"]["last"])
+        else:
+            log.info("WS connected")
+
+    def on_ping(self, ws, data):
+        self.reconnect.on_activity()
+        self.bandwidth.record_control(len(data or b""))
+
+    def on_pong(self, ws, data):
+        self.reconnect.on_activity()
+        self.bandwidth.record_control(len(data or b""))
 
     def on_error(self, ws, err):
         log.error("WS error: %s", err)
@@ -69,62 +259,127 @@ class WSRunner:
 
     def on_close(self, ws, code, msg):
         log.warning("WS closed: %s %s", code, msg)
-        notify("VRChat", "WebSocketが切断されました (自動再接続中)")
+        self.reconnect.on_closed(code)
+        self.notifier.put(("VRChat", "WebSocketが切断されました (自動再接続中)"))
 
     def on_message(self, ws, raw):
+        # WS スレッドではデコードと振り分けだけ。重い処理は dispatch ステージへ
+        trace = TRACER.begin()
+        self.reconnect.on_activity()
         try:
             msg = json.loads(raw)
         except Exception:
-            log.debug("Non-JSON: %s", raw)
+            self.bandwidth.record("(invalid)", raw)
+            if SETTINGS.debug:
+                self._enqueue(self.dispatch, "debug", None, ("debug", None, raw))
             return
 
         typ = msg.get("type")
+        self.bandwidth.record(typ if isinstance(typ, str) else "(none)", raw)
         content = msg.get("content")
         if isinstance(content, str):
             try:
                 content = json.loads(content)
             except Exception:
                 pass
+        with TRACER.activate(trace):
+            self.ingest(typ, content)
 
-        # ✨ ここを 'typ' に
-        if typ not in ("friend-online", "friend-offline", "friend-location", "friend-update"):
+    def ingest(self, typ, content) -> None:
+        """デコード済みのイベント 1 件を振り分ける (WS とポーリングの共通の入口)。"""
+        if typ not in HANDLED_TYPES:
             return
+        content = content if isinstance(content, dict) else {}
 
         uid = (
-            (content or {}).get("userId")
+            content.get("userId")
             or (content.get("user") or {}).get("id")
-            or (content or {}).get("id")
+            or content.get("id")
         )
         if not uid:
-            log.debug("[DROP] type=%s no user id", typ)
+            if SETTINGS.debug:
+                self._enqueue(self.dispatch, "debug", None, ("debug", None, f"type={typ} no user id"))
+            return
+        uid = intern_id(uid)
+        if typ not in ROSTER_TYPES and self.target_ids and uid not in self.target_ids:
+            if SETTINGS.debug:
+                self._enqueue(self.dispatch, "debug", None, ("debug", uid, "not in target set"))
+            return
+
+        # 後の表示で要る名前/ワールドを今のうちに (payload にあればそのまま、無ければ先読みキューへ)
+        self.prefetcher.offer(typ, uid, content)
+        self._enqueue(self.dispatch, typ, uid, (typ, uid, content))
+        # 集合/状態の更新はフィルタを通った直後に同じスレッドで (friend-add は以降のイベントから有効)
+        self._track(typ, uid, content)
+
+    def _notify(self, item: tuple) -> None:
+        title, body = item[:2]
+        with TRACER.stage(item[2] if len(item) > 2 else None, "notify"):
+            notify(title, body)
+
+    def _dispatch(self, item: tuple) -> None:
+        with TRACER.stage(item[3] if len(item) > 3 else None, "dispatch"):
+            self._dispatch_event(*item[:3])
+
+    def _dispatch_event(self, typ: str, uid: str | None, content) -> None:
+        if typ == "debug":
+            log.debug("[DROP] uid=%s %s", uid, content)
             return
-        if self.target_ids and uid not in self.target_ids:
-            log.debug("[DROP] uid=%s not in target set", uid)
+
+        if typ == "gathering":
+            self._dispatch_gathering(uid, content)
             return
 
+        self.prefetcher.record_display((uid,), content.get("location") if typ == "friend-location" else None)
         name = self.api.display_name(uid) or uid
+        ev: dict = {"displayName": name}
 
         if typ == "friend-online":
-            notify("VRChat", f"{name} がオンラインになりました")  # ← f-string 修正
-            print(Fore.GREEN + f"[ONLINE] {name} ({uid})" + Style.RESET_ALL)
+            self._enqueue(self.notifier, typ, uid, ("VRChat", f"{name} がオンラインになりました"))
+            self._print(Fore.GREEN + f"[ONLINE] {name} ({uid})" + Style.RESET_ALL)
 
         elif typ == "friend-offline":
-            notify("VRChat", f"{name} がオフラインになりました")
-            print(Fore.RED + f"[OFFLINE] {name} ({uid})" + Style.RESET_ALL)
+            self._enqueue(self.notifier, typ, uid, ("VRChat", f"{name} がオフラインになりました"))
+            self._print(Fore.RED + f"[OFFLINE] {name} ({uid})" + Style.RESET_ALL)
+
+        elif typ == "friend-location":
+            loc_raw = content.get("location", "")
+            world, loc = self.api.describe_location(loc_raw)
+            ev.update(location=loc_raw, world=world, instance=loc.instance_key,
+                      access=loc.access, region=loc.region)
+            self._enqueue(self.notifier, typ, uid, ("VRChat", f"{name} が移動: {world}"))
+            self._print(Back.LIGHTYELLOW_EX + Fore.BLACK + f"[MOVE] {name} ({uid}) -> {world}" + Style.RESET_ALL)
 
-        elif typ == "friend-location":  # ← ここも typ
-            loc_raw = (content or {}).get("location", "")
-            world = self.api.parse_location_to_world(loc_raw)
-            notify("VRChat", f"{name} が移動: {world}")
-            print(Back.LIGHTYELLOW_EX + Fore.BLACK + f"[MOVE] {name} ({uid}) -> {world}" + Style.RESET_ALL)
+        elif typ == "friend-add":
+            self._enqueue(self.notifier, typ, uid, ("VRChat", f"{name} とフレンドになりました"))
+            self._print(Fore.CYAN + f"[FRIEND+] {name} ({uid})" + Style.RESET_ALL)
+
+        elif typ == "friend-delete":
+            self._print(Fore.MAGENTA + f"[FRIEND-] {name} ({uid})" + Style.RESET_ALL)
+
+        elif typ == "friend-active":
+            log.debug("[ACTIVE] %s (%s)", name, uid)
 
         elif typ == "friend-update":
-            new_status = (content or {}).get("status")
-            status_desc = (content or {}).get("statusDescription", "")
+            new_status = content.get("status")
+            status_desc = content.get("statusDescription", "")
             disp_status = new_status or "unknown"  # クォート崩れ防止
-            notify("VRChat", f"{name}のステータス更新: {disp_status}")
+            ev.update(status=disp_status, statusDescription=status_desc)
+            self._enqueue(self.notifier, typ, uid, ("VRChat", f"{name}のステータス更新: {disp_status}"))
             color = status_color(new_status)
             prefix = Back.LIGHTYELLOW_EX + Fore.BLACK + "[UPDATE] " + Style.RESET_ALL
             status_part = Back.LIGHTYELLOW_EX + color + f" status={disp_status}" + Style.RESET_ALL
             desc_part = f" desc={status_desc}" if status_desc else ""
-            print(prefix + f"{name} ({uid}) " + status_part + desc_part)
+            self._print(prefix + f"{name} ({uid}) " + status_part + desc_part)
+
+        self.events.append(typ, uid, **ev)
+
+    def _dispatch_gathering(self, instance_key: str, content: dict) -> None:
+        self.prefetcher.record_display(content["friends"], content["location"])
+        world, loc = self.api.describe_location(content["location"])
+        names = [self.api.display_name(u) or u for u in content["friends"]]
+        msg = f"{world} に {len(names)} 人集まっています: " + ", ".join(names)
+        self._enqueue(self.notifier, "gathering", instance_key, ("VRChat", msg))
+        self._print(Back.CYAN + Fore.BLACK + f"[GATHER] {msg}" + Style.RESET_ALL)
+        self.events.append("gathering", None, instance=instance_key, world=world,
+                           location=loc.raw, friends=content["friends"])